@@ -1,16 +1,18 @@
-from flask import Flask, render_template
-from app.routes.auth import auth_bp
-from app.routes.inbox import inbox_bp
-from app.routes.profiles import profiles_bp
-from app import firebase  # Firebase setup (db, auth)
 import os
 
+from flask import Flask, render_template
+
+
 def create_app():
+    # ⚙️ Environment is loaded once, here, instead of in every module
+    from dotenv import load_dotenv
+    load_dotenv()
+
     app = Flask(__name__)
     #os.makedirs('static/avatars', exist_ok=True)
     
     # 🔐 Secret key for sessions
-    app.secret_key = os.getenv("SECRET_KEY", "fallback_key")
+    app.secret_key = os.getenv("SECRET_KEY") or os.getenv("FLASK_SECRET_KEY", "fallback_key")
 
     # ⚙️ Session config
     app.config.update({
@@ -20,10 +22,62 @@ def create_app():
         'PERMANENT_SESSION_LIFETIME': 3600  # 1 hour
     })
 
-    # 📦 Register Blueprints
+    # 📥 Inbox paging
+    app.config['INBOX_PAGE_SIZE'] = int(os.getenv("INBOX_PAGE_SIZE", 50))
+
+    # 🔎 Username typeahead
+    app.config['USERNAME_SEARCH_MIN_PREFIX'] = int(os.getenv("USERNAME_SEARCH_MIN_PREFIX", 1))
+    app.config['USERNAME_SEARCH_MAX'] = int(os.getenv("USERNAME_SEARCH_MAX", 20))
+
+    # 📜 Chat history paging
+    app.config['CHAT_PAGE_SIZE'] = int(os.getenv("CHAT_PAGE_SIZE", 50))
+    app.config['CHAT_HISTORY_MAX_PAGE'] = int(os.getenv("CHAT_HISTORY_MAX_PAGE", 200))
+    app.config['CHAT_SEND_MAX_BATCH'] = int(os.getenv("CHAT_SEND_MAX_BATCH", 100))
+
+    # 🍪 Server-side sessions (SESSION_BACKEND=memory|sqlite): the cookie is just an id
+    from app.services import sessions
+    sessions.init_app(app)
+
+    # 🔐 CORS: allow only trusted frontend origins
+    from flask_cors import CORS
+    origins = os.getenv("CORS_ORIGINS", "https://your-frontend.example.com,http://localhost:3000")
+    CORS(
+        app,
+        resources={r"/auth/*": {"origins": [o.strip() for o in origins.split(',') if o.strip()]}},
+        supports_credentials=True
+    )
+
+    # 📈 Request timing, backend/HTTP/template breakdown and /metrics
+    from app.services import metrics
+    metrics.init_app(app)
+
+    # 🧵 Independent backend reads run concurrently; a stuck read becomes a 504
+    from app.services import fetch
+    fetch.init_app(app)
+
+    # 🗜️ gzip/brotli for HTML, JSON and msgpack bodies
+    app.config['COMPRESS_RESPONSES'] = os.getenv("COMPRESS_RESPONSES", "1") != "0"
+    from app.services import compression
+    compression.init_app(app)
+
+    # 📦 Register Blueprints (Firebase/Cloudinary clients are built lazily on first use)
+    from app.routes.auth import auth_bp
+    from app.routes.inbox import inbox_bp
+    from app.routes.profiles import profiles_bp
+    from app.routes.maintenance import maintenance_bp
+    from app.routes.metrics import metrics_bp
+    from app.routes.friends import friends_bp
+    from app.routes.video import video_bp
+    from app.routes.presence import presence_bp
+
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(inbox_bp)
     app.register_blueprint(profiles_bp, url_prefix='/profile')
+    app.register_blueprint(maintenance_bp)
+    app.register_blueprint(metrics_bp)
+    app.register_blueprint(friends_bp)
+    app.register_blueprint(video_bp)
+    app.register_blueprint(presence_bp)
 
     # 🏠 Optional: Home route
     @app.route("/")
@@ -31,6 +85,3 @@ def create_app():
         return render_template("home.html")
 
     return app
-
-# 👇 This line makes Flask CLI and IDEs recognize the app instance
-app = create_app()
@@ -1,50 +1,127 @@
 # app/firebase.py
+#
+# Shared service registry. Nothing here talks to Google or Cloudinary at
+# import time: each client is built on first use, once per process, and then
+# shared by every blueprint. This keeps serverless cold starts cheap.
 
 import os
-from dotenv import load_dotenv
-load_dotenv()
-
-import firebase_admin
-from firebase_admin import credentials, auth, storage
-from google.cloud import firestore
-from google.oauth2.service_account import Credentials as GoogleCredentials
-
-# 🔐 Load environment variables
-private_key = os.environ.get("FIREBASE_PRIVATE_KEY")
-project_id = os.environ.get("FIREBASE_PROJECT_ID")
-client_email = os.environ.get("FIREBASE_CLIENT_EMAIL")
-storage_bucket = os.environ.get("FIREBASE_STORAGE_BUCKET")
-
-# 🔍 Validate required variables
-required_vars = [private_key, project_id, client_email, storage_bucket]
-if not all(required_vars):
-    raise ValueError("Missing one or more required Firebase environment variables")
-
-# 🧾 Shared credential dict
-firebase_creds_dict = {
-    "type": "service_account",
-    "project_id": project_id,
-    "private_key_id": os.environ.get("FIREBASE_PRIVATE_KEY_ID"),
-    "private_key": private_key.replace("\\n", "\n"),
-    "client_email": client_email,
-    "client_id": os.environ.get("FIREBASE_CLIENT_ID"),
-    "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-    "token_uri": "https://oauth2.googleapis.com/token",
-    "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-    "client_x509_cert_url": os.environ.get("FIREBASE_CLIENT_CERT_URL")
-}
-
-# 🚀 Initialize Firebase Admin SDK
-firebase_cred = credentials.Certificate(firebase_creds_dict)
-if not firebase_admin._apps:
-    firebase_admin.initialize_app(firebase_cred, {
-        'storageBucket': storage_bucket
-    })
-
-# ✅ Initialize Firestore with Google-auth credentials
-google_cred = GoogleCredentials.from_service_account_info(firebase_creds_dict)
-db = firestore.Client(credentials=google_cred, project=project_id)
+import threading
+
+_services = {}
+_lock = threading.Lock()
+
+
+def _service(name, factory):
+    svc = _services.get(name)
+    if svc is None:
+        with _lock:
+            svc = _services.get(name)
+            if svc is None:
+                svc = _services[name] = factory()
+    return svc
+
+
+def _creds_dict():
+    # 🔐 Load environment variables
+    private_key = os.environ.get("FIREBASE_PRIVATE_KEY")
+    project_id = os.environ.get("FIREBASE_PROJECT_ID")
+    client_email = os.environ.get("FIREBASE_CLIENT_EMAIL")
+    storage_bucket = os.environ.get("FIREBASE_STORAGE_BUCKET")
+
+    # 🔍 Validate required variables
+    required_vars = [private_key, project_id, client_email, storage_bucket]
+    if not all(required_vars):
+        raise ValueError("Missing one or more required Firebase environment variables")
+
+    # 🧾 Shared credential dict
+    return {
+        "type": "service_account",
+        "project_id": project_id,
+        "private_key_id": os.environ.get("FIREBASE_PRIVATE_KEY_ID"),
+        "private_key": private_key.replace("\\n", "\n"),
+        "client_email": client_email,
+        "client_id": os.environ.get("FIREBASE_CLIENT_ID"),
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token",
+        "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
+        "client_x509_cert_url": os.environ.get("FIREBASE_CLIENT_CERT_URL")
+    }
+
+
+# 🚀 Firebase Admin SDK
+def _init_firebase_app():
+    import firebase_admin
+    from firebase_admin import credentials
+
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(credentials.Certificate(_creds_dict()), {
+            'storageBucket': os.environ.get("FIREBASE_STORAGE_BUCKET")
+        })
+    return firebase_admin.get_app()
+
+
+def get_firebase_app():
+    return _service('firebase_app', _init_firebase_app)
+
+
+def get_auth():
+    get_firebase_app()
+    from firebase_admin import auth as firebase_auth
+    return firebase_auth
+
+
+# ✅ Firestore with Google-auth credentials (or the emulator when configured)
+def _init_db():
+    from google.cloud import firestore
+
+    if os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        return firestore.Client(project=os.environ.get("FIREBASE_PROJECT_ID", "demo-securechat"))
+
+    from google.oauth2.service_account import Credentials as GoogleCredentials
+    creds_dict = _creds_dict()
+    google_cred = GoogleCredentials.from_service_account_info(creds_dict)
+    return firestore.Client(credentials=google_cred, project=creds_dict["project_id"])
+
+
+def get_db():
+    return _service('db', _init_db)
+
+
+def get_bucket():
+    get_firebase_app()
+    from firebase_admin import storage
+    return _service('bucket', storage.bucket)
+
+
+# 🖼️ Cloudinary (configured once, on first upload)
+def _init_cloudinary():
+    import cloudinary
+    import cloudinary.uploader
+
+    cloudinary.config(
+        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+        api_key=os.getenv("CLOUDINARY_API_KEY"),
+        api_secret=os.getenv("CLOUDINARY_API_SECRET")
+    )
+    return cloudinary.uploader
+
+
+def get_uploader():
+    return _service('cloudinary', _init_cloudinary)
+
+
+class _Lazy:
+    """Attribute proxy so `from app.firebase import db` keeps working without building db at import."""
+
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
 
 # ✅ Expose Firebase services
-bucket = storage.bucket()
-__all__ = ['db', 'auth', 'bucket']
+db = _Lazy(get_db)
+auth = _Lazy(get_auth)
+bucket = _Lazy(get_bucket)
+__all__ = ['db', 'auth', 'bucket', 'get_db', 'get_auth', 'get_bucket', 'get_uploader']
@@ -0,0 +1,90 @@
+"""
+A call between two users while the signaling service is tracking it.
+
+Calls live in process memory from the first offer until they end; only
+the finished record (to_record) is written to the store.
+"""
+import secrets
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+KINDS = ('audio', 'video')
+
+RINGING = 'ringing'
+ACTIVE = 'active'
+
+# How a call ended (the `outcome` of its stored record)
+COMPLETED = 'completed'  # answered, then hung up
+MISSED = 'missed'        # rang out
+DECLINED = 'declined'    # callee said no
+CANCELLED = 'cancelled'  # caller hung up while it rang
+DROPPED = 'dropped'      # a party vanished (no event stream) mid-call
+
+
+class Call:
+    __slots__ = ('id', 'caller', 'callee', 'kind', 'state', 'created_at', 'started', 'ring_deadline',
+                 'answered_at', 'answer_seconds', 'ended_at', 'outcome', 'ended_by', 'candidates')
+
+    def __init__(self, caller, callee, kind, ring_seconds):
+        self.id = secrets.token_urlsafe(16)
+        self.caller = caller
+        self.callee = callee
+        self.kind = kind
+        self.state = RINGING
+        self.created_at = datetime.now(timezone.utc)
+        self.started = time.monotonic()
+        self.ring_deadline = self.started + ring_seconds
+        self.answered_at = None
+        self.answer_seconds = None
+        self.ended_at = None
+        self.outcome = None
+        self.ended_by = None
+        self.candidates = Counter()  # uid -> ICE candidates relayed so far
+
+    @property
+    def live(self):
+        return self.outcome is None
+
+    def has(self, uid):
+        return uid in (self.caller, self.callee)
+
+    def peer(self, uid):
+        return self.callee if uid == self.caller else self.caller
+
+    def answer(self):
+        self.state = ACTIVE
+        self.answered_at = datetime.now(timezone.utc)
+        self.answer_seconds = time.monotonic() - self.started
+
+    def end(self, outcome, by=None):
+        self.outcome = outcome
+        self.ended_by = by
+        self.ended_at = datetime.now(timezone.utc)
+
+    def summary(self):
+        """What clients see in events and responses."""
+        return {
+            'call_id': self.id,
+            'caller': self.caller,
+            'callee': self.callee,
+            'kind': self.kind,
+            'state': self.outcome or self.state,
+        }
+
+    def to_record(self):
+        """The stored call record (no SDP or candidates, those were only relayed)."""
+        return {
+            'caller': self.caller,
+            'callee': self.callee,
+            'participants': [self.caller, self.callee],
+            'kind': self.kind,
+            'outcome': self.outcome,
+            'ended_by': self.ended_by,
+            'created_at': self.created_at,
+            'answered_at': self.answered_at,
+            'ended_at': self.ended_at,
+            'answer_ms': round(self.answer_seconds * 1000, 1) if self.answer_seconds is not None else None,
+            'duration_seconds': round((self.ended_at - self.answered_at).total_seconds(), 1)
+                                if self.answered_at and self.ended_at else 0,
+        }
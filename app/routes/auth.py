@@ -1,26 +1,20 @@
-from dotenv import load_dotenv
-load_dotenv()
-
 import os, secrets, json
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, jsonify
-from google.cloud import firestore
-from google.protobuf.timestamp_pb2 import Timestamp
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, abort, jsonify, current_app, Response, stream_with_context, make_response
 from werkzeug.utils import secure_filename
+import msgpack
 import requests
-import cloudinary
-import cloudinary.uploader
 from datetime import datetime, timezone
 
 from app import firebase
-from app.firebase import db, auth
+from app.firebase import auth
+from app.storage import get_store
+from app.storage.base import USERNAME_RE, username_key
 from ..services.auth_service import verify_user, add_user
-
-# 🔐 Cloudinary config
-cloudinary.config(
-    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-    api_key=os.getenv("CLOUDINARY_API_KEY"),
-    api_secret=os.getenv("CLOUDINARY_API_SECRET")
-)
+from ..services.conversation_service import conversation_id
+from ..services.message_service import KeyRing, history_page, encode_cursor, decode_cursor, build_message
+from ..services import live_feed
+from ..services import profile_cache, auth_client, metrics, avatar_uploads, http_cache, fetch, sessions, friends
+from ..services import presence
 
 API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
 if not API_KEY:
@@ -32,7 +26,6 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
-db_client = db
 
 # 🔐 CSRF utilities
 def require_login():
@@ -70,34 +63,54 @@ def signup():
         flash('Missing fields', 'error')
         return redirect(url_for('auth.signup'))
 
+    username = username.strip()
+    if not USERNAME_RE.match(username):
+        return render_template('signup.html', csrf_token=get_or_create_csrf(),
+                               error="Username must be 3-32 letters, numbers, '.', '_' or '-'")
+
+    # 🏷️ Usernames are unique case-insensitively; cheap pre-check before creating the account
+    store = get_store()
+    name_key = username_key(username)
+    if store.usernames.lookup(name_key):
+        return render_template('signup.html', csrf_token=get_or_create_csrf(), error="Username is already taken")
+
     try:
-        user = auth.create_user(email=email, password=password)
+        with metrics.timed_external('identity_toolkit'):
+            user = auth.create_user(email=email, password=password)
 
-        photo_url = ''
+        # The reservation is the real uniqueness check (two signups can race past the pre-check)
+        if not store.usernames.reserve(name_key, user.uid):
+            with metrics.timed_external('identity_toolkit'):
+                auth.delete_user(user.uid)
+            return render_template('signup.html', csrf_token=get_or_create_csrf(), error="Username is already taken")
+
+        # 🖼️ Read the image now (the upload itself runs after the response)
+        avatar_bytes = None
         if avatar and allowed_file(avatar.filename):
-            safe_filename = secure_filename(avatar.filename)
-            public_id = f"{user.uid}_{safe_filename.rsplit('.', 1)[0]}"
-            upload_result = cloudinary.uploader.upload(
-                avatar,
-                folder="avatars",
-                public_id=public_id,
-                transformation={"width": 128, "height": 128, "crop": "fill"}
-            )
-            photo_url = upload_result.get("secure_url", "")
+            avatar_bytes = avatar.read(avatar_uploads.MAX_BYTES + 1)
+            if len(avatar_bytes) > avatar_uploads.MAX_BYTES:
+                flash('Avatar is too large; you can add one later.', 'warning')
+                avatar_bytes = None
 
         profile_data = {
             'email': email,
             'username': username,
             'display_name': username,
-            'photo_url': photo_url,
+            'photo_url': '',
+            'avatar_status': 'pending' if avatar_bytes else 'none',
             'public_key': public_key,
-            'public_key_format': 'curve25519_base64',
-            'created_at': firestore.SERVER_TIMESTAMP
+            'public_key_format': 'curve25519_base64'
         }
-        db.collection('profiles').document(user.uid).set(profile_data)
+        store.profiles.create(user.uid, profile_data)
+        profile_cache.invalidate(user.uid, username=username)
+
+        if avatar_bytes:
+            safe_filename = secure_filename(avatar.filename)
+            avatar_uploads.submit(user.uid, avatar_bytes, f"{user.uid}_{safe_filename.rsplit('.', 1)[0]}")
 
         try:
-            link = firebase.auth.generate_email_verification_link(email)
+            with metrics.timed_external('identity_toolkit'):
+                link = firebase.auth.generate_email_verification_link(email)
             print("📧 EMAIL VERIFICATION LINK:", link)
         except Exception as link_error:
             print("⚠️ Email verification link error:", link_error)
@@ -117,19 +130,21 @@ def login():
 
     email    = request.form.get('email')
     password = request.form.get('password')
-    payload  = {
-        "email": email,
-        "password": password,
-        "returnSecureToken": True
-    }
 
-    url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={API_KEY}"
-    response = requests.post(url, json=payload)
-    data = response.json()
+    try:
+        data = auth_client.sign_in_with_password(API_KEY, email, password)
+    except requests.RequestException as e:
+        print("❌ Sign-in request failed:", e)
+        data = {'error': {'message': 'Sign-in service unavailable'}}
 
     if "idToken" in data:
         id_token = data["idToken"]
-        decoded = firebase.auth.verify_id_token(id_token, clock_skew_seconds=5)
+        try:
+            decoded = auth_client.verify_id_token(id_token)
+        except auth_client.AuthError as e:
+            flash(f"Login failed: {e}", 'danger')
+            return render_template('login.html')
+        sessions.rotate(session)
         session['id_token'] = id_token
         session['user_id'] = decoded['uid']
         get_or_create_csrf()
@@ -148,23 +163,115 @@ def logout():
 
 @auth_bp.route('/profile/<user_id>')
 def profile(user_id):
-    doc = db.collection('profiles').document(user_id).get()
-    if not doc.exists:
+    profile = profile_cache.get_profile(user_id)
+    if profile is None:
         abort(404)
-    profile = doc.to_dict()
     return render_template('profile.html', profile=profile)
 
+# 🔑 Replace the caller's published public key (e.g. after a device reset)
+@auth_bp.route('/public-key', methods=['POST'])
+def update_public_key():
+    me_id = require_login()
+    verify_csrf()
+    data = request.get_json(silent=True) or {}
+    public_key = data.get('public_key')
+    if not public_key:
+        abort(400, description="Missing public_key")
+
+    profile_cache.update_profile(me_id, {
+        'public_key': public_key,
+        'public_key_format': data.get('public_key_format', 'curve25519_base64')
+    })
+    return jsonify({'status': 'ok'})
+
+def _send_messages(me_id, other_id, envelopes):
+    """Validate and store a list of client envelopes; aborts on any bad entry."""
+    max_batch = current_app.config.get('CHAT_SEND_MAX_BATCH', 100)
+    if not envelopes or len(envelopes) > max_batch:
+        abort(400, description=f"Send between 1 and {max_batch} messages")
+
+    keys = {}
+    try:
+        messages = [build_message(data, me_id, keys) for data in envelopes]
+    except ValueError as e:
+        abort(400, description=str(e))
+
+    if profile_cache.get_profile(other_id) is None:
+        abort(404)
+
+    convo_id = conversation_id(me_id, other_id)
+    written = get_store().messages.add_batch(convo_id, [me_id, other_id], me_id, messages, keys=keys)
+    presence.clear_typing(convo_id, me_id)
+    return written
+
+# 📦 msgpack bodies carry v2 envelopes as raw bytes; JSON stays the default
+MSGPACK = 'application/msgpack'
+
+def _request_payload():
+    if request.mimetype in (MSGPACK, 'application/x-msgpack'):
+        try:
+            return msgpack.unpackb(request.get_data(), raw=False)
+        except Exception:
+            abort(400, description="Invalid msgpack")
+    try:
+        return request.get_json(force=True)
+    except Exception:
+        abort(400, description="Invalid JSON")
+
+def _wants_msgpack():
+    return request.accept_mimetypes.best_match(['application/json', MSGPACK]) == MSGPACK
+
+def _mark_read(store, convo_id, me_id):
+    """Clear my unread count; the session's read mark lets the inbox drop cached badges."""
+    store.conversations.mark_read(convo_id, me_id)
+    session['read_mark'] = secrets.token_hex(4)
+
+def _seen_at(convo, me_id, other_id):
+    """When the peer read my latest message (None if it is unread or theirs)."""
+    if convo.get('last_sender') != me_id or not convo.get('last_message_at'):
+        return None
+    peer_read = (convo.get('last_read_at') or {}).get(other_id)
+    return peer_read if peer_read and peer_read >= convo['last_message_at'] else None
+
+def _profile_version(profile):
+    """Fingerprint of the peer fields the chat page renders."""
+    return tuple(profile.get(k) for k in ('display_name', 'username', 'photo_url', 'public_key', 'public_key_format'))
+
 @auth_bp.route('/chat/<other_id>', methods=['GET', 'POST'])
 def chat(other_id):
     me_id = require_login()
     csrf_token = get_or_create_csrf()
 
-    # 🔍 Get other user's profile
-    other_doc = db.collection('profiles').document(other_id).get()
-    if not other_doc.exists:
+    # 📨 Handle message send (no conversation pre-read)
+    if request.method == 'POST':
+        verify_csrf()
+        data = _request_payload()
+
+        msg_id, _ = _send_messages(me_id, other_id, [data])[0]
+        return jsonify({'status': 'ok', 'id': msg_id})
+
+    # 🔍 Peer profile and conversation summary are independent: read them together.
+    # Unless the client can revalidate, the first page of messages is read
+    # alongside too; its KeyRing waits on the conversation read for sender keys.
+    store = get_store()
+    convo_id = conversation_id(me_id, other_id)
+    page_size = current_app.config.get('CHAT_PAGE_SIZE', 50)
+    # The live stream resumes from just before the read so nothing falls in the gap
+    live_cursor = encode_cursor(datetime.now(timezone.utc), '')
+
+    other_read = fetch.submit(profile_cache.get_profile, other_id)
+    convo_read = fetch.submit(store.conversations.get, convo_id)
+    friends_read = fetch.submit(friends.get_friends, me_id)
+    history_read = None
+    if not request.if_none_match and not session.get('_flashes'):
+        keys = KeyRing(store, convo_id, load=lambda: fetch.result(convo_read))
+        archived = lambda: bool((fetch.result(convo_read) or {}).get('archive_chunks'))
+        history_read = fetch.submit(history_page, store, convo_id, limit=page_size, keys=keys, archived=archived)
+
+    other = fetch.result(other_read)
+    if other is None:
         abort(404)
-    other = other_doc.to_dict()
-    other['uid'] = other_doc.id
+    other['uid'] = other_id
     other['username'] = other.get('display_name') or other.get('username') or 'Unknown'
     other['photo_url'] = other.get('photo_url', '')
 
@@ -172,101 +279,36 @@ def chat(other_id):
     recipient_format = other.get('public_key_format', '')
 
     # 🔐 Ensure conversation exists
-    convo_id = '_'.join(sorted([me_id, other_id]))
-    convo_ref = db.collection('conversations').document(convo_id)
-    if not convo_ref.get().exists:
-        convo_ref.set({
-            'participants': [me_id, other_id],
-            'created_at': firestore.SERVER_TIMESTAMP
-        })
-
-    msgs_ref = convo_ref.collection('messages')
-
-    # 📨 Handle message send
-    if request.method == 'POST':
-        verify_csrf()
-        try:
-            data = request.get_json(force=True)
-        except Exception:
-            abort(400, description="Invalid JSON")
-
-        required = ('ciphertext', 'nonce', 'sender_pub', 'scheme')
-        if not all(k in data for k in required):
-            abort(400, description="Missing fields")
-
-        ephemeral = data.get("ephemeral", False)
-        expires_raw = data.get("expiresAt")
-
-        if ephemeral:
-            if not isinstance(expires_raw, (int, float)):
-                abort(400, description="Missing or invalid expiresAt for ephemeral message")
-            expires_ts = datetime.fromtimestamp(expires_raw / 1000, tz=timezone.utc)
-        else:
-            expires_ts = None
-
-
-        message = {
-        "ciphertext": data["ciphertext"],
-        "nonce": data["nonce"],
-        "from": me_id,
-        "sender_pub": data["sender_pub"],
-        "scheme": data.get("scheme", "nacl-secretbox-x25519"),
-        "created_at": firestore.SERVER_TIMESTAMP,
-        "ephemeral": ephemeral,
-        }
-        if expires_ts:
-            message["expiresAt"] = expires_ts
-
-        msgs_ref.add(message)
-        return jsonify({'status': 'ok'})
-
-# 📜 Serialize messages
-    now = datetime.now(timezone.utc)
-
-    # Non-ephemeral messages
-    non_ephemeral = msgs_ref.where("ephemeral", "==", False).order_by("created_at").stream()
-
-    # Ephemeral messages that haven't expired (explicit index match)
-    try: active_ephemeral = msgs_ref.order_by("ephemeral")\
-                           .where("ephemeral", "==", True)\
-                           .where("expiresAt", ">", now)\
-                           .order_by("expiresAt")\
-                           .order_by("created_at")\
-                           .stream()
-                                                 
-    except Exception as e:
-        print("⚠️ Firestore index error:", e)
-        active_ephemeral = []
-
-
-    # Combine both
-    raw_messages = list(non_ephemeral) + list(active_ephemeral)
-
-    # Optional: sort combined messages by created_at
-    raw_messages.sort(key=lambda doc: doc.to_dict().get("created_at") or datetime.min)
-
-    def clean_message(msg, doc_id):
-        return {
-            "id": doc_id,
-            "ciphertext": msg.get("ciphertext"),
-            "nonce": msg.get("nonce"),
-            "from": msg.get("from"),
-            "sender_pub": msg.get("sender_pub"),
-            "scheme": msg.get("scheme"),
-            "ephemeral": msg.get("ephemeral", False),
-            "timestamp": msg.get("created_at").strftime('%Y-%m-%dT%H:%M:%SZ') if msg.get("created_at") else '',
-            "expiresAt": msg.get("expiresAt").isoformat() if isinstance(msg.get("expiresAt"), datetime) else None
-        }
-
-
-    messages = []
-    for doc in raw_messages:
-        msg = doc.to_dict()
-        expires = msg.get('expiresAt')
-        if msg.get("ephemeral") and isinstance(expires, datetime) and expires < now:
-            continue
-        messages.append(clean_message(msg, doc.id))
-
+    convo = fetch.result(convo_read)
+    if convo is None:
+        store.conversations.ensure(convo_id, [me_id, other_id])
+        convo = {}
+
+    # 👁️ Opening the chat reads it: one write, and only when there is something to clear
+    if (convo.get('unread') or {}).get(me_id):
+        _mark_read(store, convo_id, me_id)
+    seen_at = _seen_at(convo, me_id, other_id)
+    friend_states = fetch.result(friends_read)
+
+    # 🏷️ Unchanged conversation (and peer profile): 304 without touching the messages
+    etag = http_cache.make_etag('chat', *http_cache.session_parts(), convo_id, convo.get('last_message_at'),
+                                convo.get('message_count'), seen_at, page_size, _profile_version(other),
+                                sorted(friend_states.items()))
+    if http_cache.is_fresh(etag):
+        return http_cache.not_modified(etag, convo.get('last_message_at'))
+
+    # 📜 Latest page of history; older pages come from chat_history
+    if history_read is not None:
+        messages, history_cursor = fetch.result(history_read)
+    else:
+        messages, history_cursor = history_page(store, convo_id, limit=page_size,
+                                                keys=KeyRing(store, convo_id, convo.get('keys')),
+                                                archived=bool(convo.get('archive_chunks')))
+
+    # 🤝 Sidebar: accepted friends (profiles from the cache, one batched read for misses)
+    friend_ids = sorted(uid for uid, state in friend_states.items() if state == 'friends')
+    friend_profiles = profile_cache.get_profiles(friend_ids)
+    friend_list = [dict(friend_profiles[uid], uid=uid) for uid in friend_ids if uid in friend_profiles]
 
     firebase_config = {
         "apiKey": os.getenv("FIREBASE_WEB_API_KEY"),
@@ -276,9 +318,8 @@ def chat(other_id):
         "messagingSenderId": os.getenv("FIREBASE_MESSAGING_SENDER_ID"),
         "appId": os.getenv("FIREBASE_APP_ID")
     }
-    print(f"Returning {len(messages)} messages")
 
-    return render_template(
+    response = make_response(render_template(
         'chat.html',
         convo_id=convo_id,
         current_user_id=me_id,
@@ -288,5 +329,114 @@ def chat(other_id):
         recipient_public_key_format=recipient_format,
         csrf_token=csrf_token,
         messages=messages,
+        history_cursor=history_cursor,
+        live_cursor=live_cursor,
+        seen_at=seen_at,
+        friends=friend_list,
+        friend_state=friend_states.get(other_id) or 'none',
         firebase_config=firebase_config
-    )
+    ))
+    return http_cache.finish(response, etag, convo.get('last_message_at'))
+
+@auth_bp.route('/chat/<other_id>/history')
+def chat_history(other_id):
+    me_id = require_login()
+
+    max_page = current_app.config.get('CHAT_HISTORY_MAX_PAGE', 200)
+    try:
+        limit = int(request.args.get('limit', current_app.config.get('CHAT_PAGE_SIZE', 50)))
+    except ValueError:
+        abort(400, description="Invalid limit")
+    limit = max(1, min(limit, max_page))
+
+    store = get_store()
+    convo_id = conversation_id(me_id, other_id)
+    binary = _wants_msgpack()
+
+    # 🏷️ Pages only change when the conversation does (new messages or reaped ones)
+    convo = store.conversations.get(convo_id) or {}
+    last_modified = convo.get('last_message_at')
+    etag = http_cache.make_etag('history', convo_id, last_modified, convo.get('message_count'),
+                                request.args.get('before'), limit, binary)
+    if http_cache.is_fresh(etag, last_modified, use_last_modified=True):
+        return http_cache.not_modified(etag, last_modified)
+
+    keys = KeyRing(store, convo_id, convo.get('keys'))
+    try:
+        messages, next_cursor = history_page(store, convo_id, before=request.args.get('before'), limit=limit,
+                                             keys=keys, binary=binary, archived=bool(convo.get('archive_chunks')))
+    except ValueError:
+        abort(400, description="Invalid cursor")
+
+    if binary:
+        # v2 envelopes: raw bytes, and each sender key once per page instead of once per message
+        body = {'messages': messages, 'keys': keys.table({m['kid'] for m in messages if m['kid']}),
+                'next_cursor': next_cursor}
+        response = Response(msgpack.packb(body, use_bin_type=True), mimetype=MSGPACK)
+    else:
+        response = jsonify({'messages': messages, 'next_cursor': next_cursor})
+    response.vary.add('Accept')
+    return http_cache.finish(response, etag, last_modified)
+
+# 📡 Live message stream (Server-Sent Events)
+@auth_bp.route('/chat/<other_id>/stream')
+def chat_stream(other_id):
+    me_id = require_login()
+    convo_id = conversation_id(me_id, other_id)
+
+    since = request.headers.get('Last-Event-ID') or request.args.get('after')
+    try:
+        since = decode_cursor(since) if since else None
+    except ValueError:
+        abort(400, description="Invalid cursor")
+
+    # 🟢 The open stream keeps me online; the peer's presence (and typing) goes out first
+    snapshot = [live_feed.signal_frame('presence', presence.status(other_id, profile_cache.get_profile(other_id)))]
+    if presence.is_typing(convo_id, other_id):
+        snapshot.append(live_feed.signal_frame('typing', {'uid': other_id, 'typing': True}))
+    stream = presence.tracked(me_id, live_feed.event_stream(get_store(), convo_id, since, (me_id, other_id)),
+                              snapshot)
+    return Response(stream_with_context(stream), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
+# ⌨️ Typing pings (throttled by the client, coalesced in memory, never stored)
+@auth_bp.route('/chat/<other_id>/typing', methods=['POST'])
+def chat_typing(other_id):
+    me_id = require_login()
+    verify_csrf()
+    data = request.get_json(silent=True) or {}
+    presence.typing(conversation_id(me_id, other_id), me_id, bool(data.get('typing', True)))
+    return '', 204
+
+# 👁️ Read marker for messages that arrived while the chat was open
+@auth_bp.route('/chat/<other_id>/read', methods=['POST'])
+def chat_read(other_id):
+    me_id = require_login()
+    verify_csrf()
+    _mark_read(get_store(), conversation_id(me_id, other_id), me_id)
+    return '', 204
+
+# 📦 Batched send: many pre-encrypted envelopes, one atomic write
+@auth_bp.route('/chat/<other_id>/messages', methods=['POST'])
+def chat_send_batch(other_id):
+    me_id = require_login()
+    verify_csrf()
+    data = _request_payload()
+    envelopes = data.get('messages') if isinstance(data, dict) else data
+    if not isinstance(envelopes, list):
+        abort(400, description="Expected a list of messages")
+    # A batch from one device may name its sender key once at the top level
+    if isinstance(data, dict) and 'sender_pub' in data:
+        envelopes = [dict(e, sender_pub=e.get('sender_pub', data['sender_pub'])) if isinstance(e, dict) else e
+                     for e in envelopes]
+
+    written = _send_messages(me_id, other_id, envelopes)
+    return jsonify({
+        'status': 'ok',
+        'messages': [
+            {'id': msg_id, 'created_at': created_at.isoformat() if created_at else None}
+            for msg_id, created_at in written
+        ]
+    })
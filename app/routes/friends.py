@@ -1,19 +1,59 @@
-from flask import Blueprint, request, session, redirect, url_for, abort
-from google.cloud import firestore
+from flask import Blueprint, jsonify, abort, url_for
+
+from app.routes.auth import require_login, verify_csrf
+from app.services import friends, profile_cache
 
-db = firestore.Client()
 friends_bp = Blueprint('friends', __name__)
 
-@friends_bp.route('/add_friend/<username>', methods=['POST'])
-def add_friend(username):
-    current_user = session.get('username')
-    if not current_user:
-        abort(403)
 
-    db.collection('friendships').add({
-        'from': current_user,
-        'to': username,
-        'timestamp': firestore.SERVER_TIMESTAMP
-    })
+def _not_self(me_id, other_id):
+    if other_id == me_id:
+        abort(400, description="Cannot befriend yourself")
+
+
+def _result(other_id, state):
+    return jsonify({'uid': other_id, 'status': state or 'none'})
+
+
+# 👥 Friend list: one adjacency read (cached) + one batched profile read
+@friends_bp.route('/friends')
+def list_friends():
+    me_id = require_login()
+    states = friends.get_friends(me_id)
+    profiles = profile_cache.get_profiles(list(states))
+    return jsonify({'friends': [{
+        'uid': uid,
+        'status': state,
+        'username': profiles[uid].get('username'),
+        'display_name': profiles[uid].get('display_name') or profiles[uid].get('username'),
+        'photo_url': profiles[uid].get('photo_url_small') or profiles[uid].get('photo_url', ''),
+        'chat_url': url_for('auth.chat', other_id=uid)
+    } for uid, state in sorted(states.items()) if uid in profiles]})
+
+
+# ➕ Request (idempotent; accepts if they already asked)
+@friends_bp.route('/friends/<other_id>', methods=['POST'])
+def add_friend(other_id):
+    me_id = require_login()
+    verify_csrf()
+    _not_self(me_id, other_id)
+    if profile_cache.get_profile(other_id) is None:
+        abort(404)
+    return _result(other_id, friends.request(me_id, other_id))
+
+
+@friends_bp.route('/friends/<other_id>/accept', methods=['POST'])
+def accept_friend(other_id):
+    me_id = require_login()
+    verify_csrf()
+    _not_self(me_id, other_id)
+    return _result(other_id, friends.accept(me_id, other_id))
+
 
-    return redirect(url_for('profiles', username=username))
+# ➖ Unfriend / cancel / decline
+@friends_bp.route('/friends/<other_id>', methods=['DELETE'])
+def remove_friend(other_id):
+    me_id = require_login()
+    verify_csrf()
+    _not_self(me_id, other_id)
+    return _result(other_id, friends.remove(me_id, other_id))
@@ -1,6 +1,7 @@
-from flask import Blueprint, render_template, session, redirect, url_for, flash, request
-from app.firebase import auth, db
-from firebase_admin import firestore
+from flask import Blueprint, render_template, session, redirect, url_for, flash, request, current_app, jsonify, make_response
+from app.routes.auth import get_or_create_csrf
+from app.services import profile_cache, http_cache, fetch, friends
+from app.storage import get_store
 from datetime import datetime
 import pytz
 
@@ -15,6 +16,30 @@ def format_timestamp(ts, tz='Asia/Manila'):
         print('Timestamp formatting failed:', ts, e)
         return 'Invalid time'
 
+def _inbox_etag(top, after, friend_states):
+    """
+    Validator from the user's most recently active conversation (id, time,
+    count) plus the session's last read marker (opening a chat clears a badge
+    that may sit below the top row) and the cached friend list.
+    """
+    top_id, top_data = top or (None, {})
+    latest = top_data.get('last_message_at')
+    etag = http_cache.make_etag('inbox', *http_cache.session_parts(), session.get('read_mark'), after,
+                                top_id, latest, top_data.get('message_count'), sorted(friend_states.items()))
+    return etag, latest
+
+def _search(query, me_id):
+    """Exact (case-insensitive) username lookup for the inbox search box."""
+    uid = profile_cache.find_uid_by_username(query) if query else None
+    data = profile_cache.get_profile(uid) if uid else None
+    if not data or uid == me_id:
+        return None
+    return {
+        'uid': uid,
+        'username': data.get('username'),
+        'photo_url': data.get('photo_url_small') or data.get('photo_url', '')
+    }
+
 @inbox_bp.route('/inbox', methods=['GET', 'POST'])
 def inbox_view():
     try:
@@ -22,76 +47,106 @@ def inbox_view():
         if not me_id:
             raise Exception("Missing user_id in session")
 
-        result = None
         query = None
+        search_read = None
+        # Created before the ETag is computed: the token is part of the rendered page
+        csrf_token = get_or_create_csrf()
 
-        # 🔍 Handle search
+        # 🔍 Handle search: runs alongside the inbox listing below
         if request.method == 'POST':
             query = request.form.get('username', '').strip().lower()
-            profiles_ref = db.collection('profiles')
-            results = profiles_ref.where('username', '==', query).stream()
-
-            for doc in results:
-                if doc.id != me_id:
-                    data = doc.to_dict()
-                    result = {
-                        'uid': doc.id,
-                        'username': data.get('username'),
-                        'photo_url': data.get('photo_url', '')
-                    }
-                    break
-
-        # 📥 Build inbox previews
-        conversations = []
-        convos_ref = db.collection('conversations').where('participants', 'array_contains', me_id)
-        convo_docs = convos_ref.stream()
+            search_read = fetch.submit(_search, query, me_id)
+
+        # 🤝 Friend states come from the cached adjacency list (one read on a miss)
+        friend_states = friends.get_friends(me_id)
+
+        # 🏷️ Nothing new since the client's copy: 304 from a one-conversation probe
+        store = get_store()
+        after = request.args.get('after')
+        etag = latest = None
+        if request.method == 'GET' and (request.if_none_match or after):
+            top, _ = store.conversations.list_for_user(me_id, 1)
+            etag, latest = _inbox_etag(top[0] if top else None, after, friend_states)
+            if http_cache.is_fresh(etag):
+                return http_cache.not_modified(etag, latest)
+
+        # 📥 Build inbox previews (one page, newest activity first)
+        page_size = current_app.config.get('INBOX_PAGE_SIZE', 50)
+        convo_rows, next_cursor = store.conversations.list_for_user(me_id, page_size, after=after)
+        if request.method == 'GET' and etag is None:
+            # First page: its newest row is what the probe would have returned
+            etag, latest = _inbox_etag(convo_rows[0] if convo_rows else None, after, friend_states)
 
-        for convo in convo_docs:
-            data = convo.to_dict()
+        rows = []
+        for convo_id, data in convo_rows:
             participants = data.get('participants', [])
             other_id = next((uid for uid in participants if uid != me_id), None)
-            if not other_id:
-                continue
+            if other_id:
+                rows.append((convo_id, other_id, data))
 
-            # 🔍 Get other user's profile
-            profile_doc = db.collection('profiles').document(other_id).get()
-            profile = profile_doc.to_dict() if profile_doc.exists else {}
+        # 👥 Fetch every peer profile in batched reads (cache first, large pages split concurrently)
+        profiles = profile_cache.get_profiles([other_id for _, other_id, _ in rows])
+
+        conversations = []
+        for convo_id, other_id, data in rows:
+            profile = profiles.get(other_id, {})
             other_username = profile.get('display_name') or profile.get('username') or 'Unknown'
 
-            # 🔐 Get last message
-            convo_id = '_'.join(sorted([me_id, other_id]))
-            messages_ref = db.collection('conversations').document(convo_id).collection('messages') \
-                             .order_by('created_at', direction=firestore.Query.DESCENDING).limit(1)
-            last_msg_docs = messages_ref.stream()
-            last_msg = next(last_msg_docs, None)
-
-            preview = '[Redacted]'
-            timestamp = None
-            timestamp_str = ''
-            if last_msg:
-                msg_data = last_msg.to_dict()
-                timestamp = msg_data.get('created_at')
-                if timestamp:
-                    timestamp_str = format_timestamp(timestamp)
+            timestamp = data.get('last_message_at')
+            timestamp_str = format_timestamp(timestamp) if timestamp else ''
+
+            # Counters live on the conversation row: no extra read per badge. Expired
+            # (reaped) messages can leave a count above what is left to read.
+            unread = min((data.get('unread') or {}).get(me_id, 0), data.get('message_count', 0))
 
             conversations.append({
                 'other_id': other_id,
                 'other_username': other_username,
-                'preview': preview,
+                'preview': '[Redacted]' if timestamp else '',
                 'timestamp': timestamp,
                 'timestamp_str': timestamp_str,
-                'photo_url': profile.get('photo_url', '')
+                'message_count': data.get('message_count', 0),
+                'unread': unread,
+                'friend_status': friend_states.get(other_id),
+                'photo_url': profile.get('photo_url_small') or profile.get('photo_url', '')
             })
 
-        # 🗂️ Sort conversations by timestamp (most recent first)
-        conversations.sort(key=lambda x: x['timestamp'], reverse=True)
+        result = fetch.result(search_read) if search_read else None
 
-        return render_template('inbox.html',
-                               result=result,
-                               query=query,
-                               conversations=conversations)
+        response = make_response(render_template('inbox.html',
+                                                 result=result,
+                                                 query=query,
+                                                 conversations=conversations,
+                                                 next_cursor=next_cursor,
+                                                 csrf_token=csrf_token))
+        return http_cache.finish(response, etag, latest) if etag else response
 
+    except fetch.FetchTimeout:
+        raise
     except Exception as e:
         flash("Session expired or invalid. Please log in again.")
         print(f"Inbox route error: {e}")
         return redirect(url_for('auth.login'))
+
+# 🔎 Typeahead: case-insensitive username prefix search
+@inbox_bp.route('/inbox/search')
+def search_users():
+    me_id = session.get('user_id')
+    if not me_id:
+        return jsonify({'error': 'Not logged in'}), 401
+
+    prefix = request.args.get('q', '').strip().lower()
+    if len(prefix) < current_app.config.get('USERNAME_SEARCH_MIN_PREFIX', 1):
+        return jsonify({'results': []})
+    limit = max(1, min(request.args.get('limit', 8, type=int), current_app.config.get('USERNAME_SEARCH_MAX', 20)))
+
+    # Ask for one extra so dropping ourselves still fills the list
+    rows = profile_cache.search_usernames(prefix, limit + 1)
+    results = [{
+        'uid': uid,
+        'username': data.get('username'),
+        'display_name': data.get('display_name') or data.get('username'),
+        'photo_url': data.get('photo_url_small') or data.get('photo_url', ''),
+        'chat_url': url_for('auth.chat', other_id=uid)
+    } for uid, data in rows if uid != me_id][:limit]
+    return jsonify({'results': results})
@@ -0,0 +1,140 @@
+import os
+import hmac
+
+import click
+from flask import Blueprint, request, abort, jsonify, current_app
+
+from app.storage import get_store
+from app.storage.base import username_key
+from ..services.reaper import reap_expired
+from ..services.archiver import MAX_CHUNK_SIZE, compact_archives
+from ..services import sessions
+
+maintenance_bp = Blueprint('maintenance', __name__, url_prefix='/internal')
+
+
+def verify_cron():
+    # Vercel cron sends "Authorization: Bearer <CRON_SECRET>"
+    secret = os.getenv("CRON_SECRET")
+    header = request.headers.get('Authorization', '')
+    if not secret or not hmac.compare_digest(header, f"Bearer {secret}"):
+        abort(403)
+
+
+# ⏰ Scheduled job: bounded so it fits inside a serverless invocation
+@maintenance_bp.route('/reap-messages', methods=['GET', 'POST'])
+def reap_messages():
+    verify_cron()
+    stats = reap_expired(get_store(), max_seconds=float(os.getenv("REAPER_MAX_SECONDS", 20)))
+    return jsonify(stats)
+
+
+# 🧹 CLI: flask maintenance reap-messages
+@maintenance_bp.cli.command('reap-messages')
+@click.option('--batch-size', default=100, show_default=True, help='Deletes per WriteBatch.')
+@click.option('--pause', default=0.2, show_default=True, help='Seconds to sleep between batches.')
+@click.option('--max-seconds', default=None, type=float, help='Stop after this long (resumable).')
+@click.option('--restart', is_flag=True, help='Ignore any saved checkpoint.')
+def reap_messages_command(batch_size, pause, max_seconds, restart):
+    """Delete expired ephemeral messages."""
+    stats = reap_expired(get_store(), batch_size=batch_size, pause=pause,
+                         max_seconds=max_seconds, resume=not restart)
+    click.echo(
+        f"Deleted {stats['deleted']} messages in {stats['batches']} batches "
+        f"({stats['deleted_per_second']}/s, {stats['elapsed_seconds']}s)"
+        + ("" if stats['complete'] else " — stopped early, rerun to resume")
+    )
+
+
+# 🗄️ Scheduled job: roll old history into archive chunks
+@maintenance_bp.route('/compact-messages', methods=['GET', 'POST'])
+def compact_messages():
+    verify_cron()
+    stats = compact_archives(get_store(), max_seconds=float(os.getenv("ARCHIVER_MAX_SECONDS", 20)))
+    return jsonify(stats)
+
+
+# 🗄️ CLI: flask maintenance compact-messages
+@maintenance_bp.cli.command('compact-messages')
+@click.option('--older-than-days', default=None, type=float, help='Archive persistent messages older than this (default ARCHIVE_AFTER_DAYS).')
+@click.option('--chunk-size', default=None, type=click.IntRange(1, MAX_CHUNK_SIZE),
+              help='Messages per archive chunk (default ARCHIVE_CHUNK_SIZE).')
+@click.option('--max-seconds', default=None, type=float, help='Stop after this long (resumable).')
+@click.option('--restart', is_flag=True, help='Ignore any saved checkpoint.')
+def compact_messages_command(older_than_days, chunk_size, max_seconds, restart):
+    """Compact old message history into archive chunks."""
+    options = {k: v for k, v in (('older_than_days', older_than_days), ('chunk_size', chunk_size)) if v is not None}
+    stats = compact_archives(get_store(), max_seconds=max_seconds, resume=not restart, **options)
+    click.echo(
+        f"Archived {stats['messages']} messages into {stats['chunks']} chunks "
+        f"across {stats['conversations']} conversations ({stats['elapsed_seconds']}s)"
+        + ("" if stats['complete'] else " — stopped early, rerun to resume")
+    )
+
+
+# 🏷️ CLI: flask maintenance backfill-usernames
+@maintenance_bp.cli.command('backfill-usernames')
+@click.option('--batch-size', default=300, show_default=True, help='Profiles per page.')
+def backfill_usernames_command(batch_size):
+    """Add username_lower and username reservations to profiles created before the index existed."""
+    store = get_store()
+    after = None
+    stats = {'scanned': 0, 'updated': 0, 'reserved': 0, 'conflicts': 0}
+    while True:
+        page = store.profiles.scan(after=after, limit=batch_size)
+        if not page:
+            break
+        for uid, data in page:
+            stats['scanned'] += 1
+            username = data.get('username')
+            if not username:
+                continue
+            key = username_key(username)
+            if data.get('username_lower') != key:
+                store.profiles.update(uid, {'username': username})
+                stats['updated'] += 1
+            if store.usernames.lookup(key) != uid:
+                if store.usernames.reserve(key, uid):
+                    stats['reserved'] += 1
+                else:
+                    stats['conflicts'] += 1
+                    click.echo(f"⚠️ '{username}' ({uid}) clashes with an existing name; left unreserved")
+        after = page[-1][0]
+    click.echo(f"Scanned {stats['scanned']} profiles: {stats['updated']} updated, "
+               f"{stats['reserved']} reserved, {stats['conflicts']} conflicts")
+
+
+# 💬 CLI: flask maintenance backfill-conversations
+@maintenance_bp.cli.command('backfill-conversations')
+@click.option('--batch-size', default=300, show_default=True, help='Conversations per page.')
+@click.option('--all', 'recompute_all', is_flag=True, help='Recompute every conversation, not just ones missing the summary.')
+def backfill_conversations_command(batch_size, recompute_all):
+    """Set last_message_at/last_sender/message_count on conversations created before the summary existed."""
+    store = get_store()
+    after = None
+    scanned = updated = 0
+    while True:
+        page = store.conversations.scan(after=after, limit=batch_size)
+        if not page:
+            break
+        for convo_id, data in page:
+            scanned += 1
+            # Firestore's inbox query orders by last_message_at and skips documents without it
+            if not recompute_all and data.get('last_message_at') is not None:
+                continue
+            summary = store.messages.summary(convo_id)
+            if not recompute_all and summary['last_message_at'] is None and 'last_message_at' in data:
+                continue
+            store.conversations.set_summary(convo_id, summary)
+            updated += 1
+        after = page[-1][0]
+    click.echo(f"Scanned {scanned} conversations: {updated} updated")
+
+
+# 🍪 CLI: flask maintenance revoke-sessions <uid>
+@maintenance_bp.cli.command('revoke-sessions')
+@click.argument('uid')
+def revoke_sessions_command(uid):
+    """End every server-side session of a user (SESSION_BACKEND=memory|sqlite)."""
+    dropped = sessions.revoke_user(current_app, uid)
+    click.echo(f"Revoked {dropped} sessions for {uid}")
@@ -0,0 +1,20 @@
+import os
+import hmac
+
+from flask import Blueprint, Response, request, abort
+
+from ..services.metrics import render_prometheus
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+# 📈 Prometheus scrape target: needs "Authorization: Bearer <METRICS_TOKEN>",
+# or METRICS_PUBLIC=1 to serve it unauthenticated (e.g. behind a private network)
+@metrics_bp.route('/metrics')
+def metrics():
+    if os.getenv("METRICS_PUBLIC") != "1":
+        token = os.getenv("METRICS_TOKEN")
+        header = request.headers.get('Authorization', '')
+        if not token or not hmac.compare_digest(header, f"Bearer {token}"):
+            abort(403)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,15 @@
+from flask import Blueprint
+
+from app.routes.auth import require_login, verify_csrf
+from app.services import presence
+
+presence_bp = Blueprint('presence', __name__)
+
+
+# 🟢 Heartbeat from pages without a chat stream (an open chat stream already counts)
+@presence_bp.route('/presence/heartbeat', methods=['POST'])
+def heartbeat():
+    me_id = require_login()
+    verify_csrf()
+    presence.heartbeat(me_id)
+    return '', 204
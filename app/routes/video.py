@@ -0,0 +1,136 @@
+from flask import Blueprint, Response, abort, jsonify, render_template, request, stream_with_context
+
+from app.routes.auth import get_or_create_csrf, require_login, verify_csrf
+from app.services import friends, profile_cache, video_service
+from app.services.conversation_service import conversation_id
+from app.storage import get_store
+
+video_bp = Blueprint('video', __name__)
+
+
+@video_bp.errorhandler(video_service.CallError)
+def call_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+
+def _may_call(me_id, other_id):
+    """Friends, or people with a conversation that has messages (opening a chat page alone doesn't count)."""
+    if friends.state(me_id, other_id) == 'friends':
+        return True
+    convo = get_store().conversations.get(conversation_id(me_id, other_id))
+    return bool(convo and convo.get('last_message_at'))
+
+
+def _json():
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        abort(400, description="Expected a JSON object")
+    return data
+
+
+# 🎥 Call page: places a call to `other_id`, or answers `?call=<id>` from them
+@video_bp.route('/calls/with/<other_id>')
+def call_page(other_id):
+    me_id = require_login()
+    other = profile_cache.get_profile(other_id)
+    if other is None or other_id == me_id:
+        abort(404)
+    kind = request.args.get('kind', 'video')
+    if kind not in video_service.KINDS:
+        abort(400, description="Unknown call kind")
+    return render_template(
+        'video.html',
+        current_user_id=me_id,
+        other_id=other_id,
+        other_user={
+            'display_name': other.get('display_name') or other.get('username') or 'Unknown',
+            'photo_url': other.get('photo_url_small') or other.get('photo_url', '')
+        },
+        kind=kind,
+        incoming_call_id=request.args.get('call', ''),
+        ice_servers=video_service.ICE_SERVERS,
+        csrf_token=get_or_create_csrf()
+    )
+
+
+# 📡 Call events for the current user (SSE; Last-Event-ID resumes)
+@video_bp.route('/calls/events')
+def call_events():
+    me_id = require_login()
+    after = video_service.parse_cursor(request.headers.get('Last-Event-ID') or request.args.get('after'))
+    return Response(stream_with_context(video_service.event_stream(me_id, after)),
+                    mimetype='text/event-stream', headers={
+                        'Cache-Control': 'no-cache',
+                        'X-Accel-Buffering': 'no'
+                    })
+
+
+# ⏳ Long-poll fallback for clients and proxies without SSE
+@video_bp.route('/calls/poll')
+def call_poll():
+    me_id = require_login()
+    timeout = min(max(request.args.get('timeout', video_service.POLL_SECONDS, type=float), 0),
+                  video_service.POLL_SECONDS)
+    events, cursor = video_service.poll(me_id, video_service.parse_cursor(request.args.get('after')), timeout)
+    response = jsonify({'events': events, 'cursor': cursor})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
+@video_bp.route('/calls', methods=['POST'])
+def start_call():
+    me_id = require_login()
+    verify_csrf()
+    data = _json()
+    callee = data.get('to')
+    if not isinstance(callee, str) or (callee != me_id and profile_cache.get_profile(callee) is None):
+        abort(404)
+    if callee != me_id and not _may_call(me_id, callee):
+        raise video_service.CallError("You can only call friends or people you have chatted with", 403)
+    call = video_service.start_call(me_id, callee, data.get('kind', 'video'), data.get('offer'))
+    return jsonify(call), 201
+
+
+@video_bp.route('/calls/<call_id>')
+def get_call(call_id):
+    me_id = require_login()
+    return jsonify(video_service.get_call(me_id, call_id))
+
+
+@video_bp.route('/calls/<call_id>/answer', methods=['POST'])
+def answer_call(call_id):
+    me_id = require_login()
+    verify_csrf()
+    return jsonify(video_service.answer_call(me_id, call_id, _json().get('answer')))
+
+
+# 🧊 Trickled ICE candidates, batched by the client
+@video_bp.route('/calls/<call_id>/candidates', methods=['POST'])
+def add_candidates(call_id):
+    me_id = require_login()
+    verify_csrf()
+    relayed = video_service.add_candidates(me_id, call_id, _json().get('candidates'))
+    return jsonify({'relayed': relayed})
+
+
+@video_bp.route('/calls/<call_id>/hangup', methods=['POST'])
+def hang_up(call_id):
+    me_id = require_login()
+    verify_csrf()
+    return jsonify(video_service.hang_up(me_id, call_id))
+
+
+# 🗂️ Finished calls, newest first (the only call data that is stored)
+@video_bp.route('/calls')
+def call_history():
+    me_id = require_login()
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+    return jsonify({'calls': [{
+        'call_id': record['id'],
+        'peer': record['callee'] if record['caller'] == me_id else record['caller'],
+        'direction': 'outgoing' if record['caller'] == me_id else 'incoming',
+        'kind': record['kind'],
+        'outcome': record['outcome'],
+        'created_at': record['created_at'].isoformat(),
+        'duration_seconds': record.get('duration_seconds', 0)
+    } for record in video_service.recent_calls(me_id, limit)]})
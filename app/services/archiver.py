@@ -0,0 +1,129 @@
+import logging
+import os
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from app.storage.base import EPOCH
+from .message_service import ARCHIVE_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'message_archiver'
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("ARCHIVE_AFTER_DAYS", 30))
+# Firestore documents max out at 1 MiB; stay far below it whatever the envelope sizes
+CHUNK_MAX_BYTES = int(os.getenv("ARCHIVE_CHUNK_MAX_BYTES", 256 * 1024))
+
+SCAN_PAGE = 500
+# Firestore writes a chunk, one delete per message and the conversation in
+# one batch, so keep chunks comfortably under its 500-write limit.
+MAX_CHUNK_SIZE = 400
+
+
+def _size(msg):
+    return sum(len(v) for v in msg.values() if isinstance(v, (str, bytes))) + 64
+
+
+def _expired(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def compact_conversation(store, convo_id, cutoff, chunk_size=ARCHIVE_CHUNK_SIZE, deadline=None):
+    """
+    Roll persistent messages older than `cutoff` into archive chunks of
+    `chunk_size`, oldest first. Only full chunks are written; the remainder
+    stays live until enough old messages accumulate, so chunks never change
+    once written. Ephemeral messages are left for the reaper.
+
+    Stops between chunks once the monotonic `deadline` passes; stats then
+    carry 'interrupted' and a rerun picks up where it left off.
+    """
+    stats = Counter()
+    chunk, chunk_bytes = [], 0
+    key = (EPOCH, '')
+    while True:
+        page = store.messages.oldest_first_after(convo_id, key, SCAN_PAGE)
+        for row in page:
+            (created_at, _), _, msg = row
+            if created_at >= cutoff:
+                return stats
+            if msg.get('ephemeral'):
+                continue
+            chunk.append(row)
+            chunk_bytes += _size(msg)
+            if len(chunk) >= chunk_size or chunk_bytes >= CHUNK_MAX_BYTES:
+                store.archives.add(convo_id, chunk)
+                stats['chunks'] += 1
+                stats['messages'] += len(chunk)
+                chunk, chunk_bytes = [], 0
+                if _expired(deadline):
+                    stats['interrupted'] = 1
+                    return stats
+        if len(page) < SCAN_PAGE:
+            return stats
+        key = page[-1][0]
+
+
+def compact_archives(store, now=None, older_than_days=ARCHIVE_AFTER_DAYS, chunk_size=ARCHIVE_CHUNK_SIZE,
+                     batch_size=100, max_seconds=None, resume=True):
+    """
+    Compact old history across all conversations.
+
+    Conversations are visited in id order, `batch_size` at a time, and the
+    last one finished is checkpointed so a run cut short by `max_seconds`
+    resumes there. The time budget is checked before every conversation and
+    between chunks. Conversations with fewer than `chunk_size` live messages
+    are skipped without reading their messages. Returns throughput stats.
+    """
+    now = now or datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=older_than_days)
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    checkpoint = (store.meta.get(CHECKPOINT_KEY) or {}).get('last_convo') if resume else None
+
+    stats = Counter()
+    started = time.monotonic()
+    deadline = started + max_seconds if max_seconds is not None else None
+    finished = stopped = False
+
+    while not stopped:
+        if _expired(deadline):
+            break
+
+        convos = store.conversations.scan(after=checkpoint, limit=batch_size)
+        if not convos:
+            finished = True
+            break
+
+        for convo_id, data in convos:
+            if _expired(deadline):
+                stopped = True
+                break
+            stats['conversations'] += 1
+            if data.get('message_count', 0) >= chunk_size:
+                done = compact_conversation(store, convo_id, cutoff, chunk_size, deadline)
+                stopped = bool(done.pop('interrupted', None))
+                stats.update(done)
+                if stopped:
+                    break  # not checkpointed: the next run finishes this conversation
+            checkpoint = convo_id
+
+        store.meta.set(CHECKPOINT_KEY, {'last_convo': checkpoint, 'last_run_chunks': stats['chunks']})
+        if not stopped and len(convos) < batch_size:
+            finished = True
+            break
+
+    # A full pass clears the checkpoint so the next run starts from the beginning
+    if finished:
+        store.meta.set(CHECKPOINT_KEY, {'last_convo': None, 'last_run_chunks': stats['chunks']})
+
+    elapsed = time.monotonic() - started
+    result = {
+        'conversations': stats['conversations'],
+        'chunks': stats['chunks'],
+        'messages': stats['messages'],
+        'elapsed_seconds': round(elapsed, 3),
+        'complete': finished
+    }
+    logger.info("Message archiver: %s", result)
+    return result
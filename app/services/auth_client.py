@@ -0,0 +1,93 @@
+import functools
+import os
+
+import cachecontrol
+import requests
+from google.auth import exceptions as google_exceptions
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token as google_id_token
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.services import metrics
+
+# 🌐 Endpoints (overridable so tests can point at a local stub)
+IDENTITY_TOOLKIT_URL = os.getenv("IDENTITY_TOOLKIT_URL", "https://identitytoolkit.googleapis.com/v1")
+CERTS_URL = os.getenv(
+    "SECURETOKEN_CERTS_URL",
+    "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+)
+
+TIMEOUT = (float(os.getenv("AUTH_CONNECT_TIMEOUT", 3.05)), float(os.getenv("AUTH_READ_TIMEOUT", 10)))
+CLOCK_SKEW_SECONDS = 5
+
+
+class AuthError(Exception):
+    pass
+
+
+def _build_session(service, adapter_class=HTTPAdapter):
+    session = requests.Session()
+    session.hooks['response'].append(metrics.http_hook(service))
+    retry = Retry(
+        total=2,
+        connect=2,
+        read=0,
+        status=2,
+        backoff_factor=0.2,
+        status_forcelist=(429, 502, 503, 504),
+        # GET only: signInWithPassword is a POST and must not be replayed
+        allowed_methods=frozenset({'GET'})
+    )
+    adapter = adapter_class(pool_connections=4, pool_maxsize=16, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+# Keep-alive pool for Identity Toolkit calls
+_session = _build_session('identity_toolkit')
+
+# Separate pool for signing certs; CacheControl honours their max-age headers,
+# so certs are refetched only when Google says they may have rotated. The
+# adapter is mounted directly (not via CacheControl(), which would replace
+# ours and its retries). google-auth passes no timeout, so bind ours.
+_certs_request = functools.partial(
+    google_requests.Request(session=_build_session('securetoken_certs', cachecontrol.CacheControlAdapter)),
+    timeout=TIMEOUT
+)
+
+
+def sign_in_with_password(api_key, email, password):
+    """Returns the Identity Toolkit response body (contains idToken on success)."""
+    response = _session.post(
+        f"{IDENTITY_TOOLKIT_URL}/accounts:signInWithPassword",
+        params={'key': api_key},
+        json={"email": email, "password": password, "returnSecureToken": True},
+        timeout=TIMEOUT
+    )
+    try:
+        return response.json()
+    except ValueError:
+        return {'error': {'message': f"HTTP {response.status_code}"}}
+
+
+def verify_id_token(token, project_id=None):
+    """Verify a Firebase ID token and return its claims (with `uid` set)."""
+    project_id = project_id or os.getenv("FIREBASE_PROJECT_ID")
+    try:
+        claims = google_id_token.verify_token(
+            token, _certs_request, audience=project_id,
+            certs_url=CERTS_URL, clock_skew_in_seconds=CLOCK_SKEW_SECONDS
+        )
+    except ValueError as e:
+        raise AuthError(str(e))
+    except google_exceptions.TransportError as e:
+        raise AuthError(f"Could not fetch signing certificates: {e}")
+
+    if claims.get('iss') != f"https://securetoken.google.com/{project_id}":
+        raise AuthError("Invalid token issuer")
+    if not claims.get('sub'):
+        raise AuthError("Token has no subject")
+    claims['uid'] = claims['sub']
+    return claims
@@ -0,0 +1,182 @@
+"""
+Avatar uploads, off the request path.
+
+Signup saves the profile straight away (avatar_status 'pending', templates
+show the default avatar) and hands the image bytes to a small worker pool.
+A worker uploads to Cloudinary with retries, asks for the small/medium
+variants eagerly so pages never wait on an on-the-fly transform, then
+patches the profile.
+
+AVATAR_UPLOADER=stub swaps Cloudinary for StubUploader, which writes files
+locally (tests, benchmarks, offline dev). AVATAR_UPLOAD_WORKERS=0 uploads
+inline, for hosts that freeze background threads after the response; that
+is the default on Vercel (VERCEL is set), where a queued upload could stall
+and leave the profile 'pending'. The inline path keeps the request short:
+one attempt, no backoff sleeps, and the variants are built by Cloudinary
+after it responds (eager_async) with their URLs derived from the upload.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as futures_wait
+
+from app.services import metrics, profile_cache
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("AVATAR_UPLOAD_WORKERS", 0 if os.getenv("VERCEL") else 2))
+QUEUE_LIMIT = int(os.getenv("AVATAR_UPLOAD_QUEUE", 32))
+ATTEMPTS = int(os.getenv("AVATAR_UPLOAD_ATTEMPTS", 3))
+BACKOFF_SECONDS = float(os.getenv("AVATAR_UPLOAD_BACKOFF", 0.5))
+MAX_BYTES = int(os.getenv("AVATAR_MAX_BYTES", 5 * 1024 * 1024))
+
+# 🖼️ Variants used by the pages: 48px in lists and message bubbles, 128px in headers and profiles
+VARIANTS = {
+    'small': {"width": 48, "height": 48, "crop": "fill", "gravity": "face"},
+    'medium': {"width": 128, "height": 128, "crop": "fill", "gravity": "face"},
+}
+
+
+class StubUploader:
+    """Stand-in for cloudinary.uploader: stores the original under `directory`, same response shape."""
+
+    def __init__(self, directory, base_url="/static/avatars", delay=0.0, fail_times=0):
+        self.directory = directory
+        self.base_url = base_url
+        self.delay = delay
+        self.fail_times = fail_times
+        self.calls = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def upload(self, file, folder=None, public_id=None, eager=(), eager_async=False, **options):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.calls <= self.fail_times:
+            raise ConnectionError("stub upload failure")
+        data = file if isinstance(file, bytes) else file.read()
+        with open(os.path.join(self.directory, public_id), 'wb') as f:
+            f.write(data)
+        result = {
+            "public_id": f"{folder}/{public_id}" if folder else public_id,
+            "secure_url": f"{self.base_url}/{public_id}",
+        }
+        # Like Cloudinary, async variants are not part of the response
+        result["eager"] = [] if eager_async else [{"secure_url": self.variant_url(result, t), **t} for t in eager]
+        return result
+
+    def variant_url(self, result, transform):
+        return f"{result['secure_url']}?w={transform['width']}&h={transform['height']}"
+
+
+def _default_uploader():
+    if os.getenv("AVATAR_UPLOADER", "cloudinary") == "stub":
+        from app import firebase
+        directory = os.getenv("AVATAR_STUB_DIR", os.path.join(os.path.dirname(__file__), '..', 'static', 'avatars'))
+        return firebase._service('avatar_stub', lambda: StubUploader(directory))
+    from app.firebase import get_uploader
+    return get_uploader()
+
+
+_uploader = None
+_executor = None
+_slots = threading.BoundedSemaphore(QUEUE_LIMIT)
+_pending = set()
+_lock = threading.Lock()
+
+
+def set_uploader(uploader):
+    """Install a specific uploader (tests, benchmarks); None restores the default."""
+    global _uploader
+    _uploader = uploader
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=WORKERS, thread_name_prefix="avatar-upload")
+        return _executor
+
+
+def _variant_url(uploader, result, transform):
+    """Delivery URL of a variant that was requested with eager_async (not in the response yet)."""
+    if hasattr(uploader, 'variant_url'):
+        return uploader.variant_url(result, transform)
+    import cloudinary.utils
+    url, _ = cloudinary.utils.cloudinary_url(result["public_id"], version=result.get("version"),
+                                             format=result.get("format"), secure=True, **transform)
+    return url
+
+
+def upload_avatar(uid, data, public_id, inline=False):
+    """
+    Upload and patch the profile. Returns the fields written. Queued uploads
+    retry with backoff and wait for the eager variants; `inline` (on the
+    request path) makes a single attempt and lets Cloudinary build them later.
+    """
+    uploader = _uploader or _default_uploader()
+    transforms = list(VARIANTS.values())
+    attempts = 1 if inline else ATTEMPTS
+    for attempt in range(1, attempts + 1):
+        try:
+            with metrics.timed_external('cloudinary'):
+                result = uploader.upload(data, folder="avatars", public_id=public_id,
+                                         eager=transforms, eager_async=inline, overwrite=True)
+            break
+        except Exception as e:
+            if attempt == attempts:
+                logger.warning("Avatar upload for %s failed after %d attempts: %s", uid, attempt, e)
+                profile_cache.update_profile(uid, {'avatar_status': 'failed'})
+                return {'avatar_status': 'failed'}
+            time.sleep(BACKOFF_SECONDS * 2 ** (attempt - 1))
+
+    eager = result.get("eager") or []
+    urls = {name: (eager[i].get("secure_url") if i < len(eager) else None) or _variant_url(uploader, result, transform)
+            for i, (name, transform) in enumerate(VARIANTS.items())}
+    fields = {
+        'photo_url': urls['medium'],
+        'photo_url_small': urls['small'],
+        'photo_url_original': result.get("secure_url", ""),
+        'avatar_status': 'ready',
+    }
+    profile_cache.update_profile(uid, fields)
+    return fields
+
+
+def submit(uid, data, public_id):
+    """
+    Queue an avatar upload. Falls back to uploading inline (one attempt,
+    async variants) when workers are disabled or the queue is full, so
+    back-pressure lands on the caller instead of memory.
+    """
+    if WORKERS <= 0 or not _slots.acquire(blocking=False):
+        return upload_avatar(uid, data, public_id, inline=True)
+
+    def run():
+        try:
+            return upload_avatar(uid, data, public_id)
+        except Exception:
+            logger.exception("Avatar upload for %s crashed", uid)
+        finally:
+            _slots.release()
+
+    future = _get_executor().submit(run)
+    with _lock:
+        _pending.add(future)
+    future.add_done_callback(_discard)
+    return None
+
+
+def _discard(future):
+    with _lock:
+        _pending.discard(future)
+
+
+def wait(timeout=None):
+    """Block until queued uploads finish (tests, CLI, shutdown). True if none are left."""
+    with _lock:
+        pending = list(_pending)
+    _, not_done = futures_wait(pending, timeout=timeout)
+    return not not_done
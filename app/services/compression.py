@@ -0,0 +1,59 @@
+"""
+Response compression for HTML, JSON and msgpack payloads.
+
+Brotli (a listed dependency; skipped if the package is missing) is used when the client accepts
+it, gzip otherwise. Streamed responses (SSE) and small bodies are left alone.
+"""
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # optional dependency
+    brotli = None
+
+MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", 6))
+BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", 5))
+
+COMPRESSIBLE = {'text/html', 'application/json', 'application/msgpack', 'text/plain'}
+
+
+def _encoding(accept):
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def compress_response(response, accept_encodings):
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding(accept_encodings)
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_BYTES:
+        return response
+
+    if encoding == 'br':
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_app(app):
+    @app.after_request
+    def compress(response):
+        if not app.config.get('COMPRESS_RESPONSES', True):
+            return response
+        return compress_response(response, request.accept_encodings)
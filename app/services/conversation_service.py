@@ -0,0 +1,3 @@
+def conversation_id(a, b):
+    """Deterministic conversation id shared by both participants."""
+    return '_'.join(sorted([a, b]))
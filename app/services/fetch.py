@@ -0,0 +1,121 @@
+"""
+Concurrent backend reads for request handlers.
+
+Independent reads (a profile, the conversation summary, a page of messages)
+are issued together on a shared, bounded thread pool, so a view waits for
+the slowest read instead of the sum of all of them. Each call runs in a copy
+of the caller's context, so Flask's request/g and the metrics breakdown are
+visible inside the worker.
+
+    profile, convo = fetch.gather(
+        (profile_cache.get_profile, other_id),
+        (store.conversations.get, convo_id),
+    )
+
+FETCH_POOL_SIZE=0 runs everything inline (handy when debugging).
+"""
+import contextvars
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_EXCEPTION, TimeoutError as FutureTimeout
+
+from flask import g, has_request_context, request
+from werkzeug.exceptions import GatewayTimeout
+
+POOL_SIZE = int(os.getenv("FETCH_POOL_SIZE", 16))
+PER_REQUEST = int(os.getenv("FETCH_PER_REQUEST", 4))
+TIMEOUT = float(os.getenv("FETCH_TIMEOUT", 10))
+
+_pool = None
+_lock = threading.Lock()
+# Set inside pool workers: nested gathers run inline instead of waiting on
+# slots their own parents hold
+_in_worker = contextvars.ContextVar('fetch_in_worker', default=False)
+
+
+class FetchTimeout(TimeoutError):
+    pass
+
+
+def init_app(app):
+    @app.errorhandler(FetchTimeout)
+    def fetch_timeout(e):
+        app.logger.warning("Backend fetch timed out on %s: %s", request.path, e)
+        return GatewayTimeout().get_response()
+
+
+def _get_pool():
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="fetch")
+        return _pool
+
+
+def _slots():
+    """Per-request cap on reads in flight, shared by every gather() in the request."""
+    if not has_request_context():
+        return threading.BoundedSemaphore(PER_REQUEST)
+    if 'fetch_slots' not in g:
+        g.fetch_slots = threading.BoundedSemaphore(PER_REQUEST)
+    return g.fetch_slots
+
+
+def submit(fn, *args, **kwargs):
+    """
+    Start one read in the background; returns a Future. Waits up to
+    FETCH_TIMEOUT for one of the request's slots, then raises FetchTimeout.
+    """
+    if POOL_SIZE <= 0 or _in_worker.get():
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    slots = _slots()
+    if not slots.acquire(timeout=TIMEOUT):
+        raise FetchTimeout(f"no fetch slot freed up within {TIMEOUT}s ({PER_REQUEST} reads already in flight)")
+    ctx = contextvars.copy_context()
+    ctx.run(_in_worker.set, True)
+
+    def run():
+        try:
+            return ctx.run(fn, *args, **kwargs)
+        finally:
+            slots.release()
+    try:
+        return _get_pool().submit(run)
+    except Exception:
+        slots.release()
+        raise
+
+
+def gather(*calls, timeout=None):
+    """
+    Run `(fn, *args)` tuples concurrently and return their results in order.
+    Raises the first error, or FetchTimeout if they take longer than `timeout`
+    seconds (FETCH_TIMEOUT by default).
+    """
+    if POOL_SIZE <= 0 or len(calls) <= 1 or _in_worker.get():
+        return [fn(*args) for fn, *args in calls]
+
+    timeout = TIMEOUT if timeout is None else timeout
+    futures = [submit(fn, *args) for fn, *args in calls]
+    done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+    for future in done:
+        if future.exception() is not None:
+            raise future.exception()
+    if pending:
+        raise FetchTimeout(f"{len(pending)} of {len(calls)} reads did not finish within {timeout}s")
+    return [future.result() for future in futures]
+
+
+def result(future, timeout=None):
+    """Future.result() with the module timeout and error type."""
+    timeout = TIMEOUT if timeout is None else timeout
+    try:
+        return future.result(timeout=timeout)
+    except FutureTimeout:
+        raise FetchTimeout(f"read did not finish within {timeout}s")
@@ -0,0 +1,70 @@
+"""
+Friend graph with an in-process adjacency cache.
+
+Each user's friend list is one stored document ({other_uid: state}), cached
+here for FRIEND_CACHE_TTL seconds so the inbox, chat page and profile
+popout can show friend status without touching the store. Writes go
+through this module and refresh both users' entries; other processes see
+them once their TTL runs out.
+"""
+import os
+import threading
+from collections import Counter
+
+from cachetools import TTLCache
+
+from app.storage import get_store
+
+MAX_SIZE = int(os.getenv("FRIEND_CACHE_SIZE", 5000))
+TTL = float(os.getenv("FRIEND_CACHE_TTL", 60))
+
+_lists = TTLCache(maxsize=MAX_SIZE, ttl=TTL)
+_lock = threading.Lock()
+
+cache_stats = Counter()
+
+
+def get_friends(uid):
+    """{other_uid: 'friends' | 'outgoing' | 'incoming'} for `uid` (a copy)."""
+    with _lock:
+        if uid in _lists:
+            cache_stats['hits'] += 1
+            return dict(_lists[uid])
+    cache_stats['misses'] += 1
+    states = get_store().friendships.get(uid)
+    with _lock:
+        _lists[uid] = states
+    return dict(states)
+
+
+def state(uid, other):
+    """Friend state of `other` as seen by `uid`, or None."""
+    return get_friends(uid).get(other)
+
+
+def _write(action, uid, other):
+    if uid == other:
+        raise ValueError("Cannot befriend yourself")
+    result = getattr(get_store().friendships, action)(uid, other)
+    invalidate(uid, other)
+    return result
+
+
+def request(uid, other):
+    """Send (or repeat) a friend request; accepts theirs if `other` already asked. Returns the new state."""
+    return _write('request', uid, other)
+
+
+def accept(uid, other):
+    return _write('accept', uid, other)
+
+
+def remove(uid, other):
+    """Unfriend, cancel an outgoing request or decline an incoming one."""
+    return _write('remove', uid, other)
+
+
+def invalidate(*uids):
+    with _lock:
+        for uid in uids:
+            _lists.pop(uid, None)
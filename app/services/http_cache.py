@@ -0,0 +1,75 @@
+"""
+Conditional GET helpers.
+
+Validators are built from cheap summary data (the conversation document, the
+inbox's most recent activity), so a matching If-None-Match is answered with
+304 before any message or inbox listing is read. ETags are weak: the same
+content may be sent gzip- or brotli-encoded.
+
+Rendered pages change with deploys too, so the deploy's commit SHA
+(VERCEL_GIT_COMMIT_SHA, or APP_BUILD_ID elsewhere) goes into every tag and
+every instance of a deploy computes the same tags. Without one, validators
+are not sent and every request is answered in full.
+"""
+import hashlib
+import logging
+import os
+from datetime import datetime
+
+from flask import Response, request, session
+
+logger = logging.getLogger(__name__)
+
+BUILD_ID = os.getenv("VERCEL_GIT_COMMIT_SHA") or os.getenv("APP_BUILD_ID")
+if not BUILD_ID:
+    logger.warning("Neither VERCEL_GIT_COMMIT_SHA nor APP_BUILD_ID is set: conditional GET is disabled")
+
+
+def _part(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return '' if value is None else str(value)
+
+
+def make_etag(*parts):
+    digest = hashlib.sha256('\x1f'.join(_part(p) for p in (BUILD_ID,) + parts).encode()).hexdigest()
+    return digest[:32]
+
+
+def session_parts():
+    """Per-session values baked into rendered pages (user id, CSRF token)."""
+    return session.get('user_id'), hashlib.sha256(session.get('csrf_token', '').encode()).hexdigest()[:16]
+
+
+def _http_time(value):
+    return value.replace(microsecond=0) if isinstance(value, datetime) else None
+
+
+def is_fresh(etag, last_modified=None, use_last_modified=False):
+    """
+    True if the client's cached copy is current. If-None-Match wins; pages
+    that embed per-session data only trust the ETag (use_last_modified=False).
+    """
+    if not BUILD_ID or session.get('_flashes'):
+        return False  # no deploy id to tag with, or a pending flash message must be rendered
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(etag)
+    since = request.if_modified_since
+    last_modified = _http_time(last_modified)
+    return bool(use_last_modified and since and last_modified and last_modified <= since)
+
+
+def not_modified(etag, last_modified=None):
+    response = Response(status=304)
+    return finish(response, etag, last_modified)
+
+
+def finish(response, etag, last_modified=None):
+    if BUILD_ID:
+        response.set_etag(etag, weak=True)
+        if _http_time(last_modified):
+            response.last_modified = _http_time(last_modified)
+    # Private (session-specific) and always revalidated; 304s make that cheap
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import queue
+import threading
+from collections import deque
+from datetime import datetime, timezone
+
+from .message_service import KeyRing, clean_message, encode_cursor, is_expired
+
+logger = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", 15))
+REPLAY_BUFFER = int(os.getenv("SSE_REPLAY_BUFFER", 200))
+SUBSCRIBER_QUEUE = 256
+BACKFILL_PAGE = 200
+
+
+class Feed:
+    """
+    One backend listener for a conversation, fanned out to every connected
+    client in this process. Recent events are kept in a ring buffer so a
+    reconnecting client can catch up without another query.
+
+    The same subscribers also get ephemeral signals (presence, typing) via
+    signal(); those are never stored or replayed.
+    """
+
+    def __init__(self, convo_id, store, participants=()):
+        self.convo_id = convo_id
+        self.participants = frozenset(participants)
+        self.started_at = datetime.now(timezone.utc)
+        self.subscribers = set()
+        self.recent = deque(maxlen=REPLAY_BUFFER)
+        self.lock = threading.Lock()
+        self.keys = KeyRing(store, convo_id)
+        self.unwatch = store.messages.watch(convo_id, self.started_at, self._on_added)
+
+    # 🔔 Runs on the backend's listener thread (or the writer's, for local stores)
+    def _on_added(self, added):
+        events = [(key, clean_message(doc_id, msg, self.keys)) for key, doc_id, msg in added]
+
+        with self.lock:
+            for key, payload in events:
+                self.recent.append((key, payload))
+            subscribers = list(self.subscribers)
+        for key, payload in events:
+            for sub in subscribers:
+                sub.push(key, payload)
+
+    def replay_after(self, key):
+        """Buffered events after `key`, or None if the buffer no longer reaches back that far."""
+        with self.lock:
+            buffered = list(self.recent)
+        if key[0] < self.started_at:
+            return None
+        if len(buffered) == REPLAY_BUFFER and key < buffered[0][0]:
+            return None  # older events were already evicted
+        return [(k, p) for k, p in buffered if k > key]
+
+    def close(self):
+        try:
+            self.unwatch()
+        except Exception as e:
+            logger.warning("Failed to close listener for %s: %s", self.convo_id, e)
+
+
+class Subscription:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE)
+        self.overflowed = False
+
+    def push(self, key, payload):
+        try:
+            self.queue.put_nowait((key, payload))
+        except queue.Full:
+            # Slow consumer: end its stream, it will reconnect with Last-Event-ID
+            self.overflowed = True
+
+    def push_signal(self, event, payload):
+        try:
+            self.queue.put_nowait((None, (event, payload)))
+        except queue.Full:
+            pass  # signals are superseded by the next one; dropping is fine
+
+
+_feeds = {}
+_feeds_by_user = {}  # uid -> {convo_id} of open feeds the user takes part in
+_feeds_lock = threading.Lock()
+
+
+def _attach(convo_id, sub, new_feed=None):
+    """Add `sub` to the open feed (or register `new_feed`); returns (feed, used new_feed)."""
+    with _feeds_lock:
+        feed = _feeds.get(convo_id)
+        registered = feed is None and new_feed is not None
+        if registered:
+            feed = _feeds[convo_id] = new_feed
+            for uid in feed.participants:
+                _feeds_by_user.setdefault(uid, set()).add(convo_id)
+        if feed is not None:
+            with feed.lock:
+                feed.subscribers.add(sub)
+    return feed, registered
+
+
+def subscribe(convo_id, store, participants=()):
+    sub = Subscription()
+    feed, _ = _attach(convo_id, sub)
+    if feed is not None:
+        return feed, sub
+    # Opening the backend listener is a network call: do it without holding
+    # _feeds_lock, and drop ours if another client opened the feed meanwhile
+    new_feed = Feed(convo_id, store, participants)
+    feed, registered = _attach(convo_id, sub, new_feed)
+    if not registered:
+        new_feed.close()
+    return feed, sub
+
+
+def unsubscribe(feed, sub):
+    with _feeds_lock:
+        with feed.lock:
+            feed.subscribers.discard(sub)
+            empty = not feed.subscribers
+        if empty and _feeds.get(feed.convo_id) is feed:
+            del _feeds[feed.convo_id]
+            for uid in feed.participants:
+                convos = _feeds_by_user.get(uid)
+                if convos is not None:
+                    convos.discard(feed.convo_id)
+                    if not convos:
+                        del _feeds_by_user[uid]
+        else:
+            empty = False
+    if empty:
+        feed.close()
+
+
+def signal(event, payload, convo_id=None, participant=None):
+    """
+    Push an ephemeral event to every client of one conversation's feed, or
+    of every open feed `participant` takes part in. Returns how many clients got it.
+    """
+    with _feeds_lock:
+        ids = [convo_id] if convo_id else list(_feeds_by_user.get(participant, ()))
+        feeds = [_feeds[i] for i in ids if i in _feeds]
+    sent = 0
+    for feed in feeds:
+        with feed.lock:
+            subscribers = list(feed.subscribers)
+        for sub in subscribers:
+            sub.push_signal(event, payload)
+        sent += len(subscribers)
+    return sent
+
+
+def _event(key, payload):
+    return f"id: {encode_cursor(*key)}\nevent: message\ndata: {json.dumps(payload)}\n\n"
+
+
+def signal_frame(event, payload):
+    # No id: signals must not move the client's Last-Event-ID
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_stream(store, convo_id, since, participants=()):
+    """
+    Generator of SSE frames for one client.
+
+    `since` is a decoded (created_at, doc_id) cursor from Last-Event-ID or the
+    page render; events at or before it are skipped. Heartbeat comments keep proxies from closing
+    idle connections.
+    """
+    key = since or (datetime.now(timezone.utc), '')
+    feed, sub = subscribe(convo_id, store, participants)
+    try:
+        yield "retry: 3000\n\n"
+
+        replay = feed.replay_after(key)
+        if replay is None:
+            # Too far behind for the buffer: page through the store until caught up
+            while True:
+                now = datetime.now(timezone.utc)
+                page = store.messages.oldest_first_after(convo_id, key, BACKFILL_PAGE)
+                for k, doc_id, msg in page:
+                    key = max(key, k)
+                    if not is_expired(msg, now):
+                        yield _event(k, clean_message(doc_id, msg, feed.keys))
+                if len(page) < BACKFILL_PAGE:
+                    break
+        else:
+            for k, payload in replay:
+                yield _event(k, payload)
+                key = max(key, k)
+
+        while not sub.overflowed:
+            try:
+                k, payload = sub.queue.get(timeout=HEARTBEAT_SECONDS)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            if k is None:
+                yield signal_frame(*payload)
+                continue
+            if k <= key:
+                continue  # already sent during replay
+            key = k
+            yield _event(k, payload)
+    finally:
+        unsubscribe(feed, sub)
+
+
+def stats():
+    with _feeds_lock:
+        return {
+            'feeds': len(_feeds),
+            'subscribers': sum(len(f.subscribers) for f in _feeds.values())
+        }
@@ -0,0 +1,276 @@
+import base64
+import binascii
+import hashlib
+import heapq
+import math
+import os
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from operator import itemgetter
+
+from app.storage import read_stats
+from app.storage.base import EPOCH
+
+MAX_FIELD_LENGTH = 64 * 1024
+
+# 📦 Envelope formats. Both use the same crypto (X25519 + XSalsa20-Poly1305):
+#   v1  ciphertext / nonce / sender_pub as base64 strings on every message
+#   v2  ciphertext / nonce as raw bytes, sender key referenced by `kid`; the
+#       conversation document maps kid -> public key (base64) under `keys`
+SCHEME_V1 = 'nacl-secretbox-x25519'
+SCHEME_V2 = 'nacl-secretbox-x25519-v2'
+
+NONCE_BYTES = 24
+PUBLIC_KEY_BYTES = 32
+
+# Store new messages compactly even when the client sent a v1 envelope
+COMPACT_ENVELOPES = os.getenv("COMPACT_ENVELOPES", "1") != "0"
+
+# ⏳ How far ahead an ephemeral message may expire (the UI offers up to 5 minutes)
+EPHEMERAL_MAX_SECONDS = int(os.getenv("EPHEMERAL_MAX_SECONDS", 7 * 24 * 3600))
+# Tolerated client clock skew for expiry times already in the past
+EPHEMERAL_SKEW = timedelta(days=1)
+
+# 🗄️ Messages per archive chunk (see app/services/archiver.py)
+ARCHIVE_CHUNK_SIZE = int(os.getenv("ARCHIVE_CHUNK_SIZE", 100))
+
+
+def key_id(public_key):
+    """Short, stable id for a 32-byte public key (8 url-safe chars)."""
+    digest = hashlib.sha256(public_key).digest()[:6]
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+def _b64(raw):
+    return base64.b64encode(raw).decode()
+
+
+def _raw(value, name, size=None):
+    """Bytes from a bytes field (msgpack) or a base64 string (JSON)."""
+    if isinstance(value, str):
+        if len(value) > MAX_FIELD_LENGTH:
+            raise ValueError(f"Invalid {name}")
+        try:
+            value = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError):
+            raise ValueError(f"Invalid {name}")
+    if not isinstance(value, bytes) or len(value) > MAX_FIELD_LENGTH or (size and len(value) != size):
+        raise ValueError(f"Invalid {name}")
+    return value
+
+
+class KeyRing:
+    """
+    Sender public keys of one conversation by key id; reloads the conversation
+    on an unknown id. `load` supplies the conversation for the first reload
+    (e.g. waits on a read already in flight) instead of reading it again.
+    """
+
+    def __init__(self, store, convo_id, keys=None, load=None):
+        self.store = store
+        self.convo_id = convo_id
+        self.keys = dict(keys) if keys else None
+        self._load = load
+
+    def get(self, kid):
+        if self.keys is None or kid not in self.keys:
+            load, self._load = self._load, None
+            convo = (load() if load else self.store.conversations.get(self.convo_id)) or {}
+            self.keys = dict(self.keys or {}, **(convo.get('keys') or {}))
+        return self.keys.get(kid)
+
+    def remember(self, kid, public_b64):
+        if self.keys is None:
+            self.keys = {}
+        self.keys.setdefault(kid, public_b64)
+
+    def table(self, kids):
+        """{kid: raw public key} for the given ids (msgpack responses)."""
+        out = {}
+        for kid in kids:
+            public_b64 = self.get(kid)
+            if public_b64:
+                out[kid] = base64.b64decode(public_b64)
+        return out
+
+
+def clean_message(doc_id, msg, keys=None, binary=False):
+    """
+    Shape a stored message for the client (still encrypted).
+
+    JSON (default): a v1 envelope with base64 strings, whatever the stored
+    format. binary=True (msgpack): a v2 envelope with raw bytes and `kid`.
+    """
+    created_at = msg.get("created_at")
+    expires_at = msg.get("expiresAt")
+    ciphertext, nonce = msg.get("ciphertext"), msg.get("nonce")
+    kid, sender_pub = msg.get("kid"), msg.get("sender_pub")
+
+    if binary:
+        if isinstance(ciphertext, str):
+            ciphertext, nonce = base64.b64decode(ciphertext), base64.b64decode(nonce)
+        if not kid and sender_pub:
+            kid = key_id(base64.b64decode(sender_pub))
+            if keys is not None:
+                keys.remember(kid, sender_pub)
+        envelope = {"ciphertext": ciphertext, "nonce": nonce, "kid": kid, "scheme": SCHEME_V2}
+    else:
+        if isinstance(ciphertext, bytes):
+            ciphertext, nonce = _b64(ciphertext), _b64(nonce)
+        if kid and not sender_pub:
+            sender_pub = keys.get(kid) if keys is not None else None
+        scheme = msg.get("scheme")
+        envelope = {"ciphertext": ciphertext, "nonce": nonce, "sender_pub": sender_pub,
+                    "scheme": SCHEME_V1 if scheme == SCHEME_V2 else scheme}
+
+    return {
+        "id": doc_id,
+        **envelope,
+        "from": msg.get("from"),
+        "ephemeral": msg.get("ephemeral", False),
+        "timestamp": created_at.strftime('%Y-%m-%dT%H:%M:%SZ') if created_at else '',
+        "expiresAt": expires_at.isoformat() if isinstance(expires_at, datetime) else None
+    }
+
+
+def build_message(data, sender_id, keys=None):
+    """
+    Validate one client envelope and return the document to store.
+
+    Accepts v1 (base64 strings) and v2 (raw bytes, e.g. from msgpack). With a
+    `keys` dict the message is stored compactly and its sender key is added
+    to `keys` (kid -> base64) for the conversation document.
+
+    Raises ValueError with a client-facing reason if the envelope is unusable.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Message must be an object")
+
+    required = ('ciphertext', 'nonce', 'sender_pub')
+    if not all(k in data for k in required):
+        raise ValueError("Missing fields")
+    scheme = data.get("scheme", SCHEME_V1)
+    if scheme not in (SCHEME_V1, SCHEME_V2):
+        raise ValueError("Invalid scheme")
+
+    ciphertext = _raw(data["ciphertext"], "ciphertext")
+    nonce = _raw(data["nonce"], "nonce", NONCE_BYTES)
+    sender_pub = _raw(data["sender_pub"], "sender_pub", PUBLIC_KEY_BYTES)
+
+    ephemeral = bool(data.get("ephemeral", False))
+    expires_raw = data.get("expiresAt")
+
+    if keys is not None and (COMPACT_ENVELOPES or scheme == SCHEME_V2):
+        kid = key_id(sender_pub)
+        keys[kid] = _b64(sender_pub)
+        message = {"ciphertext": ciphertext, "nonce": nonce, "kid": kid, "scheme": SCHEME_V2}
+    else:
+        message = {"ciphertext": _b64(ciphertext), "nonce": _b64(nonce), "sender_pub": _b64(sender_pub),
+                   "scheme": SCHEME_V1}
+
+    message.update({
+        "from": sender_id,
+        "ephemeral": ephemeral,
+    })
+    if ephemeral:
+        message["expiresAt"] = _expires_at(expires_raw)
+    return message
+
+
+def _expires_at(expires_raw):
+    """expiresAt (epoch milliseconds) as a datetime, within a sane window around now."""
+    invalid = ValueError("Missing or invalid expiresAt for ephemeral message")
+    if not isinstance(expires_raw, (int, float)) or isinstance(expires_raw, bool):
+        raise invalid
+    now = datetime.now(timezone.utc)
+    try:
+        if not math.isfinite(expires_raw):
+            raise invalid
+        expires_at = datetime.fromtimestamp(expires_raw / 1000, tz=timezone.utc)
+    except (OverflowError, OSError, ValueError):
+        raise invalid
+    if not now - EPHEMERAL_SKEW <= expires_at <= now + timedelta(seconds=EPHEMERAL_MAX_SECONDS):
+        raise invalid
+    return expires_at
+
+
+def is_expired(msg, now):
+    expires = msg.get('expiresAt')
+    return bool(msg.get("ephemeral")) and isinstance(expires, datetime) and expires < now
+
+
+# 🔖 Keyset cursors: opaque "<created_at iso>|<doc id>" tokens
+def encode_cursor(created_at, doc_id):
+    raw = f"{created_at.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        raw = base64.urlsafe_b64decode(padded.encode()).decode()
+        ts, doc_id = raw.split('|', 1)
+        return datetime.fromisoformat(ts), doc_id
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def _archived(store, convo_id, before, wanted):
+    """Archived messages older than `before`, newest first, fetched a few chunks per query."""
+    per_query = -(-wanted // ARCHIVE_CHUNK_SIZE) + 1
+    cursor = before
+    while True:
+        chunks = store.archives.newest_first(convo_id, cursor, per_query)
+        for chunk in chunks:
+            for msg in reversed(chunk['messages']):
+                key = (msg['created_at'], msg['id'])
+                if before is None or key < before:
+                    yield key, msg['id'], msg
+        if len(chunks) < per_query:
+            return
+        cursor = (chunks[-1]['start_at'], chunks[-1]['start_id'])
+
+
+def history_page(store, convo_id, before=None, limit=50, now=None, keys=None, binary=False, archived=None):
+    """
+    Return (messages, next_cursor) for one page of history, newest page first.
+
+    Messages inside the page are oldest-first so they can be rendered as-is.
+    `before` is a cursor from a previous page; `next_cursor` is None once the
+    beginning of the conversation has been reached. `keys` (a KeyRing)
+    resolves compact messages' sender keys; see clean_message for `binary`.
+
+    Archive chunks are merged in when the live messages run out. `archived`
+    says whether the conversation has any (its `archive_chunks`), or is a
+    callable answering that; None means unknown, so look.
+    """
+    now = now or datetime.now(timezone.utc)
+    if before:
+        before = decode_cursor(before)
+
+    keys = keys or KeyRing(store, convo_id)
+    stream = list(islice(store.messages.newest_first(convo_id, before, limit + 1, now), limit + 1))
+    # Live persistent messages are all newer than every archived one, so a full
+    # page ending on one needs no archive read
+    if len(stream) <= limit or stream[-1][2].get('ephemeral'):
+        if callable(archived):
+            archived = archived()
+        if archived is None or archived:
+            stream = heapq.merge(stream, _archived(store, convo_id, before, limit + 1),
+                                 key=itemgetter(0), reverse=True)
+
+    messages = []
+    next_cursor = None
+    for i, (_, doc_id, msg) in enumerate(stream):
+        if i == limit:
+            break
+        next_cursor = encode_cursor(msg.get("created_at") or EPOCH, doc_id)
+        if is_expired(msg, now):
+            read_stats['expired_skipped'] += 1
+            continue
+        messages.append(clean_message(doc_id, msg, keys, binary))
+    else:
+        next_cursor = None
+
+    messages.reverse()
+    return messages, next_cursor
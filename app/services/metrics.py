@@ -0,0 +1,247 @@
+"""
+Request-scoped instrumentation and a Prometheus text exposition.
+
+Every request gets a breakdown (flask.g) of where its time went: backend
+reads/writes/queries, external HTTP calls (Identity Toolkit, Cloudinary,
+cert fetches) and template rendering. The same timings feed process-wide
+histograms served by /metrics. Numbers are per process; each worker exports
+its own.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request, template_rendered, before_render_template
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 0))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CALL_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = sorted((k, ([*v[0]], v[1], v[2])) for k, v in self.series.items())
+        for label_values, (counts, total, count) in snapshot:
+            labels = _labels(self.labels, label_values)
+            for bound, n in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="{bound:g}"}} {n}')
+            lines.append(f'{self.name}_bucket{{{labels}{"," if labels else ""}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:.6f}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+# 📊 Registry
+request_seconds = Histogram(
+    "securechat_request_seconds", "Request latency by route.", ("endpoint", "method", "status"))
+backend_seconds = Histogram(
+    "securechat_backend_seconds", "Storage backend call latency.", ("kind", "op"))
+request_backend_calls = Histogram(
+    "securechat_request_backend_calls", "Storage backend calls per request.", ("endpoint", "kind"),
+    buckets=CALL_BUCKETS)
+external_seconds = Histogram(
+    "securechat_external_seconds", "Outbound HTTP call latency.", ("service",))
+template_seconds = Histogram(
+    "securechat_template_seconds", "Template render time.", ("template",))
+call_answer_seconds = Histogram(
+    "securechat_call_answer_seconds", "Time a call rang before the callee answered.", ("kind",),
+    buckets=(0.5, 1.0, 2.5, 5.0, 10.0, 15.0, 20.0, 30.0, 60.0))
+
+REGISTRY = [request_seconds, backend_seconds, request_backend_calls, external_seconds, template_seconds,
+            call_answer_seconds]
+
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# 🧾 Per-request breakdown: {category: [calls, seconds]}
+_note_lock = threading.Lock()
+
+
+def _breakdown():
+    if not has_request_context():
+        return None
+    if 'metrics_breakdown' not in g:
+        g.metrics_breakdown = {}
+    return g.metrics_breakdown
+
+
+def _note(category, seconds):
+    breakdown = _breakdown()
+    if breakdown is not None:
+        # Concurrent fetches (app.services.fetch) note into the same request
+        with _note_lock:
+            entry = breakdown.setdefault(category, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def record_backend(kind, op, seconds):
+    backend_seconds.observe(seconds, kind, op)
+    _note(f"backend.{kind}", seconds)
+
+
+def record_external(service, seconds):
+    external_seconds.observe(seconds, service)
+    _note(f"http.{service}", seconds)
+
+
+@contextmanager
+def timed_external(service):
+    """Time an outbound call made through a client we can't hook (Cloudinary, firebase_admin)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_external(service, time.perf_counter() - started)
+
+
+def http_hook(service):
+    """requests response hook: records the time until response headers arrived."""
+    def hook(response, *args, **kwargs):
+        if getattr(response, 'from_cache', False):
+            return  # answered by CacheControl, no network involved
+        record_external(service, response.elapsed.total_seconds())
+    return hook
+
+
+# 🗄️ Storage instrumentation
+KINDS = {
+    'get': 'read', 'get_many': 'read', 'find_by_username': 'read', 'lookup': 'read',
+    'list_for_user': 'query', 'newest_first': 'query', 'oldest_first_after': 'query', 'expired': 'query',
+    'search_prefix': 'query', 'scan': 'query',
+    'create': 'write', 'update': 'write', 'ensure': 'write', 'add_batch': 'write',
+    'delete': 'write', 'add': 'write', 'set': 'write', 'reserve': 'write', 'release': 'write',
+    'mark_read': 'write', 'request': 'write', 'accept': 'write', 'remove': 'write',
+    'recent': 'query', 'summary': 'query', 'set_summary': 'write',
+}
+
+
+class _InstrumentedRepo:
+    def __init__(self, name, repo):
+        self._name = name
+        self._repo = repo
+
+    def __getattr__(self, attr):
+        target = getattr(self._repo, attr)
+        kind = KINDS.get(attr)
+        if kind is None or not callable(target):
+            return target
+        op = f"{self._name}.{attr}"
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return target(*args, **kwargs)
+            finally:
+                record_backend(kind, op, time.perf_counter() - started)
+        return timed
+
+
+class InstrumentedStore:
+    """Wraps a store so every repository call is timed and counted."""
+
+    def __init__(self, store):
+        # Imported here: app.storage imports this module, so a top-level import is circular
+        from app.storage.base import REPOSITORIES
+        self.inner = store
+        self.name = store.name
+        for repo in REPOSITORIES:
+            setattr(self, repo, _InstrumentedRepo(repo, getattr(store, repo)))
+
+    def __getattr__(self, attr):
+        return getattr(self.inner, attr)
+
+
+def instrument_store(store):
+    if isinstance(store, InstrumentedStore) or os.getenv("METRICS_ENABLED", "1") == "0":
+        return store
+    return InstrumentedStore(store)
+
+
+# 🪝 Flask wiring
+def _before_render(sender, template, context, **extra):
+    if has_request_context():
+        g.metrics_render_started = time.perf_counter()
+
+
+def _rendered(sender, template, context, **extra):
+    started = g.pop('metrics_render_started', None) if has_request_context() else None
+    if started is not None:
+        seconds = time.perf_counter() - started
+        template_seconds.observe(seconds, template.name or '')
+        _note("template", seconds)
+
+
+def _format_breakdown(breakdown, total):
+    parts = [f"{name} {calls}x {seconds * 1000:.1f}ms" for name, (calls, seconds) in sorted(breakdown.items())]
+    accounted = sum(seconds for name, (_, seconds) in breakdown.items())
+    parts.append(f"other {max(0.0, total - accounted) * 1000:.1f}ms")
+    return ", ".join(parts)
+
+
+def init_app(app):
+    def start_timer():
+        g.metrics_started = time.perf_counter()
+        g.metrics_breakdown = {}
+
+    def finish(response):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return response
+        total = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        request_seconds.observe(total, endpoint, request.method, response.status_code)
+
+        breakdown = g.get('metrics_breakdown') or {}
+        for kind in ('read', 'write', 'query'):
+            calls = breakdown.get(f"backend.{kind}", (0, 0.0))[0]
+            request_backend_calls.observe(calls, endpoint, kind)
+
+        if SLOW_REQUEST_MS and total * 1000 >= SLOW_REQUEST_MS:
+            logger.warning("Slow request %s %s -> %s in %.0f ms: %s", request.method, request.path,
+                           response.status_code, total * 1000, _format_breakdown(breakdown, total))
+        return response
+
+    app.before_request(start_timer)
+    app.after_request(finish)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
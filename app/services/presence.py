@@ -0,0 +1,210 @@
+"""
+Presence and typing indicators.
+
+Heartbeats, open chat streams and typing pings only touch in-memory state
+here. Clients are told about changes, not pings: a user going online or
+offline, or starting or stopping to type, is one event on the chat streams
+(live_feed) of the conversations they take part in. Repeated heartbeats and
+keystrokes inside the TTLs are coalesced into nothing.
+
+- A user is online while they have an open chat stream, or for
+  PRESENCE_TTL seconds after their last heartbeat. Going offline is only
+  announced once that grace period has passed, so a page reload doesn't
+  flap.
+- Typing lasts TYPING_TTL after the last ping. An explicit stop is
+  debounced by TYPING_STOP_SECONDS, so typing again straight away sends
+  nothing. Sending a message clears it silently, because the message
+  itself tells the peer.
+- profiles.last_seen is written at most once per PRESENCE_WRITE_SECONDS
+  per user, from the sweeper thread and never on a request: a snapshot
+  while online, and the final one after going offline.
+
+State is per process, like the chat streams it rides on.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from . import live_feed, profile_cache
+
+logger = logging.getLogger(__name__)
+
+PRESENCE_TTL = float(os.getenv("PRESENCE_TTL", 45))
+TYPING_TTL = float(os.getenv("TYPING_TTL", 6))
+TYPING_STOP_SECONDS = float(os.getenv("TYPING_STOP_SECONDS", 1.5))
+WRITE_SECONDS = float(os.getenv("PRESENCE_WRITE_SECONDS", 60))
+SWEEP_SECONDS = 0.5
+
+
+class _User:
+    __slots__ = ('streams', 'active_at', 'online', 'seen_at', 'dirty', 'written_at')
+
+    def __init__(self):
+        self.streams = 0
+        self.active_at = time.monotonic()
+        self.online = False
+        self.seen_at = None      # wall clock, for last_seen
+        self.dirty = False       # seen_at not yet persisted
+        self.written_at = float('-inf')
+
+
+_lock = threading.Lock()
+_users = {}
+_typing = {}  # (convo_id, uid) -> monotonic expiry
+_sweeper = None
+
+
+def _event(uid, user):
+    return {'uid': uid, 'online': user.online, 'last_seen': user.seen_at.isoformat() if user.seen_at else None}
+
+
+def _touch(uid):
+    """Record activity (with _lock held); returns the presence event if the user just came online."""
+    user = _users.get(uid)
+    if user is None:
+        user = _users[uid] = _User()
+    user.active_at = time.monotonic()
+    user.seen_at = datetime.now(timezone.utc)
+    user.dirty = True
+    if not user.online:
+        user.online = True
+        return _event(uid, user)
+    return None
+
+
+def _announce(uid, event):
+    if event is not None:
+        live_feed.signal('presence', event, participant=uid)
+
+
+def heartbeat(uid):
+    _ensure_sweeper()
+    with _lock:
+        event = _touch(uid)
+    _announce(uid, event)
+
+
+def tracked(uid, frames, snapshot=()):
+    """
+    Wrap a chat stream generator: `uid` counts as online while it is open.
+    `snapshot` frames (the peer's current presence) are sent first.
+    """
+    _ensure_sweeper()
+    with _lock:
+        event = _touch(uid)
+        _users[uid].streams += 1
+    _announce(uid, event)
+    try:
+        yield from snapshot
+        yield from frames
+    finally:
+        with _lock:
+            user = _users.get(uid)
+            if user is not None:
+                user.streams -= 1
+                user.active_at = time.monotonic()
+                user.seen_at = datetime.now(timezone.utc)
+                user.dirty = True
+
+
+def typing(convo_id, uid, active=True):
+    """A typing ping (or an explicit stop) from `uid` in `convo_id`."""
+    _ensure_sweeper()
+    key = (convo_id, uid)
+    now = time.monotonic()
+    with _lock:
+        presence = _touch(uid)
+        started = False
+        if active:
+            started = key not in _typing
+            _typing[key] = now + TYPING_TTL
+        elif key in _typing:
+            _typing[key] = min(_typing[key], now + TYPING_STOP_SECONDS)
+    _announce(uid, presence)
+    if started:
+        live_feed.signal('typing', {'uid': uid, 'typing': True}, convo_id=convo_id)
+
+
+def clear_typing(convo_id, uid):
+    """The user sent a message: forget their typing state without an event (the message says it)."""
+    with _lock:
+        _typing.pop((convo_id, uid), None)
+
+
+def status(uid, profile=None):
+    """Presence event for `uid`; falls back to the stored last_seen when this process hasn't seen them."""
+    with _lock:
+        user = _users.get(uid)
+        if user is not None and (user.online or user.seen_at):
+            return _event(uid, user)
+    last_seen = (profile or {}).get('last_seen')
+    return {'uid': uid, 'online': False, 'last_seen': last_seen.isoformat() if last_seen else None}
+
+
+def is_typing(convo_id, uid):
+    with _lock:
+        return (convo_id, uid) in _typing
+
+
+def sweep(now=None):
+    """Expire typing and presence, announce the changes, persist due last_seen snapshots."""
+    now = now or time.monotonic()
+    stopped, offline, writes = [], [], []
+    with _lock:
+        for key, expires in list(_typing.items()):
+            if expires <= now:
+                del _typing[key]
+                stopped.append(key)
+
+        for uid, user in list(_users.items()):
+            if user.online and not user.streams and now - user.active_at > PRESENCE_TTL:
+                user.online = False
+                offline.append((uid, _event(uid, user)))
+            if user.dirty and now - user.written_at >= WRITE_SECONDS:
+                user.dirty = False
+                user.written_at = now
+                writes.append((uid, user.seen_at))
+            # Gone, written and past the write interval: nothing left to remember
+            if not user.online and not user.streams and not user.dirty and now - user.written_at >= WRITE_SECONDS:
+                del _users[uid]
+
+    for convo_id, uid in stopped:
+        live_feed.signal('typing', {'uid': uid, 'typing': False}, convo_id=convo_id)
+    for uid, event in offline:
+        live_feed.signal('presence', event, participant=uid)
+    for uid, seen_at in writes:
+        try:
+            # Write-through, so status() never falls back to a stale cached last_seen
+            profile_cache.update_profile(uid, {'last_seen': seen_at})
+        except Exception as e:
+            logger.warning("Failed to save last_seen for %s: %s", uid, e)
+    return {'typing_stopped': len(stopped), 'offline': len(offline), 'writes': len(writes)}
+
+
+def _sweep_forever():
+    while True:
+        time.sleep(SWEEP_SECONDS)
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Presence sweeper failed")
+
+
+def _ensure_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        with _lock:
+            if _sweeper is None:
+                _sweeper = threading.Thread(target=_sweep_forever, name='presence-sweeper', daemon=True)
+                _sweeper.start()
+
+
+def stats():
+    with _lock:
+        return {
+            'users': len(_users),
+            'online': sum(1 for user in _users.values() if user.online),
+            'typing': len(_typing)
+        }
@@ -0,0 +1,151 @@
+import os
+import threading
+from collections import Counter
+
+from cachetools import TTLCache
+
+from app.services import fetch
+from app.storage import get_store
+from app.storage.base import username_key
+
+# ⚙️ Sizing (per process)
+MAX_SIZE = int(os.getenv("PROFILE_CACHE_SIZE", 5000))
+TTL = float(os.getenv("PROFILE_CACHE_TTL", 300))
+NEGATIVE_TTL = float(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", 30))
+PREFIX_TTL = float(os.getenv("USERNAME_PREFIX_CACHE_TTL", 30))
+# Misses beyond this many are split into batches fetched concurrently
+FETCH_CHUNK = int(os.getenv("PROFILE_FETCH_CHUNK", 25))
+
+# TTLCache evicts least-recently-used entries once full, so hot profiles stay
+# resident and cold ones age out. Misses are remembered separately with a
+# shorter TTL so a new signup becomes visible quickly.
+_profiles = TTLCache(maxsize=MAX_SIZE, ttl=TTL)
+_missing = TTLCache(maxsize=MAX_SIZE, ttl=NEGATIVE_TTL)
+_usernames = TTLCache(maxsize=MAX_SIZE, ttl=TTL)
+_missing_usernames = TTLCache(maxsize=MAX_SIZE, ttl=NEGATIVE_TTL)
+# Typeahead results for hot prefixes ("a", "al", ...): short-lived, small
+_prefixes = TTLCache(maxsize=1000, ttl=PREFIX_TTL)
+_lock = threading.RLock()
+
+cache_stats = Counter()
+
+
+def _store(uid, data):
+    with _lock:
+        if data is None:
+            _profiles.pop(uid, None)
+            _missing[uid] = True
+        else:
+            _missing.pop(uid, None)
+            _profiles[uid] = data
+
+
+def _lookup(uid):
+    """Return (found, data) without touching Firestore."""
+    with _lock:
+        if uid in _profiles:
+            cache_stats['hits'] += 1
+            return True, _profiles[uid]
+        if uid in _missing:
+            cache_stats['negative_hits'] += 1
+            return True, None
+        cache_stats['misses'] += 1
+    return False, None
+
+
+def get_profile(uid):
+    """Profile dict for `uid` (a copy, safe to mutate) or None if it doesn't exist."""
+    found, data = _lookup(uid)
+    if not found:
+        data = get_store().profiles.get(uid)
+        _store(uid, data)
+    return dict(data) if data is not None else None
+
+
+def get_profiles(uids):
+    """
+    Batch lookup: {uid: profile} for every uid that exists. Misses are read
+    in batches of FETCH_CHUNK, issued concurrently when there are several.
+    """
+    result = {}
+    pending = []
+    for uid in dict.fromkeys(uids):
+        found, data = _lookup(uid)
+        if not found:
+            pending.append(uid)
+        elif data is not None:
+            result[uid] = dict(data)
+
+    if pending:
+        store = get_store()
+        chunks = [pending[i:i + FETCH_CHUNK] for i in range(0, len(pending), FETCH_CHUNK)]
+        fetched = {}
+        for part in fetch.gather(*[(store.profiles.get_many, chunk) for chunk in chunks]):
+            fetched.update(part)
+        for uid in pending:
+            data = fetched.get(uid)
+            _store(uid, data)
+            if data is not None:
+                result[uid] = dict(data)
+    return result
+
+
+def find_uid_by_username(username):
+    """Case-insensitive: one keyed read of the username reservation on a miss."""
+    key = username_key(username)
+    with _lock:
+        if key in _usernames:
+            cache_stats['hits'] += 1
+            return _usernames[key]
+        if key in _missing_usernames:
+            cache_stats['negative_hits'] += 1
+            return None
+        cache_stats['misses'] += 1
+    uid = get_store().usernames.lookup(key)
+    with _lock:
+        if uid is None:
+            _missing_usernames[key] = True
+        else:
+            _usernames[key] = uid
+    return uid
+
+
+def search_usernames(prefix, limit):
+    """Up to `limit` profiles whose username starts with `prefix` (case-insensitive), name order."""
+    key = (username_key(prefix), limit)
+    with _lock:
+        if key in _prefixes:
+            cache_stats['prefix_hits'] += 1
+            return [(uid, dict(data)) for uid, data in _prefixes[key]]
+        cache_stats['prefix_misses'] += 1
+    rows = get_store().profiles.search_prefix(key[0], limit)
+    with _lock:
+        _prefixes[key] = rows
+    for uid, data in rows:
+        _store(uid, data)
+    return [(uid, dict(data)) for uid, data in rows]
+
+
+def invalidate(uid, username=None):
+    with _lock:
+        _profiles.pop(uid, None)
+        _missing.pop(uid, None)
+        if username is not None:
+            name = username_key(username)
+            _usernames.pop(name, None)
+            _missing_usernames.pop(name, None)
+            # Drop every cached prefix the name falls under so it shows up in typeahead
+            for key in [k for k in _prefixes if name.startswith(k[0])]:
+                _prefixes.pop(key, None)
+        cache_stats['invalidations'] += 1
+
+
+def update_profile(uid, fields):
+    """Write-through update: persist `fields` then drop the stale cache entry."""
+    get_store().profiles.update(uid, fields)
+    invalidate(uid)
+
+
+def stats():
+    with _lock:
+        return dict(cache_stats, size=len(_profiles), negative_size=len(_missing), prefix_size=len(_prefixes))
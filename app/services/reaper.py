@@ -0,0 +1,83 @@
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_KEY = 'message_reaper'
+
+# Every deleted message may also touch its conversation summary, so keep the
+# number of writes per batch comfortably under Firestore's 500 limit.
+MAX_BATCH_SIZE = 200
+
+
+def load_checkpoint(store):
+    data = store.meta.get(CHECKPOINT_KEY)
+    if not data or not data.get('last_expires_at') or not data.get('last_path'):
+        return None
+    return data['last_expires_at'], data['last_path']
+
+
+def save_checkpoint(store, checkpoint, stats):
+    last_expires_at, last_path = checkpoint if checkpoint else (None, None)
+    store.meta.set(CHECKPOINT_KEY, {
+        'last_expires_at': last_expires_at,
+        'last_path': last_path,
+        'last_run_deleted': stats['deleted']
+    })
+
+
+def reap_expired(store, now=None, batch_size=100, pause=0.0, max_seconds=None, resume=True):
+    """
+    Delete expired ephemeral messages across all conversations.
+
+    Works through the expired messages in `expiresAt` order one batch at a
+    time, sleeping `pause` seconds between batches. Progress is checkpointed
+    after every batch so an interrupted run (or one cut short by
+    `max_seconds`) picks up where it left off. Returns throughput stats.
+    """
+    now = now or datetime.now(timezone.utc)
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    checkpoint = load_checkpoint(store) if resume else None
+
+    stats = Counter()
+    started = time.monotonic()
+    finished = False
+
+    while True:
+        if max_seconds is not None and time.monotonic() - started >= max_seconds:
+            break
+
+        expired = store.messages.expired(now, batch_size, after=checkpoint)
+        if not expired:
+            finished = True
+            break
+
+        store.messages.delete([path for _, path in expired])
+
+        checkpoint = expired[-1]
+        stats['deleted'] += len(expired)
+        stats['batches'] += 1
+        save_checkpoint(store, checkpoint, stats)
+
+        if len(expired) < batch_size:
+            finished = True
+            break
+        if pause:
+            time.sleep(pause)
+
+    # A full pass clears the checkpoint so the next run starts from the beginning
+    if finished:
+        save_checkpoint(store, None, stats)
+
+    elapsed = time.monotonic() - started
+    result = {
+        'deleted': stats['deleted'],
+        'batches': stats['batches'],
+        'elapsed_seconds': round(elapsed, 3),
+        'deleted_per_second': round(stats['deleted'] / elapsed, 1) if elapsed > 0 else 0.0,
+        'complete': finished
+    }
+    logger.info("Message reaper: %s", result)
+    return result
@@ -0,0 +1,244 @@
+"""
+Server-side sessions.
+
+The cookie carries only an opaque random id; session data stays on the
+server, so every request uploads ~50 bytes instead of a signed ~1.5KB blob
+(the Firebase ID token alone is ~1KB) and nothing is HMAC-verified or
+deserialized on requests that never touch the session.
+
+SESSION_BACKEND picks the store:
+    cookie (default)  Flask's signed cookie, for serverless hosts without shared state
+    memory            per-process LRU of SESSION_MEMORY_SIZE sessions (single process, dev)
+    sqlite            SESSION_SQLITE_PATH, shared by every worker on the host
+
+Server-side sessions expire after PERMANENT_SESSION_LIFETIME without a
+request and can be revoked: revoke_user(uid) ends every session of a user.
+"""
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+BACKENDS = ('cookie', 'memory', 'sqlite')
+
+MEMORY_SIZE = int(os.getenv("SESSION_MEMORY_SIZE", 10000))
+SQLITE_PATH = os.getenv("SESSION_SQLITE_PATH", "sessions.db")
+
+# Idle expiry is pushed forward at most this often (fraction of the lifetime),
+# so a busy session is not rewritten on every request
+TOUCH_FRACTION = 0.1
+
+SID_RE = re.compile(r'^[A-Za-z0-9_-]{32,64}$')
+
+serializer = TaggedJSONSerializer()
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.modified = False
+        self.accessed = False
+        self.rotate = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+
+class MemorySessions:
+    """LRU of serialized sessions; the least recently used is dropped when full."""
+
+    def __init__(self, max_size=MEMORY_SIZE):
+        self.max_size = max_size
+        self.rows = OrderedDict()  # sid -> (data, uid, expires_at)
+        self.lock = threading.Lock()
+
+    def get(self, sid):
+        with self.lock:
+            row = self.rows.get(sid)
+            if row is None:
+                return None
+            if row[2] <= time.time():
+                del self.rows[sid]
+                return None
+            self.rows.move_to_end(sid)
+            return row[0], row[2]
+
+    def set(self, sid, data, uid, expires_at):
+        with self.lock:
+            self.rows[sid] = (data, uid, expires_at)
+            self.rows.move_to_end(sid)
+            while len(self.rows) > self.max_size:
+                self.rows.popitem(last=False)
+
+    def touch(self, sid, expires_at):
+        with self.lock:
+            row = self.rows.get(sid)
+            if row is not None:
+                self.rows[sid] = (row[0], row[1], expires_at)
+
+    def delete(self, sid):
+        with self.lock:
+            self.rows.pop(sid, None)
+
+    def delete_user(self, uid):
+        with self.lock:
+            sids = [sid for sid, row in self.rows.items() if row[1] == uid]
+            for sid in sids:
+                del self.rows[sid]
+        return len(sids)
+
+
+class SqliteSessions:
+    """One row per session in a local SQLite file; expired rows are purged now and then."""
+
+    PURGE_EVERY = 500
+
+    def __init__(self, path=SQLITE_PATH):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS sessions (
+                id          TEXT PRIMARY KEY,
+                uid         TEXT,
+                data        TEXT NOT NULL,
+                expires_at  REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_sessions_uid ON sessions (uid);
+            CREATE INDEX IF NOT EXISTS idx_sessions_expiry ON sessions (expires_at);
+        """)
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    def get(self, sid):
+        with self.lock:
+            row = self.conn.execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+                                    (sid, time.time())).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def set(self, sid, data, uid, expires_at):
+        with self.lock:
+            self.conn.execute("INSERT OR REPLACE INTO sessions (id, uid, data, expires_at) VALUES (?, ?, ?, ?)",
+                              (sid, uid, data, expires_at))
+            self.writes += 1
+            if self.writes % self.PURGE_EVERY == 0:
+                self.conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+
+    def touch(self, sid, expires_at):
+        with self.lock:
+            self.conn.execute("UPDATE sessions SET expires_at = ? WHERE id = ?", (expires_at, sid))
+
+    def delete(self, sid):
+        with self.lock:
+            self.conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def delete_user(self, uid):
+        with self.lock:
+            return self.conn.execute("DELETE FROM sessions WHERE uid = ?", (uid,)).rowcount
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        # Static files never read the session: skip the lookup entirely
+        if app.static_url_path and request.path.startswith(app.static_url_path + '/'):
+            return ServerSession()
+        sid = request.cookies.get(self.get_cookie_name(app), '')
+        if SID_RE.match(sid):
+            row = self.backend.get(sid)
+            if row is not None:
+                data, expires_at = row
+                return ServerSession(serializer.loads(data), sid=sid, expires_at=expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and session.sid:
+                self.backend.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app),
+                                       samesite=self.get_cookie_samesite(app))
+            return
+
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        expires_at = time.time() + lifetime
+        new_sid = session.sid is None or session.rotate
+        if new_sid:
+            if session.sid:
+                self.backend.delete(session.sid)
+            session.sid = secrets.token_urlsafe(32)
+
+        if new_sid or session.modified:
+            self.backend.set(session.sid, serializer.dumps(dict(session)), session.get('user_id'), expires_at)
+        elif session.expires_at is not None and expires_at - session.expires_at > lifetime * TOUCH_FRACTION:
+            self.backend.touch(session.sid, expires_at)
+        else:
+            return
+
+        if new_sid or (session.permanent and self.should_set_cookie(app, session)):
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                domain=domain, path=path,
+                secure=self.get_cookie_secure(app), httponly=self.get_cookie_httponly(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def build_backend(name):
+    if name == 'memory':
+        return MemorySessions()
+    if name == 'sqlite':
+        return SqliteSessions()
+    raise ValueError(f"Unknown SESSION_BACKEND {name!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def init_app(app):
+    name = os.getenv("SESSION_BACKEND", "cookie").lower()
+    if name != 'cookie':
+        app.session_interface = ServerSessionInterface(build_backend(name))
+
+
+def rotate(session):
+    """Issue a new session id on the next response (call on login, against fixation)."""
+    if isinstance(session, ServerSession):
+        session.rotate = True
+
+
+def revoke_user(app, uid):
+    """End every server-side session of `uid`. Returns how many were dropped (0 for cookie sessions)."""
+    interface = app.session_interface
+    if not isinstance(interface, ServerSessionInterface):
+        return 0
+    return interface.backend.delete_user(uid)
@@ -0,0 +1,349 @@
+"""
+WebRTC call signaling.
+
+Offers, answers and ICE candidates only pass between the two browsers, so
+they are relayed through per-user mailboxes in this process and delivered
+over SSE (or long-poll) instead of being written to the store. Setting up
+a call costs no backend round trips; the one write is the call record
+when the call ends.
+
+A mailbox keeps its last MAILBOX_SIZE events with sequence numbers, so a
+client that reconnects (or a second tab, or the call page opened from a
+ring in the chat page) catches up from its cursor. A client without a
+cursor gets the buffered events of its calls that are still live.
+
+A sweeper thread ends calls that ring out (CALL_RING_SECONDS) and calls
+where a party has had no open event stream for CALL_DROP_SECONDS.
+
+Everything lives in one process: both parties must reach the same one, so
+run a single (threaded) worker or route /calls by user.
+"""
+import itertools
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from app.models.call import ACTIVE, CANCELLED, COMPLETED, DECLINED, DROPPED, KINDS, MISSED, RINGING, Call
+from app.storage import get_store
+from . import metrics
+from .live_feed import HEARTBEAT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+RING_SECONDS = float(os.getenv("CALL_RING_SECONDS", 30))
+DROP_SECONDS = float(os.getenv("CALL_DROP_SECONDS", 30))
+POLL_SECONDS = float(os.getenv("CALL_POLL_SECONDS", 25))
+MAX_SDP_BYTES = int(os.getenv("CALL_MAX_SDP_BYTES", 32 * 1024))
+MAX_CANDIDATES = int(os.getenv("CALL_MAX_CANDIDATES", 200))  # per party per call
+MAX_CANDIDATE_BYTES = 1024
+MAILBOX_SIZE = 256
+MAILBOX_IDLE_SECONDS = 300
+SWEEP_SECONDS = 1.0
+
+ICE_SERVERS = json.loads(os.getenv("CALL_ICE_SERVERS") or '[{"urls": "stun:stun.l.google.com:19302"}]')
+
+# Cursors are "<epoch>.<seq>"; a cursor from another process (or before a restart) is ignored
+EPOCH = secrets.token_hex(4)
+
+
+class CallError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class Mailbox:
+    def __init__(self):
+        self.events = deque(maxlen=MAILBOX_SIZE)  # (seq, event)
+        self.cond = threading.Condition(_lock)
+        self.listeners = 0
+        self.idle_since = time.monotonic()
+
+
+# One lock for calls and mailboxes; each mailbox's condition shares it
+_lock = threading.Lock()
+_calls = {}
+_mailboxes = {}
+_seq = itertools.count(1)
+_sweeper = None
+
+
+# 📬 Mailboxes (call with _lock held)
+def _mailbox(uid):
+    mailbox = _mailboxes.get(uid)
+    if mailbox is None:
+        mailbox = _mailboxes[uid] = Mailbox()
+    return mailbox
+
+
+def _post(uid, event):
+    mailbox = _mailbox(uid)
+    mailbox.events.append((next(_seq), event))
+    mailbox.cond.notify_all()
+
+
+def _resume(mailbox, after):
+    """(events to send now, cursor to wait from) for a client resuming at `after`."""
+    if after is not None:
+        return [e for e in mailbox.events if e[0] > after], after
+    last = mailbox.events[-1][0] if mailbox.events else 0
+    live = [e for e in mailbox.events if e[1]['call_id'] in _calls]
+    return live, last
+
+
+def cursor(seq):
+    return f"{EPOCH}.{seq}"
+
+
+def parse_cursor(text):
+    epoch, _, seq = (text or '').partition('.')
+    if epoch != EPOCH or not seq.isdigit():
+        return None
+    return int(seq)
+
+
+@contextmanager
+def _listening(uid):
+    """Counts an open event stream (or poll) for `uid`; calls of users with none are dropped."""
+    with _lock:
+        mailbox = _mailbox(uid)
+        mailbox.listeners += 1
+        mailbox.idle_since = None
+    try:
+        yield mailbox
+    finally:
+        with _lock:
+            mailbox.listeners -= 1
+            if not mailbox.listeners:
+                mailbox.idle_since = time.monotonic()
+
+
+def _wait(mailbox, after, timeout):
+    deadline = time.monotonic() + timeout
+    with _lock:
+        while True:
+            events = [e for e in mailbox.events if e[0] > after]
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            mailbox.cond.wait(remaining)
+
+
+def _frame(seq, event):
+    return f"id: {cursor(seq)}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_stream(uid, after=None):
+    """Generator of SSE frames with `uid`'s call events; heartbeats keep proxies from closing it."""
+    with _listening(uid) as mailbox:
+        yield "retry: 2000\n\n"
+        with _lock:
+            events, seq = _resume(mailbox, after)
+        while True:
+            for seq, event in events:
+                yield _frame(seq, event)
+            events = _wait(mailbox, seq, HEARTBEAT_SECONDS)
+            if not events:
+                yield ": ping\n\n"
+
+
+def poll(uid, after=None, timeout=POLL_SECONDS):
+    """Long-poll: events after the cursor, waiting up to `timeout` for one. Returns (events, cursor)."""
+    with _listening(uid) as mailbox:
+        with _lock:
+            events, seq = _resume(mailbox, after)
+        if not events:
+            events = _wait(mailbox, seq, timeout)
+    if events:
+        seq = events[-1][0]
+    return [event for _, event in events], cursor(seq)
+
+
+# ✅ Payload checks: SDP and candidates are opaque, only their shape and size are enforced
+def _description(data, kind):
+    if not isinstance(data, dict) or data.get('type') != kind or not isinstance(data.get('sdp'), str):
+        raise CallError(f"Expected an {kind} session description")
+    if len(data['sdp']) > MAX_SDP_BYTES:
+        raise CallError("Session description too large", 413)
+    return {'type': kind, 'sdp': data['sdp']}
+
+
+def _candidate(data):
+    if not isinstance(data, dict) or not isinstance(data.get('candidate'), str) \
+            or len(data['candidate']) > MAX_CANDIDATE_BYTES:
+        raise CallError("Invalid ICE candidate")
+    clean = {'candidate': data['candidate']}
+    if isinstance(data.get('sdpMid'), str):
+        clean['sdpMid'] = data['sdpMid'][:32]
+    if isinstance(data.get('sdpMLineIndex'), int):
+        clean['sdpMLineIndex'] = data['sdpMLineIndex']
+    return clean
+
+
+# 📞 Call lifecycle
+def _live_call(call_id, uid):
+    call = _calls.get(call_id)
+    if call is None or not call.has(uid):
+        raise CallError("No such call", 404)
+    return call
+
+
+def _end(call, outcome, by=None):
+    """End a live call (with _lock held) and tell both parties. Returns it for _persist."""
+    call.end(outcome, by)
+    del _calls[call.id]
+    event = dict(call.summary(), type='hangup', outcome=outcome, by=by)
+    _post(call.caller, event)
+    _post(call.callee, event)
+    return call
+
+
+def _hang_up(call, uid):
+    if call.state == ACTIVE:
+        return _end(call, COMPLETED, uid)
+    return _end(call, CANCELLED if uid == call.caller else DECLINED, uid)
+
+
+def _persist(calls):
+    """One write per finished call; outside the lock so a slow store never stalls signaling."""
+    if not calls:
+        return
+    store = get_store()
+    for call in calls:
+        try:
+            store.calls.add(call.id, call.to_record())
+        except Exception as e:
+            logger.warning("Failed to save call record %s: %s", call.id, e)
+
+
+def start_call(caller, callee, kind, offer):
+    """Ring `callee` with the caller's SDP offer. Any call the caller was still in is ended first."""
+    if kind not in KINDS:
+        raise CallError(f"Call kind must be one of {', '.join(KINDS)}")
+    if caller == callee:
+        raise CallError("Cannot call yourself")
+    offer = _description(offer, 'offer')
+
+    _ensure_sweeper()
+    with _lock:
+        ended = [_hang_up(call, caller) for call in list(_calls.values()) if call.has(caller)]
+        busy = any(call.has(callee) for call in _calls.values())
+        if not busy:
+            call = Call(caller, callee, kind, RING_SECONDS)
+            _calls[call.id] = call
+            _post(callee, dict(call.summary(), type='ring', offer=offer))
+            # The caller's mailbox exists from now on, so a caller that never listens is dropped
+            _mailbox(caller)
+    _persist(ended)
+    if busy:
+        raise CallError("User is busy", 409)
+    return call.summary()
+
+
+def answer_call(uid, call_id, answer):
+    answer = _description(answer, 'answer')
+    with _lock:
+        call = _live_call(call_id, uid)
+        if uid != call.callee:
+            raise CallError("Only the callee can answer", 403)
+        if call.state != RINGING:
+            raise CallError("Call already answered", 409)
+        call.answer()
+        _post(call.caller, dict(call.summary(), type='answer', answer=answer))
+        # Other tabs of the callee stop ringing
+        _post(call.callee, dict(call.summary(), type='answered'))
+        summary = call.summary()
+    metrics.call_answer_seconds.observe(call.answer_seconds, call.kind)
+    return summary
+
+
+def add_candidates(uid, call_id, candidates):
+    """Relay a batch of trickled ICE candidates to the other party."""
+    if not isinstance(candidates, list) or not candidates:
+        raise CallError("Expected a list of ICE candidates")
+    candidates = [_candidate(c) for c in candidates]
+    with _lock:
+        call = _live_call(call_id, uid)
+        if call.candidates[uid] + len(candidates) > MAX_CANDIDATES:
+            raise CallError("Too many ICE candidates", 429)
+        call.candidates[uid] += len(candidates)
+        _post(call.peer(uid), {'type': 'candidates', 'call_id': call.id, 'from': uid, 'candidates': candidates})
+    return len(candidates)
+
+
+def hang_up(uid, call_id):
+    """Hang up, cancel a ringing call or (callee) decline it."""
+    with _lock:
+        call = _hang_up(_live_call(call_id, uid), uid)
+    _persist([call])
+    return call.summary()
+
+
+def get_call(uid, call_id):
+    with _lock:
+        return _live_call(call_id, uid).summary()
+
+
+# 🧹 Ring timeouts, dropped parties and idle mailboxes
+def _gone(uid, now):
+    mailbox = _mailboxes.get(uid)
+    return mailbox is None or (not mailbox.listeners and now - mailbox.idle_since > DROP_SECONDS)
+
+
+def sweep(now=None):
+    now = now or time.monotonic()
+    ended = []
+    with _lock:
+        for call in list(_calls.values()):
+            if call.state == RINGING and now >= call.ring_deadline:
+                ended.append(_end(call, MISSED))
+                continue
+            # A callee may still be opening the app while it rings; the caller must be listening
+            parties = (call.caller,) if call.state == RINGING else (call.caller, call.callee)
+            gone = next((uid for uid in parties if _gone(uid, now)), None)
+            if gone:
+                ended.append(_end(call, DROPPED, gone))
+        in_calls = {uid for call in _calls.values() for uid in (call.caller, call.callee)}
+        for uid, mailbox in list(_mailboxes.items()):
+            if not mailbox.listeners and uid not in in_calls and now - mailbox.idle_since > MAILBOX_IDLE_SECONDS:
+                del _mailboxes[uid]
+    _persist(ended)
+    return len(ended)
+
+
+def _sweep_forever():
+    while True:
+        time.sleep(SWEEP_SECONDS)
+        try:
+            sweep()
+        except Exception:
+            logger.exception("Call sweeper failed")
+
+
+def _ensure_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        with _lock:
+            if _sweeper is None:
+                _sweeper = threading.Thread(target=_sweep_forever, name='call-sweeper', daemon=True)
+                _sweeper.start()
+
+
+def recent_calls(uid, limit=20):
+    """Finished call records of `uid`, newest first."""
+    return get_store().calls.recent(uid, limit)
+
+
+def stats():
+    with _lock:
+        return {
+            'calls': len(_calls),
+            'ringing': sum(1 for call in _calls.values() if call.state == RINGING),
+            'mailboxes': len(_mailboxes),
+            'listeners': sum(m.listeners for m in _mailboxes.values())
+        }
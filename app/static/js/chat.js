@@ -1,4 +1,5 @@
 import * as E2EE from './e2ee.js';
+import { listenForCallEvents, callPageUrl, declineCall } from './video.js';
 import { initializeApp } from "https://www.gstatic.com/firebasejs/10.5.0/firebase-app.js";
 import {
   getFirestore, doc, getDoc, updateDoc, arrayUnion, arrayRemove, collection, query, where, getDocs
@@ -27,6 +28,77 @@ ephemeralToggle.addEventListener('change', () => {
 });
 
   const userTimeZone = Intl.DateTimeFormat().resolvedOptions().timeZone;
+  const seenIds = new Set(); // message ids already on screen (history, sends, live)
+
+  // 👁️ Read receipts: hide "Seen" when I send, report my reads (debounced, only while visible)
+  const readReceipt = document.getElementById('read-receipt');
+  const readEndpoint = document.getElementById('read-endpoint')?.value;
+  let unreadSeen = false;
+  let readTimer = null;
+  function markRead() {
+    if (!readEndpoint || !unreadSeen || document.visibilityState !== 'visible') return;
+    clearTimeout(readTimer);
+    readTimer = setTimeout(() => {
+      unreadSeen = false;
+      fetch(readEndpoint, {
+        method: 'POST',
+        headers: { 'X-CSRF-Token': metaCsrf.getAttribute('content') },
+        credentials: 'include'
+      }).catch(err => console.warn('Read marker failed:', err));
+    }, 1000);
+  }
+  document.addEventListener('visibilitychange', markRead);
+
+  // ⌨️ Typing pings: at most one per TYPING_PING_MS while typing, one stop when the box is cleared
+  const typingEndpoint = document.getElementById('typing-endpoint')?.value;
+  const TYPING_PING_MS = 2500;
+  let typingSentAt = 0;
+  function sendTyping(typing) {
+    if (!typingEndpoint) return;
+    fetch(typingEndpoint, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json', 'X-CSRF-Token': metaCsrf.getAttribute('content') },
+      credentials: 'include',
+      body: JSON.stringify({ typing })
+    }).catch(err => console.warn('Typing ping failed:', err));
+  }
+  document.getElementById('message-input')?.addEventListener('input', (e) => {
+    if (e.target.value.trim()) {
+      if (Date.now() - typingSentAt < TYPING_PING_MS) return;
+      typingSentAt = Date.now();
+      sendTyping(true);
+    } else if (typingSentAt) {
+      typingSentAt = 0;
+      sendTyping(false);
+    }
+  });
+
+  // 🟢 Peer presence line: typing beats online beats last seen
+  const peerStatus = document.getElementById('peer-status');
+  const peerState = { online: false, lastSeen: null, typing: false };
+  let typingTimer = null;
+  function renderPeerStatus() {
+    if (!peerStatus) return;
+    if (peerState.typing) {
+      peerStatus.textContent = 'typing…';
+    } else if (peerState.online) {
+      peerStatus.textContent = 'online';
+    } else if (peerState.lastSeen) {
+      const seen = new Date(peerState.lastSeen);
+      peerStatus.textContent = isNaN(seen) ? '' : `last seen ${new Intl.DateTimeFormat('en-US', {
+        month: 'short', day: 'numeric', hour: 'numeric', minute: '2-digit', hour12: true
+      }).format(seen)}`;
+    } else {
+      peerStatus.textContent = '';
+    }
+  }
+  function setPeerTyping(typing) {
+    peerState.typing = typing;
+    clearTimeout(typingTimer);
+    // Safety net in case the stop event is lost
+    if (typing) typingTimer = setTimeout(() => setPeerTyping(false), 10000);
+    renderPeerStatus();
+  }
 
   if (!metaRecKey || !metaCsrf || !otherId || !currentUserId || !container) {
     console.error('Missing required metadata or DOM elements');
@@ -76,7 +148,7 @@ ephemeralToggle.addEventListener('change', () => {
   }
   
   // 🧱 Reusable Message Renderer
-  function renderMessage({ text, sender, timestamp, isSent, senderUid, avatarUrl, ephemeral = false, expiresAt = null }) {
+  function renderMessage({ text, sender, timestamp, isSent, senderUid, avatarUrl, ephemeral = false, expiresAt = null }, { before = null } = {}) {
     const bubble = document.createElement('div');
     bubble.classList.add('message', isSent ? 'message-sent' : 'message-received');
   
@@ -133,7 +205,8 @@ ephemeralToggle.addEventListener('change', () => {
       const timer = setInterval(updateCountdown, 1000);
     }
   
-    container.appendChild(bubble);
+    container.insertBefore(bubble, before);
+    return bubble;
   }    
 
   // 🔄 Message Sending
@@ -161,23 +234,24 @@ const messagePayload = {
 // ✅ Use dynamic endpoint injected from Flask
 const chatEndpoint = document.getElementById('chat-endpoint').value;
 
-const res = await fetch(chatEndpoint, {
-  method: 'POST',
-  headers: {
-    'Content-Type': 'application/json',
-    'X-CSRF-Token': metaCsrf.getAttribute('content')
-  },
-  credentials: 'include',
-  body: JSON.stringify(messagePayload)
-});
-
-if (!res.ok) {
-  const txt = await res.text();
-  throw new Error(`Send failed: ${res.status} ${txt}`);
+let res;
+try {
+  res = await fetch(chatEndpoint, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      'X-CSRF-Token': metaCsrf.getAttribute('content')
+    },
+    credentials: 'include',
+    body: JSON.stringify(messagePayload)
+  });
+} catch (networkErr) {
+  res = null; // offline: queue it and flush later in one batch
 }
 
 const formatted = formatTimestamp(now);
-renderMessage({
+if (readReceipt) readReceipt.hidden = true;
+const bubble = renderMessage({
   text: msg,
   sender: 'You',
   timestamp: formatted,
@@ -186,15 +260,93 @@ renderMessage({
   expiresAt
 });
 
+if (!res) {
+  bubble.classList.add('opacity-50');
+  outbox.push({ payload: messagePayload, bubble });
+} else if (!res.ok) {
+  bubble.remove();
+  const txt = await res.text();
+  throw new Error(`Send failed: ${res.status} ${txt}`);
+} else {
+  const sent = await res.json();
+  if (sent.id) seenIds.add(sent.id);
+}
+
 container.scrollTop = container.scrollHeight;
 input.value = '';
+typingSentAt = 0; // the server clears my typing state when the message lands
 } catch (err) {
 console.error('Encryption or sending failed:', err);
 alert('Failed to send encrypted message: ' + err.message);
 }
 });
 
-  // 🧩 Message Rendering
+  // 📦 Offline outbox, replayed as a single batched send
+  const outbox = [];
+  async function flushOutbox() {
+    if (!outbox.length || !navigator.onLine) return;
+    const pending = outbox.splice(0, outbox.length);
+    try {
+      const res = await fetch(document.getElementById('batch-endpoint').value, {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+          'X-CSRF-Token': metaCsrf.getAttribute('content')
+        },
+        credentials: 'include',
+        body: JSON.stringify({ messages: pending.map(p => p.payload) })
+      });
+      if (!res.ok) throw new Error(`Batch send failed: ${res.status}`);
+      const { messages: sent } = await res.json();
+      sent.forEach(m => seenIds.add(m.id));
+      pending.forEach(p => p.bubble.classList.remove('opacity-50'));
+    } catch (err) {
+      console.warn('Outbox flush failed, will retry:', err);
+      outbox.unshift(...pending);
+    }
+  }
+  window.addEventListener('online', flushOutbox);
+
+  // 🧩 Message Rendering (batches are decrypted off the main thread and rendered chunk by chunk)
+  async function renderEncrypted(batch, { prepend = false } = {}) {
+    const anchor = prepend ? container.firstChild : null;
+    const fresh = [];
+    for (const msg of batch) {
+      if (msg.id) {
+        if (seenIds.has(msg.id)) continue;
+        seenIds.add(msg.id);
+      }
+      fresh.push(msg);
+    }
+
+    const peerName = document.querySelector('.chat-header strong')?.textContent || 'Unknown';
+    let index = 0;
+    for await (const plaintexts of E2EE.decryptBatch(fresh)) {
+      for (const decrypted of plaintexts) {
+        const msg = fresh[index++];
+        if (!decrypted) {
+          console.warn('Failed to decrypt message:', msg);
+          continue;
+        }
+
+        const isSent = msg.from === currentUserId;
+        const formatted = formatTimestamp(msg.timestamp);
+        const expiresAt = msg.ephemeral && msg.expiresAt ? new Date(msg.expiresAt).getTime() : null;
+
+        renderMessage({
+          text: decrypted,
+          sender: isSent ? 'You' : peerName,
+          timestamp: formatted,
+          isSent,
+          senderUid: msg.from,
+          avatarUrl: msg.avatar_url || '/static/img/default-avatar.png',
+          ephemeral: msg.ephemeral || false,
+          expiresAt
+        }, { before: anchor });
+      }
+    }
+  }
+
   const rawMessages = document.getElementById('encrypted-messages')?.textContent;
   if (!rawMessages) {
     console.warn('No messages found in #encrypted-messages');
@@ -209,70 +361,164 @@ alert('Failed to send encrypted message: ' + err.message);
     return;
   }
 
-  for (const msg of messages) {
-    try {
-      const decrypted = await E2EE.decryptMessage(msg);
-      if (!decrypted) continue;
-  
-      const isSent = msg.from === currentUserId;
-      const senderName = isSent ? 'You' : document.querySelector('.chat-header strong')?.textContent || 'Unknown';
-  
-      console.log('Raw timestamp:', msg.timestamp);  // ✅ Step 1: log raw value
-  
-      const formatted = formatTimestamp(msg.timestamp);  // ✅ Step 2: format it
-  
-      const expiresAt = msg.ephemeral && msg.expiresAt ? new Date(msg.expiresAt).getTime() : null;
+  container.querySelector('.text-muted')?.remove();
+  await renderEncrypted(messages);
 
-renderMessage({
-  text: decrypted,
-  sender: senderName,
-  timestamp: formatted,
-  isSent,
-  senderUid: msg.from,
-  avatarUrl: msg.avatar_url || '/static/img/default-avatar.png',
-  ephemeral: msg.ephemeral || false,
-  expiresAt
-});
+  // ✅ Auto-scroll to bottom
+  container.scrollTop = container.scrollHeight;
+
+  // 📜 Load older pages when scrolled to the top
+  const historyEndpoint = document.getElementById('history-endpoint')?.value;
+  let historyCursor = document.getElementById('history-cursor')?.value || null;
+  let loadingHistory = false;
+
+  function fromMsgpackPage(page) {
+    const keys = {};
+    for (const [kid, pub] of Object.entries(page.keys || {})) {
+      keys[kid] = btoa(String.fromCharCode(...pub));
+    }
+    page.messages = page.messages.map(m => ({ ...m, sender_pub: keys[m.kid] }));
+    return page;
+  }
 
+  async function loadOlder() {
+    if (!historyEndpoint || !historyCursor || loadingHistory) return;
+    loadingHistory = true;
+    try {
+      // msgpack pages are ~25% smaller (raw bytes, sender keys listed once per page)
+      const binary = Boolean(window.MessagePack);
+      const res = await fetch(`${historyEndpoint}?before=${encodeURIComponent(historyCursor)}`, {
+        credentials: 'include',
+        headers: { Accept: binary ? 'application/msgpack' : 'application/json' }
+      });
+      if (!res.ok) throw new Error(`History fetch failed: ${res.status}`);
+      const page = binary && res.headers.get('Content-Type')?.startsWith('application/msgpack')
+        ? fromMsgpackPage(window.MessagePack.decode(new Uint8Array(await res.arrayBuffer())))
+        : await res.json();
+
+      const prevHeight = container.scrollHeight;
+      await renderEncrypted(page.messages, { prepend: true });
+      container.scrollTop += container.scrollHeight - prevHeight; // keep the viewport steady
+      historyCursor = page.next_cursor;
     } catch (err) {
-      console.warn('Failed to decrypt message:', msg, err);
+      console.error('Failed to load older messages:', err);
+    } finally {
+      loadingHistory = false;
     }
-  }  
+  }
 
-  // ✅ Auto-scroll to bottom
-  container.scrollTop = container.scrollHeight;
+  container.addEventListener('scroll', () => {
+    if (container.scrollTop < 80) loadOlder();
+  });
+
+  // 📡 Live messages over SSE (EventSource resends Last-Event-ID on reconnect)
+  const streamEndpoint = document.getElementById('stream-endpoint')?.value;
+  const liveCursor = document.getElementById('live-cursor')?.value;
+  if (streamEndpoint && window.EventSource) {
+    const source = new EventSource(`${streamEndpoint}?after=${encodeURIComponent(liveCursor || '')}`);
+    source.addEventListener('message', async (event) => {
+      try {
+        const msg = JSON.parse(event.data);
+        const atBottom = container.scrollHeight - container.scrollTop - container.clientHeight < 80;
+        await renderEncrypted([msg]);
+        if (atBottom) container.scrollTop = container.scrollHeight;
+        if (msg.from !== currentUserId) {
+          unreadSeen = true;
+          markRead();
+          setPeerTyping(false);
+        }
+      } catch (err) {
+        console.warn('Bad live message event:', err);
+      }
+    });
+    source.addEventListener('presence', (event) => {
+      const update = JSON.parse(event.data);
+      if (update.uid !== otherId) return;
+      peerState.online = update.online;
+      peerState.lastSeen = update.last_seen;
+      renderPeerStatus();
+    });
+    source.addEventListener('typing', (event) => {
+      const update = JSON.parse(event.data);
+      if (update.uid === otherId) setPeerTyping(update.typing);
+    });
+    source.onerror = () => console.warn('Live stream interrupted, reconnecting…');
+  }
 })();
 
-async function showProfilePopout(uid, anchorEl) {
-  console.log("Popout triggered for UID:", uid);
+// 🤝 Friend button labels by state (as seen by the current user)
+const FRIEND_LABELS = {
+  none: 'Add Friend',
+  outgoing: 'Request sent',
+  incoming: 'Accept friend request',
+  friends: 'Friends ✓'
+};
+
+function friendState() {
+  return document.getElementById('friend-state')?.value || 'none';
+}
 
-  const q = query(collection(db, "usernames"), where("uid", "==", uid));
-  const querySnapshot = await getDocs(q);
+// The chat peer's profile and friend state are already on the page: no lookup needed
+function pageProfile(uid) {
+  const peer = document.getElementById('recipient-public-key');
+  if (!peer || peer.dataset.uid !== uid) return null;
+  const header = document.querySelector('.chat-header');
+  return {
+    username: header?.querySelector('strong')?.textContent || 'Unknown',
+    photo_url: header?.querySelector('img')?.getAttribute('src')
+  };
+}
 
-  if (querySnapshot.empty) {
-    console.warn("No username found for UID:", uid);
-    return;
+async function showProfilePopout(uid, anchorEl) {
+  let profile = pageProfile(uid);
+  if (!profile) {
+    const q = query(collection(db, "usernames"), where("uid", "==", uid));
+    const querySnapshot = await getDocs(q);
+    if (querySnapshot.empty) {
+      console.warn("No username found for UID:", uid);
+      return;
+    }
+    const doc = querySnapshot.docs[0];
+    profile = { username: doc.id, photo_url: doc.data().photo_url };
   }
-
-  const doc = querySnapshot.docs[0];
-  const username = doc.id;
-  const photo_url = doc.data().photo_url || "/static/img/default-avatar.png";
+  const username = profile.username;
+  const photo_url = profile.photo_url || "/static/img/default-avatar.png";
+  const isPeer = document.getElementById('recipient-public-key')?.dataset?.uid === uid;
+  const state = friendState();
 
   const popout = document.createElement("div");
   popout.classList.add("profile-popout");
-  popout.innerHTML = `
-    <button class="close-popout" style="float:right;">×</button>
-    <img src="${photo_url}" alt="${username}'s avatar" />
-    <h3>${username}</h3>
-    <button class="add-friend" data-uid="${uid}">Add Friend</button>
-    <button class="block-user" data-uid="${uid}">Block</button>
-    <button class="call-user" data-uid="${uid}">Call</button>
-    <button class="video-call-user" data-uid="${uid}">Video Call</button>
-  `;
-
-  popout.querySelector(".close-popout").addEventListener("click", () => {
+  // No innerHTML: username and photo_url are user-controlled
+  const button = (className, label) => {
+    const el = document.createElement("button");
+    el.className = className;
+    el.textContent = label;
+    el.dataset.uid = uid;
+    return el;
+  };
+  const close = document.createElement("button");
+  close.className = "close-popout";
+  close.style.float = "right";
+  close.textContent = "×";
+  close.addEventListener("click", () => {
     popout.remove();
   });
+  const avatar = document.createElement("img");
+  avatar.setAttribute("src", photo_url);
+  avatar.setAttribute("alt", `${username}'s avatar`);
+  const name = document.createElement("h3");
+  name.textContent = username;
+  popout.append(close, avatar, name);
+  if (isPeer) {
+    const add = button("add-friend", FRIEND_LABELS[state] || FRIEND_LABELS.none);
+    add.disabled = ['friends', 'outgoing'].includes(state);
+    popout.append(add);
+  }
+  popout.append(
+    button("block-user", "Block"),
+    button("call-user", "Call"),
+    button("video-call-user", "Video Call")
+  );
   
   // 🧭 Anchor near the clicked element
 if (anchorEl) {
@@ -346,9 +592,28 @@ document.addEventListener("DOMContentLoaded", () => {
   });
 });
 
-function addFriend(uid) {
-  console.log("Add friend:", uid);
-  // TODO: Firestore write to profiles/{currentUserId}/friends
+async function addFriend(uid) {
+  const endpoint = document.getElementById('friend-endpoint')?.value;
+  const csrf = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content');
+  if (!endpoint) return;
+  try {
+    // One endpoint for both: requesting someone who already asked you accepts theirs
+    const res = await fetch(endpoint, {
+      method: 'POST',
+      headers: { 'X-CSRF-Token': csrf },
+      credentials: 'include'
+    });
+    if (!res.ok) throw new Error(`Friend request failed: ${res.status}`);
+    const { status } = await res.json();
+    document.getElementById('friend-state').value = status;
+    document.querySelectorAll(`.add-friend[data-uid="${uid}"]`).forEach(button => {
+      button.textContent = FRIEND_LABELS[status] || FRIEND_LABELS.none;
+      button.disabled = ['friends', 'outgoing'].includes(status);
+    });
+  } catch (err) {
+    console.error(err);
+    alert('Could not send friend request.');
+  }
 }
 
 function blockUser(uid) {
@@ -356,12 +621,54 @@ function blockUser(uid) {
   // TODO: Firestore write to profiles/{currentUserId}/blocked
 }
 
+// 📞 Calls open the call page, which does the WebRTC work (video.js)
 function startCall(uid) {
-  console.log("Start call with:", uid);
-  // TODO: Trigger signaling logic
+  window.location.href = callPageUrl(uid, { kind: 'audio' });
 }
 
 function startVideoCall(uid) {
-  console.log("Start video call with:", uid);
-  // TODO: Trigger video signaling logic
+  window.location.href = callPageUrl(uid, { kind: 'video' });
+}
+
+// 🔔 Incoming calls ring here; answering moves to the call page, which picks the offer up again
+const ringing = new Map(); // call_id -> banner
+
+function showIncomingCall(ring) {
+  if (ringing.has(ring.call_id)) return;
+  const caller = pageProfile(ring.caller)?.username || 'Someone';
+  const banner = document.createElement('div');
+  banner.classList.add('incoming-call');
+  // textContent only: the caller's name is user-controlled
+  const label = document.createElement('span');
+  label.textContent = `📞 ${caller} is ${ring.kind === 'video' ? 'video ' : ''}calling…`;
+  const accept = document.createElement('button');
+  accept.className = 'btn btn-sm btn-success accept-call';
+  accept.textContent = 'Answer';
+  accept.addEventListener('click', () => {
+    window.location.href = callPageUrl(ring.caller, { kind: ring.kind, callId: ring.call_id });
+  });
+  const decline = document.createElement('button');
+  decline.className = 'btn btn-sm btn-danger decline-call';
+  decline.textContent = 'Decline';
+  decline.addEventListener('click', () => {
+    declineCall(ring.call_id);
+    dismissIncomingCall(ring.call_id);
+  });
+  banner.append(label, accept, decline);
+  ringing.set(ring.call_id, banner);
+  document.body.appendChild(banner);
+}
+
+function dismissIncomingCall(callId) {
+  ringing.get(callId)?.remove();
+  ringing.delete(callId);
+}
+
+const callEvents = document.getElementById('call-events-endpoint')?.value;
+if (callEvents) {
+  listenForCallEvents(event => {
+    if (event.type === 'ring') showIncomingCall(event);
+    // Answered in another tab, hung up or rang out
+    else if (event.type === 'answered' || event.type === 'hangup') dismissIncomingCall(event.call_id);
+  }, { eventsUrl: callEvents, pollUrl: document.getElementById('call-poll-endpoint')?.value });
 }
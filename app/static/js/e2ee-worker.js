@@ -0,0 +1,39 @@
+// app/static/js/e2ee-worker.js
+// Batch secretbox decryption off the main thread (see decryptBatch in e2ee.js).
+// Receives per-peer shared keys only; posts plaintexts back in input order.
+
+importScripts('https://cdn.jsdelivr.net/npm/tweetnacl@1.0.3/nacl-fast.min.js');
+
+function b64decode(str) {
+  const bin = atob(str);
+  const out = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) out[i] = bin.charCodeAt(i);
+  return out;
+}
+
+function toBytes(value) {
+  return typeof value === 'string' ? b64decode(value) : value;
+}
+
+const decoder = new TextDecoder();
+
+function open(item, keys) {
+  if (!item) return null;
+  const [ciphertext, nonce, senderPub] = item;
+  const shared = keys[senderPub];
+  if (!shared) return null;
+  try {
+    const pt = nacl.secretbox.open(toBytes(ciphertext), toBytes(nonce), shared);
+    return pt ? decoder.decode(pt) : null;
+  } catch (err) {
+    return null;
+  }
+}
+
+self.onmessage = ({ data }) => {
+  const { job, chunkSize, keys, items } = data;
+  for (let start = 0; start < items.length; start += chunkSize) {
+    const plaintexts = items.slice(start, start + chunkSize).map(item => open(item, keys));
+    self.postMessage({ job, start, plaintexts });
+  }
+};
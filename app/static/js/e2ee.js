@@ -4,14 +4,23 @@
 const DB_NAME = 'securechat-kv';
 const STORE = 'kv';
 
-// --- IndexedDB KV store ---
+// --- IndexedDB KV store (one connection per page, reopened only if the browser closes it) ---
+let dbPromise = null;
+
 function idbOpen() {
-  return new Promise((resolve, reject) => {
+  if (dbPromise) return dbPromise;
+  dbPromise = new Promise((resolve, reject) => {
     const req = indexedDB.open(DB_NAME, 1);
     req.onupgradeneeded = () => req.result.createObjectStore(STORE);
-    req.onsuccess = () => resolve(req.result);
-    req.onerror = () => reject(req.error);
+    req.onsuccess = () => {
+      const db = req.result;
+      db.onclose = () => { dbPromise = null; };
+      db.onversionchange = () => { db.close(); dbPromise = null; };
+      resolve(db);
+    };
+    req.onerror = () => { dbPromise = null; reject(req.error); };
   });
+  return dbPromise;
 }
 
 async function idbGet(key) {
@@ -46,16 +55,32 @@ function b64decode(str) {
   return out;
 }
 
+// v2 (msgpack) envelopes carry raw bytes instead of base64
+function toBytes(value) {
+  return typeof value === 'string' ? b64decode(value) : value;
+}
+
 // --- Keypair management ---
+// The keypair is read from IndexedDB once per page and then kept in memory.
+let keypairPromise = null;
+
+// Precomputed nacl.box.before() results keyed by peer public key (base64).
+// A conversation only has one or two distinct sender keys, so this turns one
+// X25519 scalar multiplication per message into one per peer.
+const sharedKeys = new Map();
+
 export async function generateKeyPair() {
   const kp = nacl.box.keyPair(); // Curve25519
   const pubB64 = b64encode(kp.publicKey);
   await idbSet('pub', pubB64);
   await idbSet('priv', kp.secretKey);
-  return { publicKeyBase64: pubB64, privateKey: kp.secretKey };
+  sharedKeys.clear();
+  const keypair = { publicKeyBase64: pubB64, privateKey: kp.secretKey };
+  keypairPromise = Promise.resolve(keypair);
+  return keypair;
 }
 
-export async function getOrCreateKeypair() {
+async function loadOrCreateKeypair() {
   let pub = await idbGet('pub');
   let priv = await idbGet('priv');
   if (pub && priv) {
@@ -64,23 +89,36 @@ export async function getOrCreateKeypair() {
   return await generateKeyPair();
 }
 
+export async function getOrCreateKeypair() {
+  if (!keypairPromise) {
+    keypairPromise = loadOrCreateKeypair().catch(err => {
+      keypairPromise = null;
+      throw err;
+    });
+  }
+  return keypairPromise;
+}
+
 export async function getPrivateKey() {
-  let priv = await idbGet('priv');
-  if (!priv) {
-    const kp = await getOrCreateKeypair();
-    priv = kp.privateKey;
+  return (await getOrCreateKeypair()).privateKey;
+}
+
+export async function sharedKeyFor(peerPublicBase64) {
+  let shared = sharedKeys.get(peerPublicBase64);
+  if (!shared) {
+    const priv = await getPrivateKey();
+    shared = nacl.box.before(b64decode(peerPublicBase64), priv);
+    sharedKeys.set(peerPublicBase64, shared);
   }
-  return priv;
+  return shared;
 }
 
 // --- Encryption ---
 export async function encryptForRecipient(plaintext, recipientPublicBase64) {
-  const priv = await getPrivateKey();
-  const myPubB64 = await idbGet('pub');
-  const recipientPub = b64decode(recipientPublicBase64);
+  const { publicKeyBase64: myPubB64 } = await getOrCreateKeypair();
+  const shared = await sharedKeyFor(recipientPublicBase64);
   const nonce = nacl.randomBytes(nacl.secretbox.nonceLength);
 
-  const shared = nacl.box.before(recipientPub, priv);
   const ct = nacl.secretbox(new TextEncoder().encode(plaintext), nonce, shared);
 
   return {
@@ -93,11 +131,9 @@ export async function encryptForRecipient(plaintext, recipientPublicBase64) {
 
 // --- Decryption ---
 export async function decryptFromSender(ciphertextB64, nonceB64, senderPubB64) {
-  const priv = await getPrivateKey();
-  const senderPub = b64decode(senderPubB64);
-  const shared = nacl.box.before(senderPub, priv);
-  const nonce = b64decode(nonceB64);
-  const ct = b64decode(ciphertextB64);
+  const shared = await sharedKeyFor(senderPubB64);
+  const nonce = toBytes(nonceB64);
+  const ct = toBytes(ciphertextB64);
   const pt = nacl.secretbox.open(ct, nonce, shared);
   if (!pt) return null;
   return new TextDecoder().decode(pt);
@@ -118,3 +154,109 @@ export async function decryptMessage(msg) {
     return null;
   }
 }
+
+// --- Batch decryption ---
+// Large batches go to a Web Worker so the main thread stays responsive; the
+// worker only ever sees the per-peer shared keys, never the private key.
+// Results stream back chunk by chunk, in the same order as the input.
+const WORKER_MIN_BATCH = 64;
+const CHUNK_SIZE = 100;
+
+let worker = null;
+let nextJobId = 1;
+const jobs = new Map();
+
+function getWorker() {
+  if (worker === null) {
+    try {
+      worker = new Worker(new URL('./e2ee-worker.js', import.meta.url));
+      worker.onmessage = ({ data }) => jobs.get(data.job)?.push(data);
+      worker.onerror = (event) => {
+        console.warn('Decrypt worker failed, falling back to main thread:', event.message);
+        worker = false;
+        for (const job of jobs.values()) job.push({ error: event.message });
+      };
+    } catch (err) {
+      console.warn('Decrypt worker unavailable:', err);
+      worker = false;
+    }
+  }
+  return worker || null;
+}
+
+function usable(msg) {
+  return msg && msg.ciphertext && msg.nonce && msg.sender_pub;
+}
+
+async function keysFor(messages) {
+  const keys = {};
+  for (const msg of messages) {
+    if (usable(msg) && !(msg.sender_pub in keys)) {
+      try {
+        keys[msg.sender_pub] = await sharedKeyFor(msg.sender_pub);
+      } catch (err) {
+        console.warn('Bad sender key:', msg.sender_pub, err);
+      }
+    }
+  }
+  return keys;
+}
+
+function openWith(keys, msg) {
+  const shared = usable(msg) && keys[msg.sender_pub];
+  if (!shared) return null;
+  try {
+    const pt = nacl.secretbox.open(toBytes(msg.ciphertext), toBytes(msg.nonce), shared);
+    return pt ? new TextDecoder().decode(pt) : null;
+  } catch (err) {
+    return null;
+  }
+}
+
+async function* decryptOnMainThread(messages, keys, start = 0) {
+  for (let i = start; i < messages.length; i += CHUNK_SIZE) {
+    yield messages.slice(i, i + CHUNK_SIZE).map(msg => openWith(keys, msg));
+    await new Promise(resolve => setTimeout(resolve, 0)); // let the page paint between chunks
+  }
+}
+
+/**
+ * Decrypt many messages. Yields arrays of plaintexts (null where a message
+ * could not be decrypted) covering the input in order, CHUNK_SIZE at a time.
+ */
+export async function* decryptBatch(messages) {
+  const keys = await keysFor(messages);
+  const w = messages.length >= WORKER_MIN_BATCH ? getWorker() : null;
+  if (!w) {
+    yield* decryptOnMainThread(messages, keys);
+    return;
+  }
+
+  const job = nextJobId++;
+  const inbox = [];
+  let wake = null;
+  jobs.set(job, { push(data) { inbox.push(data); if (wake) { wake(); wake = null; } } });
+
+  w.postMessage({
+    job,
+    chunkSize: CHUNK_SIZE,
+    keys,
+    items: messages.map(m => usable(m) ? [m.ciphertext, m.nonce, m.sender_pub] : null)
+  });
+
+  let done = 0;
+  try {
+    while (done < messages.length) {
+      if (!inbox.length) await new Promise(resolve => { wake = resolve; });
+      const data = inbox.shift();
+      if (data.error) {
+        yield* decryptOnMainThread(messages, keys, done);
+        return;
+      }
+      done += data.plaintexts.length;
+      yield data.plaintexts;
+    }
+  } finally {
+    jobs.delete(job);
+  }
+}
@@ -0,0 +1,272 @@
+// 📞 WebRTC calls. Signaling goes through /calls (SSE, long-poll fallback);
+// media flows peer to peer and never touches the server.
+
+function csrfToken() {
+  return document.querySelector('meta[name="csrf-token"]')?.getAttribute('content') || '';
+}
+
+async function postJson(url, body, { keepalive = false } = {}) {
+  const res = await fetch(url, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', 'X-CSRF-Token': csrfToken() },
+    credentials: 'include',
+    body: JSON.stringify(body || {}),
+    keepalive
+  });
+  const data = await res.json().catch(() => ({}));
+  if (!res.ok) throw new Error(data.error || `Request failed: ${res.status}`);
+  return data;
+}
+
+// 📡 Call events for the signed-in user: EventSource, or long-poll where that isn't available
+export function listenForCallEvents(onEvent, { eventsUrl = '/calls/events', pollUrl = '/calls/poll' } = {}) {
+  const types = ['ring', 'answer', 'answered', 'candidates', 'hangup'];
+  if (window.EventSource) {
+    const source = new EventSource(eventsUrl);
+    types.forEach(type => source.addEventListener(type, event => {
+      try {
+        onEvent(JSON.parse(event.data));
+      } catch (err) {
+        console.warn('Bad call event:', err);
+      }
+    }));
+    source.onerror = () => console.warn('Call events interrupted, reconnecting…');
+    return () => source.close();
+  }
+
+  let stopped = false;
+  let cursor = '';
+  (async () => {
+    while (!stopped) {
+      try {
+        const res = await fetch(`${pollUrl}?after=${encodeURIComponent(cursor)}`, { credentials: 'include' });
+        if (!res.ok) throw new Error(`Poll failed: ${res.status}`);
+        const body = await res.json();
+        cursor = body.cursor;
+        body.events.forEach(onEvent);
+      } catch (err) {
+        console.warn(err);
+        await new Promise(resolve => setTimeout(resolve, 2000));
+      }
+    }
+  })();
+  return () => { stopped = true; };
+}
+
+export function callPageUrl(uid, { kind = 'video', callId = '' } = {}) {
+  const params = new URLSearchParams({ kind });
+  if (callId) params.set('call', callId);
+  return `/calls/with/${encodeURIComponent(uid)}?${params}`;
+}
+
+export function declineCall(callId) {
+  return postJson(`/calls/${encodeURIComponent(callId)}/hangup`).catch(err => console.warn(err));
+}
+
+// 🎥 One call on the call page
+export class CallSession {
+  constructor({ peerId, kind, iceServers, onState, onRemoteStream, onLocalStream }) {
+    this.peerId = peerId;
+    this.kind = kind;
+    this.callId = null;
+    this.pc = new RTCPeerConnection({ iceServers });
+    this.onState = onState || (() => {});
+    this.onRemoteStream = onRemoteStream || (() => {});
+    this.onLocalStream = onLocalStream || (() => {});
+    this.ended = false;
+    this.answering = false;
+
+    // Candidates trickle in bursts: send them in small batches, once the call id is known
+    this.outgoing = [];
+    this.flushTimer = null;
+    // Remote candidates can arrive before the remote description is set
+    this.remote = [];
+    // Events that arrive before the call id is known
+    this.early = [];
+
+    this.pc.onicecandidate = ({ candidate }) => {
+      if (!candidate) return;
+      this.outgoing.push(candidate.toJSON());
+      this.scheduleFlush();
+    };
+    this.pc.ontrack = ({ streams }) => this.onRemoteStream(streams[0]);
+    this.pc.onconnectionstatechange = () => {
+      const state = this.pc.connectionState;
+      if (state === 'connected') this.onState('connected');
+      if (state === 'failed') this.hangUp();
+    };
+  }
+
+  async openMedia() {
+    this.localStream = await navigator.mediaDevices.getUserMedia({ audio: true, video: this.kind === 'video' });
+    this.localStream.getTracks().forEach(track => this.pc.addTrack(track, this.localStream));
+    this.onLocalStream(this.localStream);
+  }
+
+  scheduleFlush() {
+    if (!this.callId || this.flushTimer || this.ended) return;
+    this.flushTimer = setTimeout(() => this.flushCandidates(), 50);
+  }
+
+  async flushCandidates() {
+    this.flushTimer = null;
+    const batch = this.outgoing.splice(0);
+    if (!batch.length || !this.callId || this.ended) return;
+    try {
+      await postJson(`/calls/${this.callId}/candidates`, { candidates: batch });
+    } catch (err) {
+      console.warn('Could not send ICE candidates:', err);
+    }
+  }
+
+  async addRemoteCandidates(candidates) {
+    if (!this.pc.remoteDescription) {
+      this.remote.push(...candidates);
+      return;
+    }
+    for (const candidate of candidates) {
+      try {
+        await this.pc.addIceCandidate(candidate);
+      } catch (err) {
+        console.warn('Bad ICE candidate:', err);
+      }
+    }
+  }
+
+  async setRemote(description) {
+    await this.pc.setRemoteDescription(description);
+    const queued = this.remote.splice(0);
+    await this.addRemoteCandidates(queued);
+  }
+
+  // 📤 Caller: media first, then the offer; the server rings the peer
+  async start() {
+    this.onState('calling');
+    await this.openMedia();
+    const offer = await this.pc.createOffer();
+    await this.pc.setLocalDescription(offer);
+    const call = await postJson('/calls', { to: this.peerId, kind: this.kind, offer: { type: offer.type, sdp: offer.sdp } });
+    this.callId = call.call_id;
+    this.onState('ringing');
+    this.scheduleFlush();
+    // A fast callee can answer before our POST returns
+    for (const event of this.early.splice(0)) await this.handle(event);
+  }
+
+  // 📥 Callee: answer the offer that came with the ring
+  async answer(ring) {
+    this.answering = true;
+    this.callId = ring.call_id;
+    this.kind = ring.kind;
+    this.onState('connecting');
+    await this.openMedia();
+    await this.setRemote(ring.offer);
+    const answer = await this.pc.createAnswer();
+    await this.pc.setLocalDescription(answer);
+    await postJson(`/calls/${this.callId}/answer`, { answer: { type: answer.type, sdp: answer.sdp } });
+    this.scheduleFlush();
+  }
+
+  async handle(event) {
+    if (!this.callId && !this.ended) {
+      this.early.push(event);
+      return false;
+    }
+    if (event.call_id !== this.callId) return false;
+    if (event.type === 'answer') {
+      this.onState('connecting');
+      await this.setRemote(event.answer);
+    } else if (event.type === 'candidates') {
+      await this.addRemoteCandidates(event.candidates);
+    } else if (event.type === 'hangup') {
+      this.close(event.outcome);
+    }
+    return true;
+  }
+
+  hangUp({ keepalive = false } = {}) {
+    if (this.ended) return;
+    if (this.callId) {
+      postJson(`/calls/${this.callId}/hangup`, {}, { keepalive }).catch(err => console.warn(err));
+    }
+    this.close('completed');
+  }
+
+  close(outcome) {
+    if (this.ended) return;
+    this.ended = true;
+    clearTimeout(this.flushTimer);
+    this.localStream?.getTracks().forEach(track => track.stop());
+    this.pc.close();
+    this.onState(outcome || 'ended');
+  }
+}
+
+// 🖥️ Call page wiring (video.html)
+const view = document.getElementById('call-view');
+if (view) {
+  const peerId = view.dataset.peer;
+  const incomingId = view.dataset.callId;
+  const status = document.getElementById('call-status');
+  const remoteVideo = document.getElementById('remote-video');
+  const localVideo = document.getElementById('local-video');
+  const backUrl = view.dataset.backUrl;
+
+  const LABELS = {
+    calling: 'Calling…',
+    ringing: 'Ringing…',
+    connecting: 'Connecting…',
+    connected: 'Connected',
+    completed: 'Call ended',
+    missed: 'No answer',
+    declined: 'Call declined',
+    cancelled: 'Call cancelled',
+    dropped: 'Connection lost',
+    failed: 'Call failed'
+  };
+
+  const session = new CallSession({
+    peerId,
+    kind: view.dataset.kind,
+    iceServers: JSON.parse(view.dataset.iceServers || '[]'),
+    onState: state => {
+      status.textContent = LABELS[state] || state;
+      if (session?.ended) setTimeout(() => { window.location.href = backUrl; }, 1500);
+    },
+    onRemoteStream: stream => { remoteVideo.srcObject = stream; },
+    onLocalStream: stream => { localVideo.srcObject = stream; }
+  });
+
+  // Events for this call are replayed when the stream opens, so a ring that
+  // arrived on the chat page (offer and early candidates) is picked up here
+  const stop = listenForCallEvents(async event => {
+    try {
+      if (incomingId && event.type === 'ring' && event.call_id === incomingId && !session.answering) {
+        await session.answer(event);
+      } else {
+        await session.handle(event);
+      }
+    } catch (err) {
+      console.error(err);
+      session.hangUp();
+    }
+  }, { eventsUrl: view.dataset.eventsUrl, pollUrl: view.dataset.pollUrl });
+
+  if (incomingId) {
+    fetch(`/calls/${encodeURIComponent(incomingId)}`, { credentials: 'include' }).then(res => {
+      if (!res.ok) session.close('missed');
+    });
+  } else {
+    session.start().catch(err => {
+      console.error(err);
+      status.textContent = err.message || LABELS.failed;
+      session.close('failed');
+    });
+  }
+
+  document.getElementById('hangup-button').addEventListener('click', () => session.hangUp());
+  window.addEventListener('pagehide', () => {
+    session.hangUp({ keepalive: true });
+    stop();
+  });
+}
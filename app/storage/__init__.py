@@ -0,0 +1,43 @@
+# app/storage — repository layer over the database.
+#
+# Routes and services talk to `get_store()` instead of Firestore directly.
+# The backend is picked by STORAGE_BACKEND:
+#   firestore (default)  Google Cloud Firestore
+#   memory               in-process dicts, for tests and benchmarks
+#   sqlite               single file at STORAGE_SQLITE_PATH (default securechat.db)
+
+import os
+
+from app.firebase import _service, get_db
+from app.services.metrics import instrument_store
+from .base import read_stats
+
+BACKENDS = ('firestore', 'memory', 'sqlite')
+
+
+def build_store(backend=None):
+    backend = (backend or os.getenv("STORAGE_BACKEND", "firestore")).lower()
+    if backend == 'firestore':
+        from .firestore_store import FirestoreStore
+        return FirestoreStore(get_db())
+    if backend == 'memory':
+        from .memory_store import MemoryStore
+        return MemoryStore()
+    if backend == 'sqlite':
+        from .sqlite_store import SqliteStore
+        return SqliteStore(os.getenv("STORAGE_SQLITE_PATH", "securechat.db"))
+    raise ValueError(f"Unknown STORAGE_BACKEND {backend!r} (expected one of {', '.join(BACKENDS)})")
+
+
+def get_store():
+    return _service('store', lambda: instrument_store(build_store()))
+
+
+def set_store(store):
+    """Install a specific store (benchmarks, local tooling)."""
+    from app import firebase
+    firebase._services['store'] = instrument_store(store)
+    return firebase._services['store']
+
+
+__all__ = ['get_store', 'build_store', 'set_store', 'read_stats', 'BACKENDS']
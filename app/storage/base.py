@@ -0,0 +1,157 @@
+"""
+Shared pieces for the storage backends.
+
+Every backend exposes the same repositories on its store object:
+
+    store.profiles       get, get_many, find_by_username, search_prefix, scan,
+                         create, update
+    store.usernames      lookup, reserve, release
+    store.conversations  get, ensure, list_for_user, mark_read, scan,
+                         set_summary
+    store.messages       newest_first, oldest_first_after, add_batch, watch,
+                         expired, delete, summary
+    store.archives       add, newest_first
+    store.friendships    get, request, accept, remove
+    store.calls          add, recent
+    store.meta           get, set
+
+Messages are plain dicts with `created_at` (and `expiresAt` for ephemeral
+messages) as timezone-aware datetimes. They are ordered by the key
+(created_at, message id). Compact (v2) messages hold raw bytes and a `kid`;
+add_batch(..., keys=) merges kid -> public key into the conversation.
+
+Old persistent messages can be compacted into immutable archive chunks
+(`archives`, one document per N messages, ids from archive_key so they sort
+by their oldest message). archives.add writes a chunk, deletes the live
+copies and records `archive_chunks`/`archived_until` on the conversation in
+one atomic write; history reads merge chunks back in by key.
+
+Conversations keep per-participant `unread` counts and `last_read_at`
+markers. add_batch bumps them in the same write that updates the summary
+(the sender's count resets, everyone else's goes up), so the inbox renders
+badges from the documents it already lists; mark_read resets one reader.
+messages.summary recomputes last_message_at/last_sender/message_count from
+the messages themselves and conversations.set_summary writes them back
+(backfilling conversations created before the summary existed).
+
+Friendships are one edge per pair of users (friend_edge_id, so writes are
+idempotent) with a pending/accepted status, plus a denormalized adjacency
+map per user ({other_uid: 'friends' | 'outgoing' | 'incoming'}) so a whole
+friend list is one read. request/accept/remove update both in one
+transaction and return the caller's resulting state.
+
+Calls are stored once, when they end (the signaling itself is relayed in
+memory, see app.services.video_service); recent lists a user's call
+records newest first.
+
+Profiles carry `username_lower` (see username_key) and each taken name has
+a reservation in `usernames`, so lookups are one keyed read and typeahead
+is a range scan over an index.
+"""
+import re
+import secrets
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+REPOSITORIES = ('profiles', 'usernames', 'conversations', 'messages', 'archives', 'friendships', 'calls', 'meta')
+
+# Usernames double as document ids in `usernames`, so keep them to a safe alphabet
+USERNAME_RE = re.compile(r'^[A-Za-z0-9_.-]{3,32}$')
+
+# Upper bound for prefix range scans (sorts after every valid username character)
+PREFIX_END = '\uf8ff'
+
+# 📊 Read-path counters (index fallbacks are otherwise invisible)
+read_stats = Counter()
+
+
+def now_utc():
+    return datetime.now(timezone.utc)
+
+
+def new_id():
+    """Random id for locally-stored documents (same shape as Firestore auto ids)."""
+    return secrets.token_urlsafe(15)[:20]
+
+
+def batch_ids(n):
+    """
+    Ids for messages written together. They share a commit timestamp, so a
+    common random prefix plus a counter keeps them in submission order under
+    the (created_at, id) ordering.
+    """
+    prefix = secrets.token_urlsafe(15)[:16]
+    return [f"{prefix}{i:04d}" for i in range(n)]
+
+
+
+def username_key(username):
+    """Normalized form used for lookups, uniqueness and prefix search."""
+    return (username or '').strip().lower()
+
+
+def with_username_key(data):
+    if 'username' in data:
+        return dict(data, username_lower=username_key(data['username']))
+    return data
+
+
+def bump_unread(convo, participants, sender_id, count, at):
+    """New (unread, last_read_at) maps after `sender_id` sends `count` messages at `at`."""
+    unread = dict(convo.get('unread') or {})
+    for uid in participants:
+        unread[uid] = 0 if uid == sender_id else unread.get(uid, 0) + count
+    last_read_at = dict(convo.get('last_read_at') or {}, **{sender_id: at})
+    return unread, last_read_at
+
+
+def archive_key(created_at, msg_id):
+    """Sortable archive chunk id for the message key (created_at, msg_id)."""
+    return f"{(created_at - EPOCH) // timedelta(microseconds=1):017d}-{msg_id}"
+
+
+def archive_chunk(messages):
+    """Chunk document for [(key, msg_id, msg)] (oldest first), as stored by archives.add."""
+    (start_at, start_id), _, _ = messages[0]
+    (end_at, end_id), _, _ = messages[-1]
+    return {
+        'start_at': start_at, 'start_id': start_id,
+        'end_at': end_at, 'end_id': end_id,
+        'count': len(messages),
+        'messages': [dict(msg, id=msg_id, created_at=created_at) for (created_at, _), msg_id, msg in messages],
+    }
+
+
+FRIEND_STATES = ('friends', 'outgoing', 'incoming')
+
+
+def friend_edge_id(a, b):
+    return '_'.join(sorted([a, b]))
+
+
+def friend_transition(edge, action, uid, other):
+    """
+    Edge after `uid` performs `action` ('request', 'accept', 'remove') towards
+    `other`. Returns `edge` itself when nothing changes, None when removed.
+    A request to someone who already asked you accepts theirs.
+    """
+    if action == 'remove':
+        return None
+    if edge is None:
+        if action != 'request':
+            return None
+        return {'users': sorted([uid, other]), 'requested_by': uid, 'status': 'pending'}
+    if edge.get('status') == 'pending' and edge.get('requested_by') == other:
+        return dict(edge, status='accepted')
+    return edge
+
+
+def friend_states(edge):
+    """{uid: (other, state)} adjacency entries for both ends of an edge."""
+    a, b = edge['users']
+    if edge.get('status') == 'accepted':
+        return {a: (b, 'friends'), b: (a, 'friends')}
+    requester = edge.get('requested_by')
+    return {uid: (peer, 'outgoing' if uid == requester else 'incoming') for uid, peer in ((a, b), (b, a))}
@@ -0,0 +1,443 @@
+import heapq
+import logging
+from collections import Counter
+from itertools import chain
+from operator import itemgetter
+
+from google.api_core import exceptions
+from google.cloud import firestore
+
+from .base import (EPOCH, PREFIX_END, archive_chunk, archive_key, batch_ids, friend_edge_id, friend_states,
+                   friend_transition, read_stats, username_key, with_username_key)
+
+logger = logging.getLogger(__name__)
+
+
+def _primed(stream):
+    """Pull the first item eagerly so missing-index errors surface here, not mid-merge."""
+    try:
+        first = next(stream)
+    except StopIteration:
+        return iter(())
+    return chain([first], stream)
+
+
+def _ordered(query):
+    """Stream (key, doc_id, msg) tuples, converting each snapshot once."""
+    for doc in query.stream():
+        msg = doc.to_dict()
+        yield (msg.get("created_at") or EPOCH, doc.id), doc.id, msg
+
+
+class FirestoreProfiles:
+    def __init__(self, db):
+        self.db = db
+
+    def _ref(self, uid):
+        return self.db.collection('profiles').document(uid)
+
+    def get(self, uid):
+        doc = self._ref(uid).get()
+        return doc.to_dict() if doc.exists else None
+
+    def get_many(self, uids):
+        refs = [self._ref(uid) for uid in uids]
+        if not refs:
+            return {}
+        return {doc.id: doc.to_dict() for doc in self.db.get_all(refs) if doc.exists}
+
+    def find_by_username(self, username):
+        uid = FirestoreUsernames(self.db).lookup(username_key(username))
+        data = self.get(uid) if uid else None
+        return (uid, data) if data is not None else (None, None)
+
+    def search_prefix(self, prefix, limit):
+        """Profiles whose username_lower starts with `prefix`, in name order (single-field index)."""
+        query = self.db.collection('profiles') \
+                       .where('username_lower', '>=', prefix) \
+                       .where('username_lower', '<', prefix + PREFIX_END) \
+                       .order_by('username_lower') \
+                       .limit(limit)
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def scan(self, after=None, limit=500):
+        query = self.db.collection('profiles').order_by('__name__').limit(limit)
+        if after:
+            query = query.start_after({'__name__': self._ref(after)})
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def create(self, uid, data):
+        self._ref(uid).set(dict(with_username_key(data), created_at=firestore.SERVER_TIMESTAMP))
+
+    def update(self, uid, fields):
+        self._ref(uid).set(with_username_key(fields), merge=True)
+
+
+class FirestoreUsernames:
+    """`usernames/{username_lower}` -> {uid}: one keyed read per lookup, create() enforces uniqueness."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def _ref(self, key):
+        return self.db.collection('usernames').document(key)
+
+    def lookup(self, key):
+        doc = self._ref(key).get()
+        return doc.to_dict().get('uid') if doc.exists else None
+
+    def reserve(self, key, uid):
+        try:
+            self._ref(key).create({'uid': uid, 'created_at': firestore.SERVER_TIMESTAMP})
+            return True
+        except exceptions.AlreadyExists:
+            return self.lookup(key) == uid
+
+    def release(self, key, uid):
+        ref = self._ref(key)
+        doc = ref.get()
+        if doc.exists and doc.to_dict().get('uid') == uid:
+            ref.delete()
+
+
+class FirestoreConversations:
+    def __init__(self, db):
+        self.db = db
+
+    def ref(self, convo_id):
+        return self.db.collection('conversations').document(convo_id)
+
+    def get(self, convo_id):
+        doc = self.ref(convo_id).get()
+        return doc.to_dict() if doc.exists else None
+
+    def ensure(self, convo_id, participants):
+        # 'last_message_at' is written as null (not omitted) so that brand new
+        # conversations still show up in order_by('last_message_at') queries.
+        ref = self.ref(convo_id)
+        if not ref.get().exists:
+            ref.set({
+                'participants': list(participants),
+                'created_at': firestore.SERVER_TIMESTAMP,
+                'last_message_at': None,
+                'last_sender': None,
+                'message_count': 0,
+            })
+
+    def mark_read(self, convo_id, uid, at=None):
+        # update() (not a merge-set) so a read marker never creates a conversation
+        try:
+            self.ref(convo_id).update({
+                f'unread.{uid}': 0,
+                f'last_read_at.{uid}': at or firestore.SERVER_TIMESTAMP,
+            })
+        except exceptions.NotFound:
+            pass
+
+    def set_summary(self, convo_id, fields):
+        # update() so a backfill never recreates a conversation deleted meanwhile
+        try:
+            self.ref(convo_id).update(fields)
+        except exceptions.NotFound:
+            pass
+
+    def scan(self, after=None, limit=500):
+        query = self.db.collection('conversations').order_by('__name__').limit(limit)
+        if after:
+            query = query.start_after({'__name__': self.ref(after)})
+        return [(doc.id, doc.to_dict()) for doc in query.stream()]
+
+    def list_for_user(self, uid, limit, after=None):
+        query = self.db.collection('conversations') \
+                       .where('participants', 'array_contains', uid) \
+                       .order_by('last_message_at', direction=firestore.Query.DESCENDING) \
+                       .limit(limit + 1)
+        if after:
+            cursor_doc = self.ref(after).get()
+            if cursor_doc.exists:
+                query = query.start_after(cursor_doc)
+
+        rows = [(doc.id, doc.to_dict()) for doc in query.stream()]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return rows, next_cursor
+
+
+class FirestoreMessages:
+    def __init__(self, db):
+        self.db = db
+
+    def _ref(self, convo_id):
+        return self.db.collection('conversations').document(convo_id).collection('messages')
+
+    def _page_query(self, query, msgs_ref, before, limit):
+        query = query.order_by("created_at", direction=firestore.Query.DESCENDING) \
+                     .order_by("__name__", direction=firestore.Query.DESCENDING) \
+                     .limit(limit)
+        if before:
+            created_at, doc_id = before
+            query = query.start_after({"created_at": created_at, "__name__": msgs_ref.document(doc_id)})
+        return query
+
+    def newest_first(self, convo_id, before, limit, now):
+        """
+        Persistent and active-ephemeral messages as two already-ordered
+        streams, lazily merged. Falls back to one unfiltered scan when the
+        composite index is missing.
+        """
+        msgs_ref = self._ref(convo_id)
+        persistent = self._page_query(msgs_ref.where("ephemeral", "==", False), msgs_ref, before, limit)
+        ephemeral = self._page_query(msgs_ref.where("ephemeral", "==", True).where("expiresAt", ">", now),
+                                     msgs_ref, before, limit)
+        try:
+            streams = [_primed(_ordered(persistent)), _primed(_ordered(ephemeral))]
+        except (exceptions.FailedPrecondition, exceptions.InvalidArgument) as e:
+            # Composite index missing: fall back to one unfiltered scan, filtered by the caller
+            read_stats['index_fallbacks'] += 1
+            logger.warning("Message index unavailable, using single-stream fallback: %s", e)
+            return _ordered(self._page_query(msgs_ref, msgs_ref, before, limit))
+        return heapq.merge(*streams, key=itemgetter(0), reverse=True)
+
+    def oldest_first_after(self, convo_id, key, limit):
+        msgs_ref = self._ref(convo_id)
+        created_at, doc_id = key
+        query = msgs_ref.order_by('created_at').order_by('__name__')
+        if doc_id:
+            query = query.start_after({'created_at': created_at, '__name__': msgs_ref.document(doc_id)})
+        else:
+            query = query.where('created_at', '>', created_at)
+        return list(_ordered(query.limit(limit)))
+
+    def summary(self, convo_id):
+        """Recomputed summary: one count aggregation plus the newest message."""
+        msgs_ref = self._ref(convo_id)
+        count = msgs_ref.count().get()[0][0].value
+        newest = [doc.to_dict() for doc in msgs_ref.order_by('created_at', direction=firestore.Query.DESCENDING)
+                                                   .limit(1).stream()]
+        if not newest:
+            return {'last_message_at': None, 'last_sender': None, 'message_count': 0}
+        return {'last_message_at': newest[0].get('created_at'), 'last_sender': newest[0].get('from'),
+                'message_count': count}
+
+    def add_batch(self, convo_id, participants, sender_id, messages, keys=None):
+        """
+        Store messages and upsert the conversation in one WriteBatch. The
+        conversation is merge-written, so it is created on first send
+        without a read; `keys` (kid -> sender public key) merges into its
+        `keys` map and the unread counters ride along in the same write.
+        Returns [(doc_id, commit_time)].
+        """
+        convo_ref = self.db.collection('conversations').document(convo_id)
+        msgs_ref = convo_ref.collection('messages')
+        refs = [msgs_ref.document(msg_id) for msg_id in batch_ids(len(messages))]
+
+        batch = self.db.batch()
+        for ref, message in zip(refs, messages):
+            batch.set(ref, dict(message, created_at=firestore.SERVER_TIMESTAMP))
+        summary = {
+            'participants': sorted(participants),
+            'last_message_at': firestore.SERVER_TIMESTAMP,
+            'last_sender': sender_id,
+            'message_count': firestore.Increment(len(messages)),
+            # Each reader's counter has a single writer (the peer) and merges as a
+            # server-side transform, so concurrent sends never read-modify-write it
+            'unread': {uid: 0 if uid == sender_id else firestore.Increment(len(messages))
+                       for uid in participants},
+            'last_read_at': {sender_id: firestore.SERVER_TIMESTAMP},
+        }
+        if keys:
+            summary['keys'] = dict(keys)
+        batch.set(convo_ref, summary, merge=True)
+        results = batch.commit()
+
+        commit_time = results[0].update_time if results else None
+        return [(ref.id, commit_time) for ref in refs]
+
+    def watch(self, convo_id, since, callback):
+        """Call `callback([(key, doc_id, msg), ...])` for messages added after `since`."""
+        def on_snapshot(docs, changes, read_time):
+            events = []
+            for change in changes:
+                if change.type.name != 'ADDED':
+                    continue
+                msg = change.document.to_dict()
+                if msg.get('created_at'):
+                    events.append(((msg['created_at'], change.document.id), change.document.id, msg))
+            if events:
+                callback(sorted(events, key=itemgetter(0)))
+
+        watch = self._ref(convo_id).where('created_at', '>', since) \
+                                   .order_by('created_at') \
+                                   .on_snapshot(on_snapshot)
+        return watch.unsubscribe
+
+    # 🧹 Reaper support
+    def expired(self, now, limit, after=None):
+        """[(expires_at, path)] of expired messages across all conversations, oldest expiry first."""
+        query = self.db.collection_group('messages') \
+                       .where('expiresAt', '<=', now) \
+                       .order_by('expiresAt') \
+                       .order_by('__name__') \
+                       .limit(limit)
+        if after:
+            expires_at, path = after
+            query = query.start_after({'expiresAt': expires_at, '__name__': self.db.document(path)})
+        return [(doc.to_dict().get('expiresAt'), doc.reference.path) for doc in query.stream()]
+
+    def delete(self, paths):
+        """Delete messages by path and decrement each conversation's message_count, atomically."""
+        batch = self.db.batch()
+        per_convo = Counter()
+        for path in paths:
+            ref = self.db.document(path)
+            batch.delete(ref)
+            per_convo[ref.parent.parent.path] += 1
+        for convo_path, count in per_convo.items():
+            batch.set(self.db.document(convo_path), {'message_count': firestore.Increment(-count)}, merge=True)
+        batch.commit()
+
+
+class FirestoreArchives:
+    """
+    `conversations/{id}/archive/{chunk_id}`: immutable chunks of old messages.
+    One document read returns a whole chunk, so deep history costs a read per
+    chunk instead of one per message.
+    """
+
+    # Chunk write + one delete per message + the conversation, under the 500-write batch limit
+    MAX_MESSAGES = 400
+
+    def __init__(self, db):
+        self.db = db
+
+    def _ref(self, convo_id):
+        return self.db.collection('conversations').document(convo_id).collection('archive')
+
+    def add(self, convo_id, messages):
+        if len(messages) > self.MAX_MESSAGES:
+            raise ValueError(f"Archive chunks hold at most {self.MAX_MESSAGES} messages")
+        chunk = archive_chunk(messages)
+        chunk_id = archive_key(chunk['start_at'], chunk['start_id'])
+        convo_ref = self.db.collection('conversations').document(convo_id)
+        msgs_ref = convo_ref.collection('messages')
+
+        batch = self.db.batch()
+        batch.create(self._ref(convo_id).document(chunk_id), chunk)
+        for _, msg_id, _ in messages:
+            batch.delete(msgs_ref.document(msg_id))
+        batch.set(convo_ref, {
+            'archive_chunks': firestore.Increment(1),
+            'archived_until': chunk['end_at'],
+            'message_count': firestore.Increment(-len(messages)),
+        }, merge=True)
+        batch.commit()
+        return chunk_id
+
+    def newest_first(self, convo_id, before, limit):
+        archive_ref = self._ref(convo_id)
+        query = archive_ref.order_by('__name__', direction=firestore.Query.DESCENDING).limit(limit)
+        if before:
+            query = query.where('__name__', '<', archive_ref.document(archive_key(*before)))
+        return [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+
+
+class FirestoreFriendships:
+    """
+    `friendships/{a_b}`: one edge per pair (deterministic id, so repeated
+    clicks rewrite the same document). `friend_lists/{uid}` holds the
+    adjacency map {other_uid: state}, so a friend list is a single read.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    def _list_ref(self, uid):
+        return self.db.collection('friend_lists').document(uid)
+
+    def get(self, uid):
+        doc = self._list_ref(uid).get()
+        return dict((doc.to_dict() or {}).get('friends') or {}) if doc.exists else {}
+
+    def _apply(self, action, uid, other):
+        edge_ref = self.db.collection('friendships').document(friend_edge_id(uid, other))
+
+        @firestore.transactional
+        def apply(transaction):
+            snap = edge_ref.get(transaction=transaction)
+            edge = snap.to_dict() if snap.exists else None
+            new = friend_transition(edge, action, uid, other)
+            if new is edge:
+                return friend_states(edge)[uid][1] if edge else None
+            if new is None:
+                transaction.delete(edge_ref)
+                transaction.set(self._list_ref(uid), {'friends': {other: firestore.DELETE_FIELD}}, merge=True)
+                transaction.set(self._list_ref(other), {'friends': {uid: firestore.DELETE_FIELD}}, merge=True)
+                return None
+            if edge is None:
+                new['created_at'] = firestore.SERVER_TIMESTAMP
+            if new['status'] == 'accepted':
+                new['accepted_at'] = firestore.SERVER_TIMESTAMP
+            transaction.set(edge_ref, new)
+            states = friend_states(new)
+            for user, (peer, state) in states.items():
+                transaction.set(self._list_ref(user), {'friends': {peer: state}}, merge=True)
+            return states[uid][1]
+
+        return apply(self.db.transaction())
+
+    def request(self, uid, other):
+        return self._apply('request', uid, other)
+
+    def accept(self, uid, other):
+        return self._apply('accept', uid, other)
+
+    def remove(self, uid, other):
+        return self._apply('remove', uid, other)
+
+
+class FirestoreCalls:
+    """calls/{call_id}: one document per finished call."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def add(self, call_id, record):
+        self.db.collection('calls').document(call_id).set(record)
+
+    def recent(self, uid, limit):
+        query = self.db.collection('calls') \
+                       .where('participants', 'array_contains', uid) \
+                       .order_by('created_at', direction=firestore.Query.DESCENDING) \
+                       .limit(limit)
+        return [dict(doc.to_dict(), id=doc.id) for doc in query.stream()]
+
+
+class FirestoreMeta:
+    """Small bookkeeping documents (job checkpoints and the like)."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, key):
+        doc = self.db.collection('maintenance').document(key).get()
+        return doc.to_dict() if doc.exists else None
+
+    def set(self, key, data):
+        self.db.collection('maintenance').document(key).set(dict(data, updated_at=firestore.SERVER_TIMESTAMP))
+
+
+class FirestoreStore:
+    name = 'firestore'
+
+    def __init__(self, db):
+        self.db = db
+        self.profiles = FirestoreProfiles(db)
+        self.usernames = FirestoreUsernames(db)
+        self.conversations = FirestoreConversations(db)
+        self.messages = FirestoreMessages(db)
+        self.archives = FirestoreArchives(db)
+        self.friendships = FirestoreFriendships(db)
+        self.calls = FirestoreCalls(db)
+        self.meta = FirestoreMeta(db)
@@ -0,0 +1,373 @@
+import bisect
+import threading
+from collections import Counter, defaultdict
+
+from .base import (PREFIX_END, archive_chunk, archive_key, batch_ids, bump_unread, friend_edge_id, friend_states,
+                   friend_transition, now_utc, username_key, with_username_key)
+
+
+def _path(convo_id, msg_id):
+    return f"conversations/{convo_id}/messages/{msg_id}"
+
+
+def _split(path):
+    parts = path.split('/')
+    return parts[1], parts[3]
+
+
+def _active(msg, now):
+    expires = msg.get('expiresAt')
+    return not (msg.get('ephemeral') and expires is not None and expires <= now)
+
+
+class _Thread:
+    """Messages of one conversation, kept sorted by (created_at, id)."""
+
+    def __init__(self):
+        self.keys = []
+        self.docs = {}
+
+
+class MemoryStore:
+    """
+    Everything in process memory. Meant for tests, local profiling and
+    benchmarks: no network, no persistence, same semantics as Firestore.
+    """
+    name = 'memory'
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.profiles = MemoryProfiles(self)
+        self.usernames = MemoryUsernames(self)
+        self.conversations = MemoryConversations(self)
+        self.messages = MemoryMessages(self)
+        self.archives = MemoryArchives(self)
+        self.friendships = MemoryFriendships(self)
+        self.calls = MemoryCalls(self)
+        self.meta = MemoryMeta(self)
+
+
+class MemoryProfiles:
+    def __init__(self, store):
+        self.store = store
+        self.rows = {}
+        self.by_name = []  # sorted (username_lower, uid), the "index" for prefix scans
+
+    def get(self, uid):
+        with self.store.lock:
+            data = self.rows.get(uid)
+            return dict(data) if data is not None else None
+
+    def get_many(self, uids):
+        with self.store.lock:
+            return {uid: dict(self.rows[uid]) for uid in uids if uid in self.rows}
+
+    def find_by_username(self, username):
+        with self.store.lock:
+            uid = self.store.usernames.lookup(username_key(username))
+            data = self.rows.get(uid) if uid else None
+            return (uid, dict(data)) if data is not None else (None, None)
+
+    def search_prefix(self, prefix, limit):
+        with self.store.lock:
+            start = bisect.bisect_left(self.by_name, (prefix,))
+            end = bisect.bisect_left(self.by_name, (prefix + PREFIX_END,))
+            return [(uid, dict(self.rows[uid])) for _, uid in self.by_name[start:min(end, start + limit)]]
+
+    def scan(self, after=None, limit=500):
+        with self.store.lock:
+            uids = sorted(uid for uid in self.rows if after is None or uid > after)[:limit]
+            return [(uid, dict(self.rows[uid])) for uid in uids]
+
+    def _write(self, uid, data):
+        old = self.rows.get(uid, {}).get('username_lower')
+        if old is not None:
+            self.by_name.remove((old, uid))
+        self.rows[uid] = data
+        if data.get('username_lower') is not None:
+            bisect.insort(self.by_name, (data['username_lower'], uid))
+
+    def create(self, uid, data):
+        with self.store.lock:
+            self._write(uid, dict(with_username_key(data), created_at=now_utc()))
+
+    def update(self, uid, fields):
+        with self.store.lock:
+            self._write(uid, dict(self.rows.get(uid, {}), **with_username_key(fields)))
+
+
+class MemoryUsernames:
+    def __init__(self, store):
+        self.store = store
+        self.rows = {}
+
+    def lookup(self, key):
+        with self.store.lock:
+            return self.rows.get(key)
+
+    def reserve(self, key, uid):
+        with self.store.lock:
+            return self.rows.setdefault(key, uid) == uid
+
+    def release(self, key, uid):
+        with self.store.lock:
+            if self.rows.get(key) == uid:
+                del self.rows[key]
+
+
+class MemoryConversations:
+    def __init__(self, store):
+        self.store = store
+        self.rows = {}
+
+    def get(self, convo_id):
+        with self.store.lock:
+            data = self.rows.get(convo_id)
+            return dict(data) if data is not None else None
+
+    def ensure(self, convo_id, participants):
+        with self.store.lock:
+            if convo_id not in self.rows:
+                self.rows[convo_id] = {
+                    'participants': list(participants),
+                    'created_at': now_utc(),
+                    'last_message_at': None,
+                    'last_sender': None,
+                    'message_count': 0,
+                }
+
+    def mark_read(self, convo_id, uid, at=None):
+        with self.store.lock:
+            convo = self.rows.get(convo_id)
+            if convo is not None:
+                convo['unread'] = dict(convo.get('unread') or {}, **{uid: 0})
+                convo['last_read_at'] = dict(convo.get('last_read_at') or {}, **{uid: at or now_utc()})
+
+    def set_summary(self, convo_id, fields):
+        with self.store.lock:
+            convo = self.rows.get(convo_id)
+            if convo is not None:
+                convo.update(fields)
+
+    def scan(self, after=None, limit=500):
+        with self.store.lock:
+            ids = sorted(cid for cid in self.rows if after is None or cid > after)[:limit]
+            return [(cid, dict(self.rows[cid])) for cid in ids]
+
+    def list_for_user(self, uid, limit, after=None):
+        with self.store.lock:
+            mine = [(cid, dict(data)) for cid, data in self.rows.items() if uid in data.get('participants', [])]
+        # Newest activity first; conversations without messages sort last (like Firestore nulls)
+        mine.sort(key=lambda row: (row[1].get('last_message_at') is not None,
+                                   row[1].get('last_message_at') or 0, row[0]), reverse=True)
+        if after:
+            ids = [cid for cid, _ in mine]
+            if after in ids:
+                mine = mine[ids.index(after) + 1:]
+        rows = mine[:limit]
+        next_cursor = rows[-1][0] if len(mine) > limit else None
+        return rows, next_cursor
+
+
+class MemoryMessages:
+    def __init__(self, store):
+        self.store = store
+        self.threads = defaultdict(_Thread)
+        self.listeners = defaultdict(list)
+
+    def newest_first(self, convo_id, before, limit, now):
+        with self.store.lock:
+            thread = self.threads.get(convo_id)
+            if thread is None:
+                return []
+            end = bisect.bisect_left(thread.keys, before) if before else len(thread.keys)
+            out = []
+            for key in reversed(thread.keys[:end]):
+                msg = thread.docs[key[1]]
+                if _active(msg, now):
+                    out.append((key, key[1], dict(msg)))
+                    if len(out) == limit:
+                        break
+            return out
+
+    def oldest_first_after(self, convo_id, key, limit):
+        with self.store.lock:
+            thread = self.threads.get(convo_id)
+            if thread is None:
+                return []
+            start = bisect.bisect_right(thread.keys, key)
+            return [(k, k[1], dict(thread.docs[k[1]])) for k in thread.keys[start:start + limit]]
+
+    def summary(self, convo_id):
+        with self.store.lock:
+            thread = self.threads.get(convo_id)
+            if thread is None or not thread.keys:
+                return {'last_message_at': None, 'last_sender': None, 'message_count': 0}
+            created_at, msg_id = thread.keys[-1]
+            return {'last_message_at': created_at, 'last_sender': thread.docs[msg_id].get('from'),
+                    'message_count': len(thread.keys)}
+
+    def add_batch(self, convo_id, participants, sender_id, messages, keys=None):
+        with self.store.lock:
+            created_at = now_utc()
+            thread = self.threads[convo_id]
+            events = []
+            for msg_id, message in zip(batch_ids(len(messages)), messages):
+                msg = dict(message, created_at=created_at)
+                thread.docs[msg_id] = msg
+                bisect.insort(thread.keys, (created_at, msg_id))
+                events.append(((created_at, msg_id), msg_id, dict(msg)))
+
+            convo = self.store.conversations.rows.setdefault(convo_id, {'message_count': 0})
+            convo['participants'] = sorted(participants)
+            convo['last_message_at'] = created_at
+            convo['last_sender'] = sender_id
+            convo['message_count'] = convo.get('message_count', 0) + len(messages)
+            convo['unread'], convo['last_read_at'] = bump_unread(convo, participants, sender_id, len(messages),
+                                                                 created_at)
+            if keys:
+                convo['keys'] = dict(convo.get('keys') or {}, **keys)
+            listeners = list(self.listeners.get(convo_id, ()))
+
+        for callback in listeners:
+            callback(events)
+        return [(msg_id, created_at) for _, msg_id, _ in events]
+
+    def watch(self, convo_id, since, callback):
+        with self.store.lock:
+            self.listeners[convo_id].append(callback)
+
+        def unsubscribe():
+            with self.store.lock:
+                if callback in self.listeners.get(convo_id, ()):
+                    self.listeners[convo_id].remove(callback)
+        return unsubscribe
+
+    def expired(self, now, limit, after=None):
+        with self.store.lock:
+            found = []
+            for convo_id, thread in self.threads.items():
+                for msg_id, msg in thread.docs.items():
+                    expires = msg.get('expiresAt')
+                    if expires is not None and expires <= now:
+                        found.append((expires, _path(convo_id, msg_id)))
+        found.sort()
+        if after:
+            found = [row for row in found if row > tuple(after)]
+        return found[:limit]
+
+    def delete(self, paths):
+        with self.store.lock:
+            per_convo = Counter()
+            for path in paths:
+                convo_id, msg_id = _split(path)
+                thread = self.threads.get(convo_id)
+                if thread is None or msg_id not in thread.docs:
+                    continue
+                msg = thread.docs.pop(msg_id)
+                thread.keys.remove((msg['created_at'], msg_id))
+                per_convo[convo_id] += 1
+            for convo_id, count in per_convo.items():
+                convo = self.store.conversations.rows.get(convo_id)
+                if convo is not None:
+                    convo['message_count'] = convo.get('message_count', 0) - count
+
+
+class MemoryArchives:
+    def __init__(self, store):
+        self.store = store
+        self.chunks = defaultdict(list)  # convo_id -> sorted [(chunk_id, chunk)]
+
+    def add(self, convo_id, messages):
+        chunk = archive_chunk(messages)
+        chunk_id = archive_key(chunk['start_at'], chunk['start_id'])
+        with self.store.lock:
+            bisect.insort(self.chunks[convo_id], (chunk_id, chunk), key=lambda row: row[0])
+            thread = self.store.messages.threads.get(convo_id)
+            removed = 0
+            for key, msg_id, _ in messages:
+                if thread is not None and thread.docs.pop(msg_id, None) is not None:
+                    thread.keys.remove(key)
+                    removed += 1
+            convo = self.store.conversations.rows.get(convo_id)
+            if convo is not None:
+                convo['message_count'] = convo.get('message_count', 0) - removed
+                convo['archive_chunks'] = convo.get('archive_chunks', 0) + 1
+                convo['archived_until'] = chunk['end_at']
+        return chunk_id
+
+    def newest_first(self, convo_id, before, limit):
+        with self.store.lock:
+            rows = self.chunks.get(convo_id, [])
+            end = bisect.bisect_left(rows, archive_key(*before), key=lambda row: row[0]) if before else len(rows)
+            return [dict(chunk, id=chunk_id) for chunk_id, chunk in reversed(rows[max(0, end - limit):end])]
+
+
+class MemoryFriendships:
+    def __init__(self, store):
+        self.store = store
+        self.edges = {}
+        self.lists = defaultdict(dict)  # uid -> {other_uid: state}
+
+    def get(self, uid):
+        with self.store.lock:
+            return dict(self.lists.get(uid, {}))
+
+    def _apply(self, action, uid, other):
+        with self.store.lock:
+            edge_id = friend_edge_id(uid, other)
+            edge = self.edges.get(edge_id)
+            new = friend_transition(edge, action, uid, other)
+            if new is not edge:
+                if new is None:
+                    self.edges.pop(edge_id, None)
+                    self.lists[uid].pop(other, None)
+                    self.lists[other].pop(uid, None)
+                else:
+                    now = now_utc()
+                    new.setdefault('created_at', now)
+                    if new['status'] == 'accepted':
+                        new.setdefault('accepted_at', now)
+                    self.edges[edge_id] = new
+                    for user, (peer, state) in friend_states(new).items():
+                        self.lists[user][peer] = state
+            return self.lists.get(uid, {}).get(other)
+
+    def request(self, uid, other):
+        return self._apply('request', uid, other)
+
+    def accept(self, uid, other):
+        return self._apply('accept', uid, other)
+
+    def remove(self, uid, other):
+        return self._apply('remove', uid, other)
+
+
+class MemoryCalls:
+    def __init__(self, store):
+        self.store = store
+        self.rows = {}
+
+    def add(self, call_id, record):
+        with self.store.lock:
+            self.rows[call_id] = dict(record)
+
+    def recent(self, uid, limit):
+        with self.store.lock:
+            rows = [dict(data, id=call_id) for call_id, data in self.rows.items() if uid in data['participants']]
+        return sorted(rows, key=lambda row: (row['created_at'], row['id']), reverse=True)[:limit]
+
+
+class MemoryMeta:
+    def __init__(self, store):
+        self.store = store
+        self.rows = {}
+
+    def get(self, key):
+        with self.store.lock:
+            data = self.rows.get(key)
+            return dict(data) if data is not None else None
+
+    def set(self, key, data):
+        with self.store.lock:
+            self.rows[key] = dict(data, updated_at=now_utc())
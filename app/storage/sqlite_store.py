@@ -0,0 +1,541 @@
+import base64
+import json
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from .base import (EPOCH, PREFIX_END, archive_chunk, archive_key, batch_ids, bump_unread, friend_edge_id,
+                   friend_states, friend_transition, now_utc, username_key, with_username_key)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS profiles (
+    uid             TEXT PRIMARY KEY,
+    username        TEXT,
+    username_lower  TEXT,
+    data            TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS usernames (
+    username_lower  TEXT PRIMARY KEY,
+    uid             TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS conversations (
+    id    TEXT PRIMARY KEY,
+    data  TEXT NOT NULL
+);
+
+-- One row per participant so the inbox is a single index range scan
+CREATE TABLE IF NOT EXISTS conversation_members (
+    uid            TEXT NOT NULL,
+    convo_id       TEXT NOT NULL,
+    last_activity  INTEGER NOT NULL DEFAULT -1,
+    PRIMARY KEY (uid, convo_id)
+);
+CREATE INDEX IF NOT EXISTS idx_members_inbox ON conversation_members (uid, last_activity DESC, convo_id DESC);
+
+CREATE TABLE IF NOT EXISTS messages (
+    convo_id    TEXT NOT NULL,
+    id          TEXT NOT NULL,
+    created_at  INTEGER NOT NULL,
+    ephemeral   INTEGER NOT NULL DEFAULT 0,
+    expires_at  INTEGER,
+    data        TEXT NOT NULL,
+    PRIMARY KEY (convo_id, id)
+);
+CREATE INDEX IF NOT EXISTS idx_messages_order ON messages (convo_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_messages_expiry ON messages (expires_at) WHERE expires_at IS NOT NULL;
+
+-- Compacted history: one row per chunk of old messages, ids sort by oldest message
+CREATE TABLE IF NOT EXISTS archives (
+    convo_id  TEXT NOT NULL,
+    id        TEXT NOT NULL,
+    data      TEXT NOT NULL,
+    PRIMARY KEY (convo_id, id)
+);
+
+-- One row per pair of users (friend_edge_id); friend_lists is the per-user adjacency
+CREATE TABLE IF NOT EXISTS friend_edges (
+    id    TEXT PRIMARY KEY,
+    data  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS friend_lists (
+    uid    TEXT NOT NULL,
+    other  TEXT NOT NULL,
+    state  TEXT NOT NULL,
+    PRIMARY KEY (uid, other)
+);
+
+-- Finished calls only; signaling never touches the database
+CREATE TABLE IF NOT EXISTS calls (
+    id          TEXT PRIMARY KEY,
+    caller      TEXT NOT NULL,
+    callee      TEXT NOT NULL,
+    created_at  INTEGER NOT NULL,
+    data        TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_calls_caller ON calls (caller, created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_calls_callee ON calls (callee, created_at DESC);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    data  TEXT NOT NULL
+);
+"""
+
+# Run after SCHEMA so columns added later exist before their indexes
+INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_profiles_username_lower ON profiles (username_lower);
+"""
+
+# (table, column, type) added after the first release; applied to older files on open
+COLUMNS = [
+    ('profiles', 'username_lower', 'TEXT'),
+]
+
+
+# 🕒 Datetimes are stored as integer microseconds so they sort and compare exactly
+def to_micros(dt):
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(us):
+    return EPOCH + timedelta(microseconds=us)
+
+
+def _default(value):
+    if isinstance(value, datetime):
+        return {'$dt': to_micros(value)}
+    if isinstance(value, bytes):
+        return {'$b64': base64.b64encode(value).decode()}
+    raise TypeError(f"Unsupported type {type(value).__name__}")
+
+
+def _hook(obj):
+    if len(obj) == 1:
+        if '$dt' in obj:
+            return from_micros(obj['$dt'])
+        if '$b64' in obj:
+            return base64.b64decode(obj['$b64'])
+    return obj
+
+
+def dumps(data):
+    return json.dumps(data, default=_default, separators=(',', ':'))
+
+
+def loads(text):
+    return json.loads(text, object_hook=_hook)
+
+
+def _path(convo_id, msg_id):
+    return f"conversations/{convo_id}/messages/{msg_id}"
+
+
+class SqliteStore:
+    """
+    Single-file SQLite backend for local benchmarks and self-hosted installs.
+    One shared connection in WAL mode, serialized by a lock.
+    """
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.executescript(INDEXES)
+        self.lock = threading.RLock()
+
+        self.profiles = SqliteProfiles(self)
+        self.usernames = SqliteUsernames(self)
+        self.conversations = SqliteConversations(self)
+        self.messages = SqliteMessages(self)
+        self.archives = SqliteArchives(self)
+        self.friendships = SqliteFriendships(self)
+        self.calls = SqliteCalls(self)
+        self.meta = SqliteMeta(self)
+
+    def _migrate(self):
+        for table, column, kind in COLUMNS:
+            existing = {row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+            if column not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {kind}")
+        self.conn.execute("DROP INDEX IF EXISTS idx_profiles_username")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def transaction(self):
+        return _Transaction(self)
+
+
+class _Transaction:
+    def __init__(self, store):
+        self.store = store
+
+    def __enter__(self):
+        self.store.lock.acquire()
+        self.store.conn.execute("BEGIN IMMEDIATE")
+        return self.store.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self.store.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+        finally:
+            self.store.lock.release()
+
+
+class SqliteProfiles:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, uid):
+        rows = self.store.query("SELECT data FROM profiles WHERE uid = ?", (uid,))
+        return loads(rows[0][0]) if rows else None
+
+    def get_many(self, uids):
+        uids = list(uids)
+        if not uids:
+            return {}
+        marks = ','.join('?' * len(uids))
+        rows = self.store.query(f"SELECT uid, data FROM profiles WHERE uid IN ({marks})", uids)
+        return {uid: loads(data) for uid, data in rows}
+
+    def find_by_username(self, username):
+        rows = self.store.query(
+            "SELECT p.uid, p.data FROM usernames u JOIN profiles p ON p.uid = u.uid WHERE u.username_lower = ?",
+            (username_key(username),))
+        return (rows[0][0], loads(rows[0][1])) if rows else (None, None)
+
+    def search_prefix(self, prefix, limit):
+        rows = self.store.query(
+            "SELECT uid, data FROM profiles WHERE username_lower >= ? AND username_lower < ? "
+            "ORDER BY username_lower LIMIT ?", (prefix, prefix + PREFIX_END, limit))
+        return [(uid, loads(data)) for uid, data in rows]
+
+    def scan(self, after=None, limit=500):
+        rows = self.store.query("SELECT uid, data FROM profiles WHERE uid > ? ORDER BY uid LIMIT ?",
+                                (after or '', limit))
+        return [(uid, loads(data)) for uid, data in rows]
+
+    @staticmethod
+    def _write(conn, uid, data):
+        conn.execute("INSERT OR REPLACE INTO profiles (uid, username, username_lower, data) VALUES (?, ?, ?, ?)",
+                     (uid, data.get('username'), data.get('username_lower'), dumps(data)))
+
+    def create(self, uid, data):
+        with self.store.transaction() as conn:
+            self._write(conn, uid, dict(with_username_key(data), created_at=now_utc()))
+
+    def update(self, uid, fields):
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT data FROM profiles WHERE uid = ?", (uid,)).fetchone()
+            data = loads(row[0]) if row else {}
+            data.update(with_username_key(fields))
+            self._write(conn, uid, data)
+
+
+class SqliteUsernames:
+    def __init__(self, store):
+        self.store = store
+
+    def lookup(self, key):
+        rows = self.store.query("SELECT uid FROM usernames WHERE username_lower = ?", (key,))
+        return rows[0][0] if rows else None
+
+    def reserve(self, key, uid):
+        with self.store.transaction() as conn:
+            conn.execute("INSERT OR IGNORE INTO usernames (username_lower, uid) VALUES (?, ?)", (key, uid))
+            row = conn.execute("SELECT uid FROM usernames WHERE username_lower = ?", (key,)).fetchone()
+        return row[0] == uid
+
+    def release(self, key, uid):
+        with self.store.transaction() as conn:
+            conn.execute("DELETE FROM usernames WHERE username_lower = ? AND uid = ?", (key, uid))
+
+
+class SqliteConversations:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, convo_id):
+        rows = self.store.query("SELECT data FROM conversations WHERE id = ?", (convo_id,))
+        return loads(rows[0][0]) if rows else None
+
+    def ensure(self, convo_id, participants):
+        data = {
+            'participants': list(participants),
+            'created_at': now_utc(),
+            'last_message_at': None,
+            'last_sender': None,
+            'message_count': 0,
+        }
+        with self.store.transaction() as conn:
+            cur = conn.execute("INSERT OR IGNORE INTO conversations (id, data) VALUES (?, ?)",
+                               (convo_id, dumps(data)))
+            if cur.rowcount:
+                conn.executemany("INSERT OR IGNORE INTO conversation_members (uid, convo_id) VALUES (?, ?)",
+                                 [(uid, convo_id) for uid in participants])
+
+    def mark_read(self, convo_id, uid, at=None):
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT data FROM conversations WHERE id = ?", (convo_id,)).fetchone()
+            if row:
+                data = loads(row[0])
+                data['unread'] = dict(data.get('unread') or {}, **{uid: 0})
+                data['last_read_at'] = dict(data.get('last_read_at') or {}, **{uid: at or now_utc()})
+                conn.execute("UPDATE conversations SET data = ? WHERE id = ?", (dumps(data), convo_id))
+
+    def set_summary(self, convo_id, fields):
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT data FROM conversations WHERE id = ?", (convo_id,)).fetchone()
+            if not row:
+                return
+            data = dict(loads(row[0]), **fields)
+            conn.execute("UPDATE conversations SET data = ? WHERE id = ?", (dumps(data), convo_id))
+            at = data.get('last_message_at')
+            conn.executemany(
+                "INSERT INTO conversation_members (uid, convo_id, last_activity) VALUES (?, ?, ?) "
+                "ON CONFLICT (uid, convo_id) DO UPDATE SET last_activity = excluded.last_activity",
+                [(uid, convo_id, to_micros(at) if at else -1) for uid in data.get('participants', [])])
+
+    def scan(self, after=None, limit=500):
+        rows = self.store.query("SELECT id, data FROM conversations WHERE id > ? ORDER BY id LIMIT ?",
+                                (after or '', limit))
+        return [(cid, loads(data)) for cid, data in rows]
+
+    def list_for_user(self, uid, limit, after=None):
+        params = [uid]
+        where = "m.uid = ?"
+        if after:
+            cursor = self.store.query(
+                "SELECT last_activity FROM conversation_members WHERE uid = ? AND convo_id = ?", (uid, after))
+            if cursor:
+                where += " AND (m.last_activity, m.convo_id) < (?, ?)"
+                params += [cursor[0][0], after]
+        rows = self.store.query(
+            f"SELECT c.id, c.data FROM conversation_members m JOIN conversations c ON c.id = m.convo_id "
+            f"WHERE {where} ORDER BY m.last_activity DESC, m.convo_id DESC LIMIT ?",
+            params + [limit + 1])
+        rows = [(cid, loads(data)) for cid, data in rows]
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1][0]
+        return rows, next_cursor
+
+    @staticmethod
+    def _bump(conn, convo_id, participants, sender_id, count, at, keys=None):
+        row = conn.execute("SELECT data FROM conversations WHERE id = ?", (convo_id,)).fetchone()
+        data = loads(row[0]) if row else {'created_at': at, 'message_count': 0}
+        data['participants'] = sorted(participants)
+        data['last_message_at'] = at
+        data['last_sender'] = sender_id
+        data['message_count'] = data.get('message_count', 0) + count
+        data['unread'], data['last_read_at'] = bump_unread(data, participants, sender_id, count, at)
+        if keys:
+            data['keys'] = dict(data.get('keys') or {}, **keys)
+        conn.execute("INSERT OR REPLACE INTO conversations (id, data) VALUES (?, ?)", (convo_id, dumps(data)))
+        conn.executemany(
+            "INSERT INTO conversation_members (uid, convo_id, last_activity) VALUES (?, ?, ?) "
+            "ON CONFLICT (uid, convo_id) DO UPDATE SET last_activity = excluded.last_activity",
+            [(uid, convo_id, to_micros(at)) for uid in participants])
+
+
+class SqliteMessages:
+    def __init__(self, store):
+        self.store = store
+        self.listeners = defaultdict(list)
+
+    @staticmethod
+    def _row_to_message(created_at, msg_id, data):
+        msg = loads(data)
+        msg['created_at'] = from_micros(created_at)
+        return (msg['created_at'], msg_id), msg_id, msg
+
+    def newest_first(self, convo_id, before, limit, now):
+        params = [convo_id, to_micros(now)]
+        where = "convo_id = ? AND (ephemeral = 0 OR expires_at > ?)"
+        if before:
+            where += " AND (created_at, id) < (?, ?)"
+            params += [to_micros(before[0]), before[1]]
+        rows = self.store.query(
+            f"SELECT created_at, id, data FROM messages WHERE {where} "
+            f"ORDER BY created_at DESC, id DESC LIMIT ?", params + [limit])
+        return [self._row_to_message(*row) for row in rows]
+
+    def oldest_first_after(self, convo_id, key, limit):
+        rows = self.store.query(
+            "SELECT created_at, id, data FROM messages WHERE convo_id = ? AND (created_at, id) > (?, ?) "
+            "ORDER BY created_at, id LIMIT ?", (convo_id, to_micros(key[0]), key[1], limit))
+        return [self._row_to_message(*row) for row in rows]
+
+    def summary(self, convo_id):
+        (count,), = self.store.query("SELECT COUNT(*) FROM messages WHERE convo_id = ?", (convo_id,))
+        rows = self.store.query("SELECT created_at, id, data FROM messages WHERE convo_id = ? "
+                                "ORDER BY created_at DESC, id DESC LIMIT 1", (convo_id,))
+        if not rows:
+            return {'last_message_at': None, 'last_sender': None, 'message_count': 0}
+        (created_at, _), _, msg = self._row_to_message(*rows[0])
+        return {'last_message_at': created_at, 'last_sender': msg.get('from'), 'message_count': count}
+
+    def add_batch(self, convo_id, participants, sender_id, messages, keys=None):
+        created_at = now_utc()
+        events = []
+        with self.store.transaction() as conn:
+            for msg_id, message in zip(batch_ids(len(messages)), messages):
+                expires = message.get('expiresAt')
+                body = {k: v for k, v in message.items() if k != 'created_at'}
+                conn.execute(
+                    "INSERT INTO messages (convo_id, id, created_at, ephemeral, expires_at, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (convo_id, msg_id, to_micros(created_at), int(bool(message.get('ephemeral'))),
+                     to_micros(expires) if expires else None, dumps(body)))
+                events.append(((created_at, msg_id), msg_id, dict(message, created_at=created_at)))
+            SqliteConversations._bump(conn, convo_id, participants, sender_id, len(messages), created_at, keys)
+            listeners = list(self.listeners.get(convo_id, ()))
+
+        # Only writes made by this process are observed (no cross-process notifications)
+        for callback in listeners:
+            callback(events)
+        return [(msg_id, created_at) for _, msg_id, _ in events]
+
+    def watch(self, convo_id, since, callback):
+        with self.store.lock:
+            self.listeners[convo_id].append(callback)
+
+        def unsubscribe():
+            with self.store.lock:
+                if callback in self.listeners.get(convo_id, ()):
+                    self.listeners[convo_id].remove(callback)
+        return unsubscribe
+
+    def expired(self, now, limit, after=None):
+        params = [to_micros(now)]
+        where = "expires_at IS NOT NULL AND expires_at <= ?"
+        if after:
+            expires_at, path = after
+            _, convo_id, _, msg_id = path.split('/')
+            where += " AND (expires_at, convo_id, id) > (?, ?, ?)"
+            params += [to_micros(expires_at), convo_id, msg_id]
+        rows = self.store.query(
+            f"SELECT expires_at, convo_id, id FROM messages WHERE {where} "
+            f"ORDER BY expires_at, convo_id, id LIMIT ?", params + [limit])
+        return [(from_micros(exp), _path(cid, mid)) for exp, cid, mid in rows]
+
+    def delete(self, paths):
+        per_convo = Counter()
+        with self.store.transaction() as conn:
+            for path in paths:
+                _, convo_id, _, msg_id = path.split('/')
+                cur = conn.execute("DELETE FROM messages WHERE convo_id = ? AND id = ?", (convo_id, msg_id))
+                per_convo[convo_id] += cur.rowcount
+            for convo_id, count in per_convo.items():
+                row = conn.execute("SELECT data FROM conversations WHERE id = ?", (convo_id,)).fetchone()
+                if row and count:
+                    data = loads(row[0])
+                    data['message_count'] = data.get('message_count', 0) - count
+                    conn.execute("UPDATE conversations SET data = ? WHERE id = ?", (dumps(data), convo_id))
+
+
+class SqliteArchives:
+    def __init__(self, store):
+        self.store = store
+
+    def add(self, convo_id, messages):
+        chunk = archive_chunk(messages)
+        chunk_id = archive_key(chunk['start_at'], chunk['start_id'])
+        with self.store.transaction() as conn:
+            conn.execute("INSERT INTO archives (convo_id, id, data) VALUES (?, ?, ?)",
+                         (convo_id, chunk_id, dumps(chunk)))
+            removed = conn.executemany("DELETE FROM messages WHERE convo_id = ? AND id = ?",
+                                       [(convo_id, msg_id) for _, msg_id, _ in messages]).rowcount
+            row = conn.execute("SELECT data FROM conversations WHERE id = ?", (convo_id,)).fetchone()
+            if row:
+                data = loads(row[0])
+                data['message_count'] = data.get('message_count', 0) - removed
+                data['archive_chunks'] = data.get('archive_chunks', 0) + 1
+                data['archived_until'] = chunk['end_at']
+                conn.execute("UPDATE conversations SET data = ? WHERE id = ?", (dumps(data), convo_id))
+        return chunk_id
+
+    def newest_first(self, convo_id, before, limit):
+        rows = self.store.query(
+            "SELECT id, data FROM archives WHERE convo_id = ? AND id < ? ORDER BY id DESC LIMIT ?",
+            (convo_id, archive_key(*before) if before else '~', limit))
+        return [dict(loads(data), id=chunk_id) for chunk_id, data in rows]
+
+
+class SqliteFriendships:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, uid):
+        return dict(self.store.query("SELECT other, state FROM friend_lists WHERE uid = ?", (uid,)))
+
+    def _apply(self, action, uid, other):
+        edge_id = friend_edge_id(uid, other)
+        with self.store.transaction() as conn:
+            row = conn.execute("SELECT data FROM friend_edges WHERE id = ?", (edge_id,)).fetchone()
+            edge = loads(row[0]) if row else None
+            new = friend_transition(edge, action, uid, other)
+            if new is not edge:
+                if new is None:
+                    conn.execute("DELETE FROM friend_edges WHERE id = ?", (edge_id,))
+                    conn.execute("DELETE FROM friend_lists WHERE (uid, other) IN ((?, ?), (?, ?))",
+                                 (uid, other, other, uid))
+                else:
+                    now = now_utc()
+                    new.setdefault('created_at', now)
+                    if new['status'] == 'accepted':
+                        new.setdefault('accepted_at', now)
+                    conn.execute("INSERT OR REPLACE INTO friend_edges (id, data) VALUES (?, ?)", (edge_id, dumps(new)))
+                    conn.executemany("INSERT OR REPLACE INTO friend_lists (uid, other, state) VALUES (?, ?, ?)",
+                                     [(user, peer, state) for user, (peer, state) in friend_states(new).items()])
+            row = conn.execute("SELECT state FROM friend_lists WHERE uid = ? AND other = ?", (uid, other)).fetchone()
+        return row[0] if row else None
+
+    def request(self, uid, other):
+        return self._apply('request', uid, other)
+
+    def accept(self, uid, other):
+        return self._apply('accept', uid, other)
+
+    def remove(self, uid, other):
+        return self._apply('remove', uid, other)
+
+
+class SqliteCalls:
+    def __init__(self, store):
+        self.store = store
+
+    def add(self, call_id, record):
+        with self.store.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO calls (id, caller, callee, created_at, data) VALUES (?, ?, ?, ?, ?)",
+                         (call_id, record['caller'], record['callee'], to_micros(record['created_at']),
+                          dumps(record)))
+
+    def recent(self, uid, limit):
+        rows = self.store.query(
+            "SELECT id, data FROM calls WHERE caller = ? OR callee = ? ORDER BY created_at DESC, id DESC LIMIT ?",
+            (uid, uid, limit))
+        return [dict(loads(data), id=call_id) for call_id, data in rows]
+
+
+class SqliteMeta:
+    def __init__(self, store):
+        self.store = store
+
+    def get(self, key):
+        rows = self.store.query("SELECT data FROM meta WHERE key = ?", (key,))
+        return loads(rows[0][0]) if rows else None
+
+    def set(self, key, data):
+        with self.store.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO meta (key, data) VALUES (?, ?)",
+                         (key, dumps(dict(data, updated_at=now_utc()))))
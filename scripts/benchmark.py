@@ -0,0 +1,453 @@
+"""
+Load benchmark for the hot request paths: inbox, chat history, send, login and typeahead.
+
+    python scripts/benchmark.py [--backend memory|sqlite] [--requests 200] [--concurrency 8]
+                                [--history-sizes 10,1000,100000] [--out results.json]
+                                [--compare baseline.json]
+
+Seeds synthetic users, conversations and an ephemeral/expired message mix
+into a local store, then drives the Flask app from several threads through
+the test client (no network, no real Firebase). Login goes through a stub
+Identity Toolkit on localhost that signs real RS256 tokens, so token
+verification is measured too.
+
+Writes one JSON document with p50/p95/p99 latency, requests per second,
+backend round trips per request and peak RSS for each scenario. Pass an
+earlier result with --compare to print the differences.
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import secrets
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+PROJECT_ID = "bench-project"
+PASSWORD = "bench-password"
+KEY_ID = "bench-key"
+SENDER_PUB = base64.b64encode(bytes(range(32))).decode()
+
+
+# 🔐 Stub Identity Toolkit: signs ID tokens and serves the matching cert
+class AuthStub:
+    def __init__(self):
+        import jwt
+        from cryptography import x509
+        from cryptography.hazmat.primitives import hashes, serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+        from cryptography.x509.oid import NameOID
+
+        self.jwt = jwt
+        self.key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "bench")])
+        now = datetime.now(timezone.utc)
+        cert = x509.CertificateBuilder() \
+            .subject_name(name).issuer_name(name) \
+            .public_key(self.key.public_key()) \
+            .serial_number(x509.random_serial_number()) \
+            .not_valid_before(now - timedelta(days=1)) \
+            .not_valid_after(now + timedelta(days=1)) \
+            .sign(self.key, hashes.SHA256())
+        self.certs = json.dumps({KEY_ID: cert.public_bytes(serialization.Encoding.PEM).decode()}).encode()
+        self.users = {}
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def sign(self, uid):
+        now = int(time.time())
+        claims = {
+            "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+            "aud": PROJECT_ID,
+            "sub": uid,
+            "iat": now,
+            "exp": now + 3600,
+            "auth_time": now,
+            "nonce": secrets.token_hex(8),
+        }
+        return self.jwt.encode(claims, self.key, algorithm="RS256", headers={"kid": KEY_ID})
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, body, headers=()):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                with stub.lock:
+                    stub.calls['certs'] += 1
+                self._reply(200, stub.certs, [("Cache-Control", "public, max-age=3600")])
+
+            def do_POST(self):
+                with stub.lock:
+                    stub.calls['sign_in'] += 1
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                uid = stub.users.get(body.get("email"))
+                if uid and body.get("password") == PASSWORD:
+                    reply = {"idToken": stub.sign(uid), "localId": uid}
+                    self._reply(200, json.dumps(reply).encode())
+                else:
+                    self._reply(400, json.dumps({"error": {"message": "INVALID_LOGIN_CREDENTIALS"}}).encode())
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+
+# 📊 Counts every repository call; one call is one backend round trip
+class CountingRepo:
+    def __init__(self, name, repo, calls):
+        self._name = name
+        self._repo = repo
+        self._calls = calls
+
+    def __getattr__(self, attr):
+        target = getattr(self._repo, attr)
+        if not callable(target):
+            return target
+        label = f"{self._name}.{attr}"
+
+        def counted(*args, **kwargs):
+            self._calls[label] += 1
+            return target(*args, **kwargs)
+        return counted
+
+
+class CountingStore:
+    def __init__(self, store):
+        self.inner = store
+        self.name = store.name
+        self.round_trips = Counter()
+        from app.storage.base import REPOSITORIES
+        for repo in REPOSITORIES:
+            setattr(self, repo, CountingRepo(repo, getattr(store, repo), self.round_trips))
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+# 🌱 Synthetic data
+def envelope(i, now_ms, ephemeral=False, expired=False):
+    data = {
+        "ciphertext": base64.b64encode(secrets.token_bytes(96)).decode(),
+        "nonce": base64.b64encode(secrets.token_bytes(24)).decode(),
+        "sender_pub": SENDER_PUB,
+        "scheme": "nacl-secretbox-x25519",
+    }
+    if ephemeral:
+        data["ephemeral"] = True
+        data["expiresAt"] = now_ms - 60_000 if expired else now_ms + 3_600_000
+    return data
+
+
+def seed(store, auth_stub, args):
+    from app.services.conversation_service import conversation_id
+    from app.services.message_service import build_message
+
+    rng = random.Random(args.seed)
+    now_ms = time.time() * 1000
+
+    def add_user(uid):
+        email = f"{uid}@bench.local"
+        store.profiles.create(uid, {
+            'email': email, 'username': uid, 'display_name': uid, 'photo_url': '',
+            'public_key': secrets.token_urlsafe(32), 'public_key_format': 'curve25519_base64'
+        })
+        store.usernames.reserve(uid.lower(), uid)
+        auth_stub.users[email] = uid
+
+    def fill(me, other, count):
+        convo_id = conversation_id(me, other)
+        participants = [me, other]
+        store.conversations.ensure(convo_id, participants)
+        for start in range(0, count, args.seed_batch):
+            batch = []
+            for i in range(start, min(count, start + args.seed_batch)):
+                roll = rng.random()
+                ephemeral = roll < args.ephemeral_ratio
+                expired = ephemeral and roll < args.ephemeral_ratio * args.expired_ratio
+                batch.append(build_message(envelope(i, now_ms, ephemeral, expired), rng.choice(participants)))
+            store.messages.add_batch(convo_id, participants, me, batch)
+
+    started = time.perf_counter()
+    add_user("bench-me")
+    for n in range(args.users):
+        add_user(f"bench-user-{n:05d}")
+
+    # Inbox: the benchmark user talks to `--conversations` people
+    for n in range(min(args.conversations, args.users)):
+        fill("bench-me", f"bench-user-{n:05d}", args.messages_per_conversation)
+
+    # Chat history: one dedicated peer per thread size
+    peers = {}
+    for size in args.history_sizes:
+        peer = f"bench-peer-{size}"
+        add_user(peer)
+        fill("bench-me", peer, size)
+        peers[size] = peer
+
+    add_user("bench-send-peer")
+    return {
+        'seconds': round(time.perf_counter() - started, 2),
+        'users': args.users + len(peers) + 2,
+        'peers': peers,
+    }
+
+
+# 🏃 Load driver
+def login(client, uid):
+    with client.session_transaction() as sess:
+        sess['user_id'] = uid
+        sess['csrf_token'] = 'bench-csrf'
+
+
+def run_scenario(app, store, auth_stub, name, fn, args, expect=(200,), logged_in=True):
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+            if logged_in:
+                login(local.client, "bench-me")
+        return local.client
+
+    def one(i):
+        c = client()
+        started = time.perf_counter()
+        response = fn(c, i)
+        elapsed = time.perf_counter() - started
+        response.close()
+        return elapsed, response.status_code in expect
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(one, range(args.warmup)))
+
+        store.round_trips.clear()
+        auth_before = Counter(auth_stub.calls)
+        started = time.perf_counter()
+        results = list(pool.map(one, range(args.requests)))
+        wall = time.perf_counter() - started
+
+    latencies = sorted(r[0] * 1000 for r in results)
+    count = len(results)
+    round_trips = dict(store.round_trips)
+    for call, n in (auth_stub.calls - auth_before).items():
+        round_trips[f"identity_toolkit.{call}"] = n
+
+    return {
+        'requests': count,
+        'errors': sum(1 for r in results if not r[1]),
+        'concurrency': args.concurrency,
+        'rps': round(count / wall, 1) if wall else None,
+        'p50_ms': round(percentile(latencies, 50), 2),
+        'p95_ms': round(percentile(latencies, 95), 2),
+        'p99_ms': round(percentile(latencies, 99), 2),
+        'max_ms': round(latencies[-1], 2),
+        'round_trips_per_request': round(sum(round_trips.values()) / count, 2),
+        'round_trips': {k: round(v / count, 3) for k, v in sorted(round_trips.items())},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def revalidate(path):
+    """GET that replays the last ETag this client saw, like a browser reload."""
+    def fn(client, i):
+        response = client.get(path, headers={'If-None-Match': getattr(client, 'etag', None) or '*none*'})
+        client.etag = response.headers.get('ETag') or getattr(client, 'etag', None)
+        return response
+    return fn
+
+
+def scenarios(seeded):
+    headers = {'X-CSRF-Token': 'bench-csrf'}
+    now_ms = time.time() * 1000
+
+    yield 'inbox', dict(fn=lambda c, i: c.get('/inbox'))
+    yield 'inbox_revalidate', dict(fn=revalidate('/inbox'), expect=(200, 304))
+    for size, peer in seeded['peers'].items():
+        yield f'chat_history_{size}', dict(fn=lambda c, i, peer=peer: c.get(f'/auth/chat/{peer}'))
+        yield f'chat_revalidate_{size}', dict(fn=revalidate(f'/auth/chat/{peer}'), expect=(200, 304))
+        yield f'history_api_{size}', dict(fn=lambda c, i, peer=peer: c.get(f'/auth/chat/{peer}/history',
+                                                                           query_string={'limit': 200}))
+    yield 'username_typeahead', dict(fn=lambda c, i: c.get('/inbox/search', query_string={
+        'q': f"bench-user-{i % 50:02d}"[:12 + i % 4], 'limit': 8}))
+    yield 'chat_send', dict(fn=lambda c, i: c.post('/auth/chat/bench-send-peer', json=envelope(i, now_ms),
+                                                   headers=headers))
+    yield 'login', dict(
+        fn=lambda c, i: c.post('/auth/login', data={
+            'email': f"bench-user-{i % 50:05d}@bench.local", 'password': PASSWORD
+        }),
+        expect=(302,), logged_in=False)
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result, baseline):
+    """Print per-scenario changes against an earlier run."""
+    print(f"\nvs {baseline['meta'].get('commit')} ({baseline['meta'].get('backend')})", file=sys.stderr)
+    print(f"{'scenario':<22}{'p50 ms':>18}{'p95 ms':>18}{'rps':>18}{'trips/req':>14}", file=sys.stderr)
+    for name, now in result['scenarios'].items():
+        before = baseline['scenarios'].get(name)
+        if not before:
+            print(f"{name:<22}{'(new)':>18}", file=sys.stderr)
+            continue
+
+        def cell(key, width=18):
+            old, new = before.get(key), now.get(key)
+            if not old or new is None:
+                return f"{new!s:>{width}}"
+            return f"{new} ({(new - old) / old:+.0%})".rjust(width)
+        print(f"{name:<22}{cell('p50_ms')}{cell('p95_ms')}{cell('rps')}{cell('round_trips_per_request', 14)}",
+              file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--sqlite-path", help="SQLite file (default: a temporary file)")
+    parser.add_argument("--requests", type=int, default=200, help="measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--conversations", type=int, default=200, help="conversations in the inbox")
+    parser.add_argument("--messages-per-conversation", type=int, default=3)
+    parser.add_argument("--history-sizes", default="10,1000,100000",
+                        type=lambda s: [int(x) for x in s.split(',') if x])
+    parser.add_argument("--ephemeral-ratio", type=float, default=0.2)
+    parser.add_argument("--expired-ratio", type=float, default=0.5, help="share of ephemeral messages already expired")
+    parser.add_argument("--seed-batch", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--archive", action="store_true",
+                        help="compact all seeded history into archive chunks before measuring")
+    parser.add_argument("--only", help="comma separated scenario names to run")
+    parser.add_argument("--out", help="write JSON here instead of stdout")
+    parser.add_argument("--compare", help="earlier JSON result to diff against")
+    args = parser.parse_args()
+
+    auth_stub = AuthStub().start()
+
+    # Everything below must be configured before the app modules are imported
+    os.environ["IDENTITY_TOOLKIT_URL"] = f"{auth_stub.url}/v1"
+    os.environ["SECURETOKEN_CERTS_URL"] = f"{auth_stub.url}/certs"
+    os.environ["FIREBASE_PROJECT_ID"] = PROJECT_ID
+    os.environ.setdefault("FIREBASE_WEB_API_KEY", "bench")
+    os.environ.setdefault("SECRET_KEY", "bench")
+    # A fixed deploy id so ETags (and the *_revalidate scenarios) are on
+    os.environ.setdefault("APP_BUILD_ID", "bench")
+
+    from app import create_app
+    from app.storage import build_store, read_stats, set_store
+
+    tmpdir = None
+    if args.backend == 'sqlite' and not args.sqlite_path:
+        tmpdir = tempfile.TemporaryDirectory()
+        args.sqlite_path = os.path.join(tmpdir.name, "bench.db")
+    if args.sqlite_path:
+        os.environ["STORAGE_SQLITE_PATH"] = args.sqlite_path
+
+    store = CountingStore(build_store(args.backend))
+    set_store(store)
+    app = create_app()
+    app.logger.disabled = True
+
+    seeded = seed(store.inner, auth_stub, args)
+    print(f"seeded in {seeded['seconds']}s, peak RSS {peak_rss_mb()} MB", file=sys.stderr)
+    if args.archive:
+        from app.services.archiver import ARCHIVE_AFTER_DAYS, compact_archives
+        future = datetime.now(timezone.utc) + timedelta(days=ARCHIVE_AFTER_DAYS + 1)
+        seeded['archive'] = compact_archives(store.inner, now=future, resume=False)
+        print(f"archived {seeded['archive']['messages']} messages into {seeded['archive']['chunks']} chunks "
+              f"in {seeded['archive']['elapsed_seconds']}s", file=sys.stderr)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    for name, spec in scenarios(seeded):
+        if only and name not in only:
+            continue
+        results[name] = run_scenario(app, store, auth_stub, name, args=args, **spec)
+        r = results[name]
+        print(f"{name:<22} p50 {r['p50_ms']:>8} ms  p95 {r['p95_ms']:>8} ms  {r['rps']:>8} req/s  "
+              f"{r['round_trips_per_request']} trips/req  errors {r['errors']}", file=sys.stderr)
+
+    auth_stub.stop()
+    output = {
+        'meta': {
+            'commit': git_commit(),
+            'backend': args.backend,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'params': {k: v for k, v in vars(args).items() if k not in ('out', 'compare')},
+            'seed_seconds': seeded['seconds'],
+            'archive': seeded.get('archive'),
+            'read_stats': dict(read_stats),
+        },
+        'scenarios': results,
+    }
+
+    text = json.dumps(output, indent=2)
+    if args.out:
+        with open(args.out, 'w') as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(output, json.load(f))
+    if tmpdir:
+        tmpdir.cleanup()
+    return 1 if any(r['errors'] for r in results.values()) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,261 @@
+"""
+Simulated WebRTC peers for the call signaling service.
+
+    python scripts/call_sim.py [--pairs 20] [--calls 5] [--transport poll|sse]
+                               [--candidates 4] [--decline-ratio 0.1] [--backend memory|sqlite]
+
+Each pair is a caller and a callee thread driving the Flask app through the
+test client, exactly like two browsers would: the caller posts an offer and
+trickles candidates, the callee picks the ring up from its event stream,
+answers and trickles its own, then the caller hangs up. SDP and candidates
+are fake strings; the server treats them as opaque anyway.
+
+Prints call setup time (offer posted -> answer received by the caller),
+outcomes and backend round trips per call as JSON.
+"""
+import argparse
+import json
+import os
+import queue
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmark import CountingStore, login, peak_rss_mb, percentile  # noqa: E402
+
+HEADERS = {'X-CSRF-Token': 'bench-csrf'}
+
+
+def fake_sdp(kind, uid):
+    return {'type': kind, 'sdp': f"v=0\r\no=- {random.getrandbits(48)} 2 IN IP4 127.0.0.1\r\ns={uid}\r\n" + "a=x\r\n" * 40}
+
+
+def fake_candidates(n):
+    return [{'candidate': f"candidate:{i} 1 udp {2122260223 - i} 10.0.0.{i + 1} {50000 + i} typ host",
+             'sdpMid': '0', 'sdpMLineIndex': 0} for i in range(n)]
+
+
+# 📡 Event sources: long-poll requests, or one SSE response read incrementally
+class PollEvents:
+    def __init__(self, client):
+        self.client = client
+        self.cursor = None
+        self.pending = []
+
+    def next(self, timeout):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            response = self.client.get('/calls/poll', query_string={
+                'after': self.cursor or '', 'timeout': round(max(deadline - time.monotonic(), 0), 3)})
+            body = response.get_json()
+            self.cursor = body['cursor']
+            if body['events']:
+                return body['events']
+        return []
+
+    def close(self):
+        pass
+
+
+class SseEvents:
+    def __init__(self, client):
+        self.response = client.get('/calls/events', buffered=False)
+        self.events = queue.Queue()
+        self.pending = []
+        self.closed = False
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        buffer = ''
+        try:
+            for chunk in self.response.response:
+                if self.closed:
+                    break
+                buffer += chunk.decode() if isinstance(chunk, bytes) else chunk
+                while '\n\n' in buffer:
+                    frame, buffer = buffer.split('\n\n', 1)
+                    data = [line[6:] for line in frame.split('\n') if line.startswith('data: ')]
+                    if data:
+                        self.events.put(json.loads(data[0]))
+        except Exception:
+            pass
+        # Closed from this thread: the stream generator can't be closed while another thread runs it
+        self.response.close()
+
+    def next(self, timeout):
+        try:
+            first = self.events.get(timeout=timeout)
+        except queue.Empty:
+            return []
+        events = [first]
+        while not self.events.empty():
+            events.append(self.events.get_nowait())
+        return events
+
+    def close(self):
+        self.closed = True
+
+
+def wait_for(source, call_id, types, timeout=10):
+    """Read events until one of `types` for `call_id` arrives; returns it and everything seen before."""
+    seen = []
+    deadline = time.monotonic() + timeout
+    while source.pending or time.monotonic() < deadline:
+        if not source.pending:
+            source.pending.extend(source.next(deadline - time.monotonic()))
+        while source.pending:
+            event = source.pending.pop(0)
+            seen.append(event)
+            if event['type'] in types and (call_id is None or event['call_id'] == call_id):
+                return event, seen
+    raise TimeoutError(f"no {types} event for {call_id}")
+
+
+# 🎭 The two peers
+def callee_loop(app, uid, args, rng, stats, stop):
+    client = app.test_client()
+    login(client, uid)
+    source = (SseEvents if args.transport == 'sse' else PollEvents)(client)
+    try:
+        while not stop.is_set():
+            try:
+                ring, _ = wait_for(source, None, ('ring',), timeout=1)
+            except TimeoutError:
+                continue
+            call_id = ring['call_id']
+            if rng.random() < args.decline_ratio:
+                client.post(f'/calls/{call_id}/hangup', headers=HEADERS)
+                continue
+            client.post(f'/calls/{call_id}/candidates', json={'candidates': fake_candidates(args.candidates)},
+                        headers=HEADERS)
+            response = client.post(f'/calls/{call_id}/answer', json={'answer': fake_sdp('answer', uid)},
+                                   headers=HEADERS)
+            if response.status_code != 200:
+                stats['errors'] += 1
+                continue
+            hangup, seen = wait_for(source, call_id, ('hangup',), timeout=30)
+            stats['callee_candidates_received'] += sum(len(e['candidates']) for e in seen
+                                                       if e['type'] == 'candidates' and e['call_id'] == call_id)
+    finally:
+        source.close()
+
+
+def caller_loop(app, uid, callee, args, stats, setups):
+    client = app.test_client()
+    login(client, uid)
+    source = (SseEvents if args.transport == 'sse' else PollEvents)(client)
+    try:
+        for _ in range(args.calls):
+            started = time.perf_counter()
+            response = client.post('/calls', json={'to': callee, 'kind': args.kind, 'offer': fake_sdp('offer', uid)},
+                                   headers=HEADERS)
+            if response.status_code != 201:
+                stats['errors'] += 1
+                continue
+            call_id = response.get_json()['call_id']
+            client.post(f'/calls/{call_id}/candidates', json={'candidates': fake_candidates(args.candidates)},
+                        headers=HEADERS)
+            event, seen = wait_for(source, call_id, ('answer', 'hangup'))
+            if event['type'] == 'hangup':
+                stats[event['outcome']] += 1
+                continue
+            setups.append((time.perf_counter() - started) * 1000)
+            time.sleep(args.hold_ms / 1000)
+            client.post(f'/calls/{call_id}/hangup', headers=HEADERS)
+            event, more = wait_for(source, call_id, ('hangup',))
+            stats[event['outcome']] += 1
+            stats['caller_candidates_received'] += sum(len(e['candidates']) for e in seen + more
+                                                       if e['type'] == 'candidates' and e['call_id'] == call_id)
+    finally:
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--backend", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--pairs", type=int, default=20)
+    parser.add_argument("--calls", type=int, default=5, help="calls per pair")
+    parser.add_argument("--transport", choices=("poll", "sse"), default="poll")
+    parser.add_argument("--kind", choices=("audio", "video"), default="video")
+    parser.add_argument("--candidates", type=int, default=4, help="ICE candidates trickled by each side")
+    parser.add_argument("--decline-ratio", type=float, default=0.1)
+    parser.add_argument("--hold-ms", type=float, default=20, help="how long each answered call lasts")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ.setdefault("FIREBASE_WEB_API_KEY", "sim")
+    os.environ.setdefault("SECRET_KEY", "sim")
+
+    from app import create_app
+    from app.storage import build_store, set_store
+
+    tmpdir = None
+    if args.backend == 'sqlite':
+        tmpdir = tempfile.TemporaryDirectory()
+        os.environ["STORAGE_SQLITE_PATH"] = os.path.join(tmpdir.name, "calls.db")
+
+    store = CountingStore(build_store(args.backend))
+    set_store(store)
+    app = create_app()
+    app.logger.disabled = True
+
+    pairs = [(f"sim-caller-{n:03d}", f"sim-callee-{n:03d}") for n in range(args.pairs)]
+    for uid in (uid for pair in pairs for uid in pair):
+        store.inner.profiles.create(uid, {'username': uid, 'display_name': uid, 'photo_url': ''})
+    # Only friends (or people who have chatted) may call each other
+    for caller, callee in pairs:
+        store.inner.friendships.request(caller, callee)
+        store.inner.friendships.accept(callee, caller)
+
+    stats, setups, stop = Counter(), [], threading.Event()
+    rng = random.Random(args.seed)
+    callees = [threading.Thread(target=callee_loop, args=(app, callee, args, random.Random(rng.random()), stats, stop))
+               for _, callee in pairs]
+    callers = [threading.Thread(target=caller_loop, args=(app, caller, callee, args, stats, setups))
+               for caller, callee in pairs]
+    for t in callees:
+        t.start()
+    time.sleep(0.2)  # let every callee open its event stream
+
+    store.round_trips.clear()
+    started = time.perf_counter()
+    for t in callers:
+        t.start()
+    for t in callers:
+        t.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    for t in callees:
+        t.join()
+
+    from app.services import video_service
+    setups.sort()
+    placed = args.pairs * args.calls
+    output = {
+        'params': vars(args),
+        'calls': placed,
+        'outcomes': {k: v for k, v in stats.items() if k in ('completed', 'declined', 'missed', 'cancelled', 'dropped')},
+        'errors': stats['errors'],
+        'setup_p50_ms': round(percentile(setups, 50), 2) if setups else None,
+        'setup_p95_ms': round(percentile(setups, 95), 2) if setups else None,
+        'setup_p99_ms': round(percentile(setups, 99), 2) if setups else None,
+        'candidates_relayed': stats['caller_candidates_received'] + stats['callee_candidates_received'],
+        'calls_per_second': round(placed / wall, 1),
+        'round_trips_per_call': {k: round(v / placed, 3) for k, v in sorted(store.round_trips.items())},
+        'live_after': video_service.stats(),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    print(json.dumps(output, indent=2))
+    if tmpdir:
+        tmpdir.cleanup()
+    return 1 if stats['errors'] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
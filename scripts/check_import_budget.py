@@ -0,0 +1,59 @@
+"""
+Cold-start budget check: building the app must stay under a time budget and
+must not construct any Firebase/Cloudinary client.
+
+    python scripts/check_import_budget.py [--budget-ms 1500] [--runs 3]
+
+Each run happens in a fresh interpreter so module caches don't hide the cost.
+Exits non-zero when the budget is exceeded, so it can gate CI.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, time
+t0 = time.perf_counter()
+from app import create_app
+app = create_app()
+elapsed = (time.perf_counter() - t0) * 1000
+from app import firebase
+print(json.dumps({"ms": elapsed, "services": sorted(firebase._services)}))
+"""
+
+
+def probe():
+    env = dict(os.environ)
+    env.setdefault("FIREBASE_WEB_API_KEY", "import-budget-check")
+    out = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 1500)))
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    results = [probe() for _ in range(args.runs)]
+    best = min(r["ms"] for r in results)
+    built = sorted({s for r in results for s in r["services"]})
+
+    print(f"create_app(): best {best:.0f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    if built:
+        print(f"FAIL: clients built at import time: {', '.join(built)}")
+        return 1
+    if best > args.budget_ms:
+        print("FAIL: over budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())